@@ -367,47 +367,44 @@ def get_rate_lookup_cdf(
 
     bins = np.arange(binsize, 1.0+binsize, binsize)
 
-    true_prob = []
-    false_prob = []
-    all_prob = []
-
-    for cell_id in mapping:
-        is_true = (mapping[cell_id][level]['assignment']
-                   == truth[cell_id][level])
-
-        prob = 1.0
-        for l in taxonomy_tree.hierarchy:
-            prob *= mapping[cell_id][l]['bootstrapping_probability']
-            if l == level:
-                break
-        if is_true:
-            true_prob.append(prob)
-        else:
-            false_prob.append(prob)
-        all_prob.append(prob)
-
-    true_prob = np.array(true_prob)
-    false_prob = np.array(false_prob)
-    all_prob = np.array(all_prob)
-
-    expected = []
-    actual = []
-    used_bins = []
-    for b in bins:
-        expected_mask = (all_prob<=b)
-        this_true = (true_prob<=b).sum()
-        this_false = (false_prob<=b).sum()
-
-        if len(expected_mask) == 0:
-            continue
-        if this_true+this_false == 0:
-            continue
-
-        used_bins.append(b)
-        expected.append(all_prob[expected_mask].sum()/expected_mask.sum())
-        denom = max(1, this_true+this_false)
-        actual.append(this_true/denom)
-    return np.array(used_bins), np.array(expected), np.array(actual)
+    hierarchy = taxonomy_tree.hierarchy
+    levels = hierarchy[:hierarchy.index(level)+1]
+
+    cell_id_list = list(mapping.keys())
+    n_cells = len(cell_id_list)
+
+    # (n_cells, n_levels) array of bootstrapping probabilities
+    # down to (and including) level
+    prob_matrix = np.zeros((n_cells, len(levels)), dtype=float)
+    for i_level, l in enumerate(levels):
+        prob_matrix[:, i_level] = np.fromiter(
+            (mapping[cell_id][l]['bootstrapping_probability']
+             for cell_id in cell_id_list),
+            dtype=float,
+            count=n_cells)
+
+    is_true = np.fromiter(
+        (mapping[cell_id][level]['assignment'] == truth[cell_id][level]
+         for cell_id in cell_id_list),
+        dtype=bool,
+        count=n_cells)
+
+    all_prob = np.cumprod(prob_matrix, axis=1)[:, -1]
+    true_prob = all_prob[is_true]
+
+    # number of cells (all and correctly assigned) with
+    # probability <= each bin, and the summed probability
+    # of those cells, from one sort of each array
+    sorted_prob = np.sort(all_prob)
+    all_ct = np.searchsorted(sorted_prob, bins, side='right')
+    true_ct = np.searchsorted(np.sort(true_prob), bins, side='right')
+    cum_prob = np.concatenate([[0.0], np.cumsum(sorted_prob)])
+
+    valid = (all_ct > 0)
+    used_bins = bins[valid]
+    expected = cum_prob[all_ct[valid]]/all_ct[valid]
+    actual = true_ct[valid]/all_ct[valid]
+    return used_bins, expected, actual
 
 
 
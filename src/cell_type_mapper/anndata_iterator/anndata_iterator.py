@@ -5,6 +5,7 @@ import os
 import pathlib
 import scipy.sparse
 import tempfile
+import threading
 import time
 
 from cell_type_mapper.utils.utils import (
@@ -15,27 +16,56 @@ from cell_type_mapper.utils.csc_to_csr import (
     csc_to_csr_on_disk)
 
 from cell_type_mapper.utils.sparse_utils import (
-    load_csr,
+    _csr_to_dense,
     _load_disjoint_csr)
 
+from cell_type_mapper.utils.multiprocessing_utils import (
+    DummyLock)
+
 
 class h5_handler_manager():
-    def __init__(self, h5_path, mode='r', keepopen=True):
+    """
+    Manage an h5py.File handle that is either kept open for the
+    lifetime of this object or opened anew on every __enter__.
+
+    file_kwargs are passed through to h5py.File (e.g. to configure
+    the raw data chunk cache with rdcc_nbytes, rdcc_nslots, rdcc_w0)
+
+    If sequential is True, the kernel is advised (via
+    posix_fadvise, where available) that the file will be read
+    sequentially, which enlarges its readahead window.
+    """
+    def __init__(
+            self,
+            h5_path,
+            mode='r',
+            keepopen=True,
+            file_kwargs=None,
+            sequential=False):
         self.keepopen = keepopen
         self.h5_path = h5_path
         self.mode = mode
         self.h5_handle = None
+        if file_kwargs is None:
+            file_kwargs = dict()
+        self.file_kwargs = file_kwargs
+        self.sequential = sequential
         if keepopen:
-            self.h5_handle = h5py.File(h5_path,
-                                       mode,
-                                       swmr=True)
+            self.h5_handle = self._open()
+
+    def _open(self):
+        h5_handle = h5py.File(
+            self.h5_path,
+            self.mode,
+            swmr=True,
+            **self.file_kwargs)
+        if self.sequential:
+            _advise_sequential(h5_handle)
+        return h5_handle
 
     def __enter__(self):
         if not self.keepopen:
-            self.h5_handle = h5py.File(
-                self.h5_path,
-                self.mode,
-                swmr=True)
+            self.h5_handle = self._open()
         return self.h5_handle
 
     def __exit__(self, exc_type, exc_value, exc_traceback):
@@ -48,6 +78,107 @@ class h5_handler_manager():
             self.h5_handle = None
 
 
+def _advise_sequential(h5_handle):
+    """
+    Tell the kernel that the file underlying h5_handle will be
+    read sequentially. Readahead state is kept per open file
+    description, so the advice is given on h5py's own file
+    descriptor. This is only a hint; platforms or HDF5 drivers
+    that do not expose a file descriptor are silently skipped.
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        fd = h5_handle.id.get_vfd_handle()
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+    except Exception:
+        pass
+
+
+class CSRTranscriptionAborted(Exception):
+    """
+    Raised in the thread writing a CSR file when the transcription
+    has been aborted (see CSRTranscriptionProgress.abort)
+    """
+    pass
+
+
+class CSRTranscriptionProgress(object):
+    """
+    Track the progress of a CSC-to-CSR transcription that is
+    running in a background thread so that a CSRRowIterator
+    reading the CSR file can block until the rows it needs
+    have been written.
+
+    The transcription writes rows in order, so progress is
+    a single watermark: the number of rows complete on disk.
+    No reads are allowed until the first update (which marks
+    the CSR file, including its indptr, as created), even if
+    zero rows are requested.
+
+    lock must be held whenever the CSR file is open (by either
+    the writing or the reading thread).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._condition = threading.Condition()
+        self._n_rows_done = 0
+        self._started = False
+        self._done = False
+        self._aborted = False
+        self._error = None
+
+    @property
+    def done(self):
+        return self._done
+
+    def update(self, n_rows_done):
+        """
+        Record that the first n_rows_done rows are on disk
+
+        Raises CSRTranscriptionAborted if abort() has been called,
+        so that the writing thread stops at the next band of rows.
+        """
+        with self._condition:
+            if self._aborted:
+                raise CSRTranscriptionAborted()
+            self._started = True
+            self._n_rows_done = max(self._n_rows_done, n_rows_done)
+            self._condition.notify_all()
+
+    def abort(self):
+        """
+        Ask the writing thread to stop (the next call to update
+        will raise CSRTranscriptionAborted)
+        """
+        with self._condition:
+            self._aborted = True
+
+    def finish(self, error=None):
+        """
+        Record that the transcription has stopped (error is the
+        exception that stopped it, if any)
+        """
+        with self._condition:
+            self._done = True
+            self._error = error
+            self._condition.notify_all()
+
+    def wait_for(self, n_rows):
+        """
+        Block until the first n_rows rows are on disk
+        """
+        with self._condition:
+            while not self._done and (
+                    not self._started or self._n_rows_done < n_rows):
+                self._condition.wait()
+            if self._error is not None:
+                raise RuntimeError(
+                    "CSC to CSR transcription failed"
+                ) from self._error
+
+
 class AnnDataRowIterator(object):
     """
     A class to efficiently iterate over the rows of an anndata
@@ -67,13 +198,24 @@ class AnnDataRowIterator(object):
     tmp_dir:
         Optional scratch directory. This is where a hypothetical
         CSC file will be written as a CSR file. If None, the
-        CSC file will be iterated over using anndata's infrastructure
-        (which can be very slow)
+        system's default temporary directory is used.
     log:
         an optional CommandLog for tracking warnings during CLI runs
     max_gb:
         maximum number of gigabytes to use (approximate) when converting
         CSC matrix to CSR (if necessary)
+    keep_open:
+        boolean indicating whether or not to leave the h5 handle
+        open (should be false when using cuda)
+    background_transcription:
+        If True, a CSC file is transcribed to CSR in a background
+        thread and rows can be read as soon as they are on disk.
+        Only use this if the iterator will never be pickled and
+        the process will not fork while the transcription is running
+        (a forked child can inherit HDF5's locks while the writing
+        thread holds them, and a copy of the iterator cannot follow
+        the writer's progress). If False, the whole file is
+        transcribed before the constructor returns.
     """
 
     def __init__(
@@ -84,7 +226,8 @@ class AnnDataRowIterator(object):
             tmp_dir=None,
             log=None,
             max_gb=10,
-            keep_open=True):
+            keep_open=True,
+            background_transcription=False):
 
         if layer == 'X':
             self._layer = layer
@@ -93,12 +236,16 @@ class AnnDataRowIterator(object):
 
         self.log = log
         self.tmp_dir = None
+        self._transcription_thread = None
+        self._transcription_progress = None
         self.max_gb = max_gb
         h5ad_path = pathlib.Path(h5ad_path)
         if not h5ad_path.is_file():
             raise RuntimeError(
                 f"{h5ad_path} is not a file")
 
+        # read everything needed to dispatch on the encoding type
+        # with a single open of the file
         with h5py.File(h5ad_path, 'r', swmr=True) as in_file:
             attrs = dict(in_file[self.layer].attrs)
             array_shape = None
@@ -107,6 +254,8 @@ class AnnDataRowIterator(object):
                 array_shape = attrs['shape']
             if 'encoding-type' in attrs:
                 encoding_type = attrs['encoding-type']
+            if encoding_type.startswith('array'):
+                array_shape = in_file[self.layer].shape
 
         if encoding_type.startswith('csr') and array_shape is not None:
             self._iterator_type = 'CSRRow'
@@ -122,11 +271,11 @@ class AnnDataRowIterator(object):
                 h5ad_path=h5ad_path,
                 row_chunk_size=row_chunk_size,
                 tmp_dir=tmp_dir,
-                keep_open=keep_open)
+                keep_open=keep_open,
+                attrs=attrs,
+                background_transcription=background_transcription)
         elif encoding_type.startswith('array'):
             self._iterator_type = "dense"
-            with h5py.File(h5ad_path, "r", swmr=True) as src:
-                array_shape = src[self.layer].shape
             self.n_rows = array_shape[0]
             self._chunk_iterator = DenseArrayRowIterator(
                   h5_path=h5ad_path,
@@ -143,7 +292,26 @@ class AnnDataRowIterator(object):
     def layer(self):
         return self._layer
 
+    @property
+    def is_csr(self):
+        """
+        True if rows are read from CSR-encoded data (so that
+        get_chunk(sparse=True) does not need to
+        convert anything)
+        """
+        return self._iterator_type == 'CSRRow'
+
     def __del__(self):
+        if self._transcription_thread is not None:
+            # nothing will read the remaining rows; stop the writer
+            # (this still blocks until it finishes its current band
+            # of rows, so that the scratch file is closed before it
+            # is deleted)
+            self._transcription_progress.abort()
+            # (a thread cannot join itself; if this is running on the
+            # writer thread, the transcription has already returned)
+            if threading.current_thread() is not self._transcription_thread:
+                self._transcription_thread.join()
         if self.tmp_dir is not None:
             _clean_up(self.tmp_dir)
 
@@ -165,12 +333,15 @@ class AnnDataRowIterator(object):
         result = next(self._chunk_iterator)
         return result
 
-    def get_chunk(self, r0, r1):
+    def get_chunk(self, r0, r1, sparse=False):
         """
         Returns the tuple (data[r0:r1, :], r0, r1)
+
+        If sparse is True, data[r0:r1, :] is returned as a CSR
+        matrix. Otherwise, it is returned as a dense array.
         """
         return self._chunk_iterator.get_chunk(
-            r0=r0, r1=r1)
+            r0=r0, r1=r1, sparse=sparse)
 
     def get_batch(self, row_idx, sparse=False):
         """
@@ -189,7 +360,9 @@ class AnnDataRowIterator(object):
             h5ad_path,
             row_chunk_size,
             tmp_dir=None,
-            keep_open=True):
+            keep_open=True,
+            attrs=None,
+            background_transcription=False):
         """
         Initialize iterator for CSC data. If possible,
         write out data to scratch space as CSR matrix
@@ -203,11 +376,18 @@ class AnnDataRowIterator(object):
             Number of rows to deliver per chunk
         tmp_dir:
             scratch dir in which to write the CSR form of the data
-            (if None, no CSR data will be written and we will just
-            use anndata.chunked_X to iterate over the data)
+            (if None, the system's default temporary directory
+            is used)
         keep_open:
             boolean indicating whether or not to leave the h5 handle
             open (should be false when using cuda)
+        attrs:
+            the attrs of the data's HDF5 group, if they have
+            already been read (otherwise they are read from
+            h5ad_path)
+        background_transcription:
+            if True, transcribe to CSR in a background thread
+            (see the AnnDataRowIterator docstring)
         """
         write_as_csr = True
         self.tmp_dir = tempfile.mkdtemp(
@@ -225,8 +405,9 @@ class AnnDataRowIterator(object):
         if free_bytes < fudge_factor*file_size_bytes:
             write_as_csr = False
         else:
-            with h5py.File(h5ad_path, 'r', swmr=True) as src:
-                attrs = dict(src[self.layer].attrs)
+            if attrs is None:
+                with h5py.File(h5ad_path, 'r', swmr=True) as src:
+                    attrs = dict(src[self.layer].attrs)
 
             if 'shape' not in attrs:
                 write_as_csr = False
@@ -243,7 +424,6 @@ class AnnDataRowIterator(object):
                     prefix=f"{h5ad_path.name}_as_csr_",
                     suffix=".h5"))
 
-            t0 = time.time()
             msg = (f"transcribing {pathlib.Path(h5ad_path).name} "
                    f"to {pathlib.Path(self.tmp_path).name} "
                    "as a CSR array")
@@ -254,28 +434,101 @@ class AnnDataRowIterator(object):
 
             array_shape = attrs['shape']
             self.n_rows = array_shape[0]
-            with h5py.File(h5ad_path, 'r', swmr=True) as src:
-                csc_to_csr_on_disk(
-                    csc_group=src[self.layer],
-                    csr_path=self.tmp_path,
+            self._iterator_type = 'CSRRow'
+
+            progress = None
+            if background_transcription:
+                # transcribe in a background thread; the CSRRowIterator
+                # blocks until the rows it is asked for are on disk, so
+                # iteration starts as soon as the first band of rows
+                # has been written
+                progress = CSRTranscriptionProgress()
+                self._transcription_progress = progress
+                self._transcription_thread = threading.Thread(
+                    target=_transcribe_csc_to_csr,
+                    kwargs={
+                        'h5ad_path': h5ad_path,
+                        'layer': self.layer,
+                        'tmp_path': self.tmp_path,
+                        'array_shape': array_shape,
+                        'max_gb': self.max_gb,
+                        'log': self.log,
+                        'progress': progress},
+                    daemon=True)
+            else:
+                _transcribe_csc_to_csr(
+                    h5ad_path=h5ad_path,
+                    layer=self.layer,
+                    tmp_path=self.tmp_path,
                     array_shape=array_shape,
-                    max_gb=0.8*self.max_gb)
+                    max_gb=self.max_gb,
+                    log=self.log)
 
-            self._iterator_type = 'CSRRow'
             self._chunk_iterator = CSRRowIterator(
                 h5_path=self.tmp_path,
                 row_chunk_size=row_chunk_size,
                 array_shape=array_shape,
-                keep_open=keep_open)
+                keep_open=keep_open,
+                transcription_progress=progress)
+
+            if self._transcription_thread is not None:
+                self._transcription_thread.start()
 
-            duration = time.time()-t0
-            if self.log is not None:
-                self.log.benchmark(
-                    msg=f"transcribing {pathlib.Path(h5ad_path).name} to CSR",
-                    duration=duration)
-            else:
-                msg = f"transcription to CSR took {duration:.2e} seconds"
-                print(msg)
+
+def _transcribe_csc_to_csr(
+        h5ad_path,
+        layer,
+        tmp_path,
+        array_shape,
+        max_gb,
+        log=None,
+        progress=None):
+    """
+    Write the CSC data in the layer group of h5ad_path to tmp_path
+    as a CSR matrix, reporting progress to progress (an optional
+    instance of CSRTranscriptionProgress, used when this is run in
+    a background thread).
+
+    This is a module-level function, rather than a method of
+    AnnDataRowIterator, so that a background writer thread does not
+    keep the iterator alive (the iterator's __del__ is what aborts
+    an unneeded transcription).
+    """
+    t0 = time.time()
+    output_lock = None
+    progress_callback = None
+    if progress is not None:
+        output_lock = progress.lock
+        progress_callback = progress.update
+
+    try:
+        with h5py.File(h5ad_path, 'r', swmr=True) as src:
+            csc_to_csr_on_disk(
+                csc_group=src[layer],
+                csr_path=tmp_path,
+                array_shape=array_shape,
+                max_gb=0.8*max_gb,
+                output_lock=output_lock,
+                progress_callback=progress_callback)
+    except CSRTranscriptionAborted:
+        progress.finish()
+        return
+    except Exception as err:
+        if progress is not None:
+            progress.finish(error=err)
+        raise
+
+    if progress is not None:
+        progress.finish()
+
+    duration = time.time()-t0
+    if log is not None:
+        log.benchmark(
+            msg=f"transcribing {pathlib.Path(h5ad_path).name} to CSR",
+            duration=duration)
+    else:
+        msg = f"transcription to CSR took {duration:.2e} seconds"
+        print(msg)
 
 
 class CSRRowIterator(object):
@@ -295,6 +548,25 @@ class CSRRowIterator(object):
     h5_group:
         Optional group in the HDF5 file where you will find
         'data', 'indices' and 'indptr'
+    keep_open:
+        boolean indicating whether or not to leave the h5 handle
+        open (should be false when using cuda)
+    rdcc_nbytes:
+        Size in bytes of the HDF5 raw data chunk cache
+        (h5py's default is only 1 MiB, which means sequential
+        row chunks keep re-reading the same HDF5 chunks from disk)
+    rdcc_nslots:
+        Number of hash slots in the raw data chunk cache
+    rdcc_w0:
+        Chunk preemption policy of the raw data chunk cache
+        (1.0 because this is a read-only path that streams through
+        the file, so fully read chunks can always be evicted first)
+    transcription_progress:
+        Optional CSRTranscriptionProgress. If not None, the file at
+        h5_path is still being written by another thread. Reads will
+        block until the requested rows are on disk and the file will
+        only be opened (under transcription_progress.lock) for the
+        duration of each read until the transcription is done.
     """
 
     def __init__(
@@ -303,7 +575,11 @@ class CSRRowIterator(object):
             row_chunk_size,
             array_shape,
             h5_group=None,
-            keep_open=True):
+            keep_open=True,
+            rdcc_nbytes=256*1024**2,
+            rdcc_nslots=1000003,
+            rdcc_w0=1.0,
+            transcription_progress=None):
 
         self.h5_path = h5_path
         self.h5_handle = None
@@ -311,8 +587,26 @@ class CSRRowIterator(object):
         self.r0 = 0
         self.n_rows = array_shape[0]
         self.n_cols = array_shape[1]
-
-        self.h5_handler = h5_handler_manager(h5_path, keepopen=keep_open)
+        self.keep_open = keep_open
+        self.transcription_progress = transcription_progress
+
+        self.file_kwargs = {
+            'rdcc_nbytes': rdcc_nbytes,
+            'rdcc_nslots': rdcc_nslots,
+            'rdcc_w0': rdcc_w0}
+
+        if transcription_progress is None:
+            self.h5_handler = h5_handler_manager(
+                h5_path,
+                keepopen=keep_open,
+                file_kwargs=self.file_kwargs,
+                sequential=True)
+        else:
+            self.h5_handler = h5_handler_manager(
+                h5_path,
+                keepopen=False,
+                file_kwargs=self.file_kwargs,
+                sequential=True)
 
         if h5_group is None:
             self.data_key = 'data'
@@ -323,10 +617,66 @@ class CSRRowIterator(object):
             self.indices_key = f'{h5_group}/indices'
             self.indptr_key = f'{h5_group}/indptr'
 
+        # (h5_handle, data, indices) for the handle
+        # most recently passed to _get_datasets
+        self._dataset_cache = None
+
+        # the whole indptr array, read once on first access
+        self._indptr = None
+
     def __del__(self):
         if self.h5_handle is not None:
             self.h5_handler.close()
 
+    def _get_datasets(self, h5_handle):
+        """
+        Return the (data, indices) h5py.Dataset handles in
+        h5_handle and the indptr array. The handles are cached so
+        that, when the file is kept open, the HDF5 links are only
+        traversed once rather than on every chunk.
+
+        indptr (8 bytes per row) is read into memory in full the first
+        time it is needed, so that each chunk costs two reads rather
+        than three. It is safe to do so even while the file is being
+        transcribed, since transpose_sparse_matrix_on_disk writes
+        indptr in full before any of the rows.
+        """
+        if self._dataset_cache is None \
+                or self._dataset_cache[0] is not h5_handle:
+            self._dataset_cache = (
+                h5_handle,
+                h5_handle[self.data_key],
+                h5_handle[self.indices_key])
+        if self._indptr is None:
+            self._indptr = h5_handle[self.indptr_key][()]
+        return (self._dataset_cache[1],
+                self._dataset_cache[2],
+                self._indptr)
+
+    def _wait_for_rows(self, n_rows):
+        """
+        Block until the first n_rows rows of the CSR file are
+        on disk. Return the lock that must be held while the
+        file is open.
+        """
+        if self.transcription_progress is None:
+            return DummyLock()
+
+        self.transcription_progress.wait_for(n_rows)
+
+        if self.transcription_progress.done:
+            # nothing else will write to the file;
+            # revert to normal access
+            self.transcription_progress = None
+            self.h5_handler = h5_handler_manager(
+                self.h5_path,
+                keepopen=self.keep_open,
+                file_kwargs=self.file_kwargs,
+                sequential=True)
+            return DummyLock()
+
+        return self.transcription_progress.lock
+
     def __next__(self):
         """
         Actually return a tuple
@@ -336,28 +686,70 @@ class CSRRowIterator(object):
         where r0 and r1 are the indices of the slice of rows
         (i.e. row_chunk is data[r0:r1, :])
         """
-        if self.r0 >= self.n_rows:
+        r0 = self.r0
+        n_rows = self.n_rows
+        if r0 >= n_rows:
             if self.h5_handle is not None:
                 self.h5_handle = None
             raise StopIteration
-        r1 = min(self.n_rows, self.r0+self.row_chunk_size)
-        chunk = self.get_chunk(r0=self.r0, r1=r1)
+        r1 = min(n_rows, r0+self.row_chunk_size)
+        chunk = self.get_chunk(r0=r0, r1=r1)
         self.r0 = r1
         return chunk
 
-    def get_chunk(self, r0, r1):
+    def get_chunk(self, r0, r1, sparse=False):
         """
         Returns the tuple (data[r0:r1, :], r0, r1)
+
+        If sparse is True, data[r0:r1, :] is returned as a CSR
+        matrix. Otherwise, it is returned as a dense array.
         """
-        with self.h5_handler as h5_handle:
-            chunk = load_csr(
-                row_spec=(r0, r1),
-                n_cols=self.n_cols,
-                data=h5_handle[self.data_key],
-                indices=h5_handle[self.indices_key],
-                indptr=h5_handle[self.indptr_key])
+        with self._wait_for_rows(r1), self.h5_handler as h5_handle:
+            chunk = self._load_rows(
+                h5_handle=h5_handle,
+                r0=r0,
+                r1=r1,
+                sparse=sparse)
         return (chunk, r0, r1)
 
+    def _load_rows(self, h5_handle, r0, r1, sparse=False):
+        """
+        Return data[r0:r1, :] as a dense array (or as a CSR
+        matrix if sparse is True).
+
+        indptr[r0:r1+1] is read first. data and indices are then
+        each read in a single call into buffers pre-allocated from
+        the span of the indptr chunk.
+        """
+        (data_ds,
+         indices_ds,
+         indptr) = self._get_datasets(h5_handle)
+        indptr = indptr[r0:r1+1]
+        nz0 = indptr[0]
+        nz1 = indptr[-1]
+
+        data = np.empty(nz1-nz0, dtype=data_ds.dtype)
+        indices = np.empty(nz1-nz0, dtype=indices_ds.dtype)
+        if nz1 > nz0:
+            data_ds.read_direct(
+                data,
+                source_sel=np.s_[nz0:nz1])
+            indices_ds.read_direct(
+                indices,
+                source_sel=np.s_[nz0:nz1])
+
+        if sparse:
+            return scipy.sparse.csr_matrix(
+                (data, indices, indptr-nz0),
+                shape=(r1-r0, self.n_cols))
+
+        return _csr_to_dense(
+            data=data,
+            indices=indices,
+            indptr=indptr-nz0,
+            n_rows=r1-r0,
+            n_cols=self.n_cols)
+
     def get_batch(self, row_idx, sparse=False):
         """
         Return a dense array representing the rows whose
@@ -367,20 +759,35 @@ class CSRRowIterator(object):
         Otherwise, return as a dense array.
         """
 
-        with self.h5_handler as h5_handle:
+        n_rows = 0
+        if len(row_idx) > 0:
+            n_rows = int(np.max(row_idx))+1
+
+        with self._wait_for_rows(n_rows), self.h5_handler as h5_handle:
+            (data_ds,
+             indices_ds,
+             full_indptr) = self._get_datasets(h5_handle)
             (data,
              indices,
              indptr) = _load_disjoint_csr(
                 row_index_list=row_idx,
-                data=h5_handle[self.data_key],
-                indices=h5_handle[self.indices_key],
-                indptr=h5_handle[self.indptr_key])
-        output = scipy.sparse.csr_matrix(
+                data=data_ds,
+                indices=indices_ds,
+                indptr=full_indptr)
+
+        if not sparse:
+            # scatter directly into the dense result rather
+            # than building an intermediate scipy matrix
+            return _csr_to_dense(
+                data=data,
+                indices=indices,
+                indptr=indptr,
+                n_rows=len(row_idx),
+                n_cols=self.n_cols)
+
+        return scipy.sparse.csr_matrix(
             (data, indices, indptr),
             shape=(len(row_idx), self.n_cols))
-        if sparse:
-            return output
-        return output.toarray()
 
     def __getitem__(self, r0):
         if isinstance(r0, list):
@@ -389,13 +796,11 @@ class CSRRowIterator(object):
         else:
             r1 = r0 + 1
 
-        with self.h5_handler as h5_handle:
-            chunk = load_csr(
-                row_spec=(r0, r1),
-                n_cols=self.n_cols,
-                data=h5_handle[self.data_key],
-                indices=h5_handle[self.indices_key],
-                indptr=h5_handle[self.indptr_key])
+        with self._wait_for_rows(r1), self.h5_handler as h5_handle:
+            chunk = self._load_rows(
+                h5_handle=h5_handle,
+                r0=r0,
+                r1=r1)
 
         return (chunk, r0, r1)
 
@@ -458,12 +863,17 @@ class DenseArrayRowIterator(object):
         self.r0 = r1
         return chunk
 
-    def get_chunk(self, r0, r1):
+    def get_chunk(self, r0, r1, sparse=False):
         """
         Returns the tuple (data[r0:r1, :], r0, r1)
+
+        If sparse is True, data[r0:r1, :] is returned as a CSR
+        matrix. Otherwise, it is returned as a dense array.
         """
         with self.h5_handler as h5_handle:
             chunk = h5_handle[self.data_key][r0:r1, :]
+        if sparse:
+            chunk = scipy.sparse.csr_matrix(chunk)
         return (chunk, r0, r1)
 
     def get_batch(self, row_idx, sparse=False):
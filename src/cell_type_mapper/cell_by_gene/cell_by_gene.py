@@ -140,9 +140,9 @@ class CellByGeneMatrix(object):
     def n_cells(self):
         return self._data.shape[0]
 
-    def _downsample_genes(self, selected_genes):
+    def _gene_idx(self, selected_genes):
         """
-        Return the data array with only selected_genes included
+        Return the array of column indices of selected_genes
         """
         id_set = set()
         for g in selected_genes:
@@ -151,17 +151,39 @@ class CellByGeneMatrix(object):
                     f"gene {g} occurs more than once in selected_genes")
             id_set.add(g)
 
-        idx_array = np.array([self.gene_to_col[n] for n in selected_genes],
-                             dtype=int)
+        return np.array([self.gene_to_col[n] for n in selected_genes],
+                        dtype=int)
 
-        return self.data[:, idx_array]
+    def _cell_idx(self, selected_cells):
+        """
+        Return (row indices, new cell identifiers) for selected_cells
+        (see downsample_cells)
+        """
+        if self.cell_identifiers is None:
+            return selected_cells, None
+        selected_cell_idx = [
+            self.cell_to_row[c] for c in selected_cells]
+        return selected_cell_idx, selected_cells
+
+    def _downsample_genes(self, selected_genes, dtype=None):
+        """
+        Return the data array with only selected_genes included
+        (cast to dtype, if dtype is not None)
+        """
+        data = self.data[:, self._gene_idx(selected_genes)]
+        if dtype is not None:
+            data = data.astype(dtype, copy=False)
+        return data
 
-    def downsample_genes(self, selected_genes):
+    def downsample_genes(self, selected_genes, dtype=None):
         """
         Return a new CellByGeneMatrix including only selected_genes
+
+        If dtype is not None, the data of the new CellByGeneMatrix
+        is cast to that dtype.
         """
         result = CellByGeneMatrix(
-            data=self._downsample_genes(selected_genes),
+            data=self._downsample_genes(selected_genes, dtype=dtype),
             gene_identifiers=selected_genes,
             normalization=self.normalization,
             cell_identifiers=self.cell_identifiers)
@@ -189,13 +211,8 @@ class CellByGeneMatrix(object):
         must be a list of cell_identifiers.
         """
 
-        if self.cell_identifiers is None:
-            selected_cell_idx = selected_cells
-            new_cell_id = None
-        else:
-            selected_cell_idx = [
-                self.cell_to_row[c] for c in selected_cells]
-            new_cell_id = selected_cells
+        (selected_cell_idx,
+         new_cell_id) = self._cell_idx(selected_cells)
 
         subset = self.data[selected_cell_idx, :]
         return CellByGeneMatrix(
@@ -204,6 +221,40 @@ class CellByGeneMatrix(object):
             normalization=self.normalization,
             cell_identifiers=new_cell_id)
 
+    def downsample_cells_and_genes(
+            self,
+            selected_cells,
+            selected_genes,
+            dtype=None):
+        """
+        Return another CellByGeneMatrix that only contains
+        the cells specified by selected_cells (see downsample_cells)
+        and the genes specified by selected_genes.
+
+        If dtype is not None, the data of the new CellByGeneMatrix
+        is cast to that dtype.
+
+        Equivalent to downsample_cells followed by
+        downsample_genes, but the sub-matrix is gathered in a single
+        pass, without first copying every gene of the selected cells.
+        """
+        (selected_cell_idx,
+         new_cell_id) = self._cell_idx(selected_cells)
+        gene_idx = self._gene_idx(selected_genes)
+
+        cell_idx = np.asarray(selected_cell_idx, dtype=int)
+        subset = self.data[cell_idx[:, None], gene_idx[None, :]]
+        if dtype is not None:
+            subset = subset.astype(dtype, copy=False)
+
+        result = CellByGeneMatrix(
+            data=subset,
+            gene_identifiers=selected_genes,
+            normalization=self.normalization,
+            cell_identifiers=new_cell_id)
+        result._genes_downsampled = True
+        return result
+
     def to_log2CPM(self):
         """
         Return a new CellByGeneMatrix that is normalized to log2CPM
@@ -246,6 +297,10 @@ class CellByGeneMatrix(object):
         if use_torch() and isinstance(self.data, torch.Tensor):
             self._data = torch.log2(1.0+convert_to_cpm(self.data))
         else:
-            self._data = np.log2(1.0+convert_to_cpm(self.data))
+            # convert_to_cpm returns a new buffer that nothing else
+            # references, so the log2 transform can be done in place
+            data = convert_to_cpm(self.data)
+            data += 1.0
+            self._data = np.log2(data, out=data)
 
         self._normalization = "log2CPM"
@@ -1,4 +1,5 @@
 import numpy as np
+import scipy.sparse
 
 from cell_type_mapper.utils.torch_utils import (
     use_torch)
@@ -10,7 +11,9 @@ except ImportError:
 
 
 def convert_to_cpm(
-        data):
+        data,
+        out=None,
+        dtype=np.float64):
     """
     Convert a cell-by-gene array from raw counts to
     counts per million.
@@ -19,12 +22,34 @@ def convert_to_cpm(
     ----------
     data:
         A numpy array of cell-by-gene data (each row is a cell;
-        each column is a gene)
+        each column is a gene). May also be a scipy.sparse
+        CSR matrix, in which case a CSR matrix is returned
+        without ever densifying the data (see convert_to_cpm_csr)
+    out:
+        Optional array (of the same shape as data) into which
+        to write the result. May be data itself if data is
+        already of a floating point type. Ignored for torch
+        tensors.
+    dtype:
+        The floating point dtype of the result. Row sums
+        are always accumulated in float64; only the final scaled
+        array is cast to dtype. np.float32 halves the memory
+        traffic of this (bandwidth bound) step and is adequate
+        for log2CPM statistics. Ignored for torch tensors.
 
     Returns
     -------
     cpm_data:
         data converted to "counts per million"
+
+    Notes
+    -----
+    The numpy branch divides each row by a broadcasted
+    (n_cells, 1) row sum and then scales the same buffer by
+    1.0e6, so that the array is never transposed and only one
+    output buffer is allocated (none if out is specified). The
+    order of operations matches the original data/denom*1.0e6
+    so results are bit-for-bit identical.
     """
     if use_torch():
         if torch.is_tensor(data):
@@ -34,8 +59,76 @@ def convert_to_cpm(
             cpm = 1.0e6*cpm
             return torch.t(cpm)
 
-    row_sums = np.sum(data, axis=1)
+    if scipy.sparse.issparse(data):
+        data = data.tocsr()
+        cpm_data = convert_to_cpm_csr(
+            data=data.data,
+            indptr=data.indptr,
+            dtype=dtype)
+        return scipy.sparse.csr_matrix(
+            (cpm_data, data.indices, data.indptr),
+            shape=data.shape)
+
+    row_sums = np.sum(data, axis=1, dtype=np.float64)
+    denom = np.where(row_sums > 0.0, row_sums, 1.)
+    cpm = np.divide(data, denom[:, None], out=out, dtype=dtype)
+    cpm *= 1.0e6
+    return cpm
+
+
+def convert_to_cpm_csr(
+        data,
+        indptr,
+        out=None,
+        dtype=np.float64):
+    """
+    Convert the non-zero values of a CSR cell-by-gene matrix
+    from raw counts to counts per million.
+
+    Parameters
+    ----------
+    data:
+        The data array of the CSR matrix (as in
+        scipy.sparse.csr_matrix().data)
+    indptr:
+        The indptr array of the CSR matrix (as in
+        scipy.sparse.csr_matrix().indptr). indptr[0] need
+        not be zero (i.e. data may be a slice of a larger
+        array; only data[indptr[0]:indptr[-1]] is used)
+    out:
+        Optional array of length indptr[-1]-indptr[0] into which
+        to write the result. May be data itself if data is already
+        of a floating point type.
+    dtype:
+        The floating point dtype of the result (row sums are
+        always accumulated in float64)
+
+    Returns
+    -------
+    cpm_data:
+        The data array of the normalized CSR matrix. The
+        indices and indptr arrays are unchanged by normalization.
+
+    Notes
+    -----
+    Only the non-zero values are read (once to take the row
+    sums, once to scale them) so the cost scales with the number
+    of non-zero entries rather than with n_cells*n_genes.
+    """
+    indptr = np.asarray(indptr)
+    data = data[indptr[0]:indptr[-1]]
+    offsets = indptr[:-1]-indptr[0]
+    n_per_row = np.diff(indptr)
+    row_sums = np.zeros(len(n_per_row), dtype=np.float64)
+    has_data = n_per_row > 0
+    if len(data) > 0:
+        row_sums[has_data] = np.add.reduceat(
+            data, offsets[has_data], dtype=np.float64)
     denom = np.where(row_sums > 0.0, row_sums, 1.)
-    cpm = data.transpose()/denom
-    cpm = 1.0e6*cpm
-    return cpm.transpose()
+    cpm = np.divide(
+        data,
+        np.repeat(denom, n_per_row),
+        out=out,
+        dtype=dtype)
+    cpm *= 1.0e6
+    return cpm
@@ -4,6 +4,7 @@ import h5py
 import json
 import multiprocessing
 import numpy as np
+import os
 import pathlib
 import tempfile
 import time
@@ -122,11 +123,7 @@ def run_mapping(
     for pth in (output_path, log_path):
         if pth is not None:
             if not pth.exists():
-                try:
-                    with open(pth, 'w') as out_file:
-                        out_file.write('junk')
-                    pth.unlink()
-                except FileNotFoundError:
+                if not os.access(pth.parent, os.W_OK):
                     raise RuntimeError(
                         "unable to write to "
                         f"{pth.resolve().absolute()}")
@@ -207,12 +204,14 @@ def run_mapping(
             output["gene_identifier_mapping"] = uns["AIBS_CDM_gene_mapping"]
 
         if output_path is not None:
+            # json.dump streams the encoded chunks to the file
+            # rather than building the whole document as one
+            # string in memory first
             with open(output_path, "w") as out_file:
-                out_file.write(
-                    json.dumps(
-                        clean_for_json(output), indent=2
-                    )
-                )
+                json.dump(
+                    clean_for_json(output),
+                    out_file,
+                    indent=2)
 
         if hdf5_output_path is not None:
             blob_to_hdf5(
@@ -283,7 +282,8 @@ def _run_mapping(config, tmp_dir, tmp_result_dir, log):
     t0 = time.time()
 
     marker_lookup_path = config['query_markers']['serialized_lookup']
-    marker_lookup = json.load(open(marker_lookup_path, 'rb'))
+    with open(marker_lookup_path, 'rb') as src:
+        marker_lookup = json.load(src)
 
     if 'metadata' in marker_lookup:
         marker_lookup.pop('metadata')
@@ -294,12 +294,10 @@ def _run_mapping(config, tmp_dir, tmp_result_dir, log):
 
         taxonomy_tree = taxonomy_tree.flatten()
 
-        all_markers = set()
-        for k in marker_lookup:
-            if k not in ('log', 'metadata'):
-                all_markers = all_markers.union(set(marker_lookup[k]))
-        all_markers = list(all_markers)
-        all_markers.sort()
+        all_markers = sorted({
+            gene
+            for k in marker_lookup if k not in ('log', 'metadata')
+            for gene in marker_lookup[k]})
         marker_lookup = {'None': all_markers}
 
     (query_gene_names,
@@ -114,7 +114,7 @@ class OnTheFlyMapper(argschema.ArgSchemaParser):
                     t0=t0)
 
                 with open(output_path, 'w') as dst:
-                    dst.write(json.dumps(results, indent=2))
+                    json.dump(results, dst, indent=2)
 
         finally:
             _clean_up(tmp_dir)
@@ -45,6 +45,10 @@ class ReferenceMarkerRunner(argschema.ArgSchemaParser):
 
         taxonomy_tree = None
 
+        # precomputed stats files usually share a taxonomy;
+        # only build (and drop_level) each distinct tree once
+        serialized_to_tree = dict()
+
         t0 = time.time()
 
         if self.args['query_path'] is not None:
@@ -62,12 +66,20 @@ class ReferenceMarkerRunner(argschema.ArgSchemaParser):
             if self.args['cloud_safe']:
                 to_write = '../' + pathlib.Path(to_write).name
             print(f'writing {to_write}')
-            taxonomy_tree = TaxonomyTree.from_precomputed_stats(
-                stats_path=precomputed_path)
+            with h5py.File(precomputed_path, 'r') as src:
+                serialized_tree = src['taxonomy_tree'][()]
+
+            if serialized_tree not in serialized_to_tree:
+                taxonomy_tree = TaxonomyTree.from_str(
+                    serialized_tree.decode('utf-8'))
+
+                if self.args['drop_level'] is not None:
+                    taxonomy_tree = taxonomy_tree.drop_level(
+                        self.args['drop_level'])
+
+                serialized_to_tree[serialized_tree] = taxonomy_tree
 
-            if self.args['drop_level'] is not None:
-                taxonomy_tree = taxonomy_tree.drop_level(
-                    self.args['drop_level'])
+            taxonomy_tree = serialized_to_tree[serialized_tree]
 
             find_markers_for_all_taxonomy_pairs(
                 precomputed_stats_path=precomputed_path,
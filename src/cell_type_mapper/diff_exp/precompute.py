@@ -1,5 +1,6 @@
 import h5py
 import json
+import numpy as np
 
 
 def _create_empty_stats_file(
@@ -23,7 +24,37 @@ def _create_empty_stats_file(
         out_file.create_dataset('n_cells', shape=(n_clusters,), dtype=int)
         for (k, dt) in (('sum', float), ('sumsq', float),
                         ('gt0', int), ('gt1', int), ('ge1', int)):
-            out_file.create_dataset(k,
-                                    shape=(n_clusters, n_genes),
-                                    chunks=((max(1, n_clusters//10), n_genes)),
-                                    dtype=dt)
+            out_file.create_dataset(
+                k,
+                shape=(n_clusters, n_genes),
+                dtype=dt,
+                **_get_stats_dataset_kwargs(
+                    n_clusters=n_clusters,
+                    n_genes=n_genes,
+                    this_dtype=dt))
+
+
+def _get_stats_dataset_kwargs(
+        n_clusters,
+        n_genes,
+        this_dtype,
+        chunk_bytes=1024**2):
+    """
+    Return the chunking and compression kwargs for a
+    (n_clusters, n_genes) summary stats dataset.
+
+    Chunks span all genes and as many clusters as fit in
+    (approximately) chunk_bytes, so that reading or writing
+    the stats for a single cluster touches as little data as
+    possible. The data is byte-shuffled and compressed with
+    lzf (which ships with h5py), since the stats matrices are
+    dominated by zeros and small integers.
+    """
+    if n_clusters == 0 or n_genes == 0:
+        return dict()
+    bytes_per_row = n_genes*np.dtype(this_dtype).itemsize
+    n_rows = max(1, min(n_clusters, chunk_bytes//bytes_per_row))
+    return {
+        'chunks': (n_rows, n_genes),
+        'shuffle': True,
+        'compression': 'lzf'}
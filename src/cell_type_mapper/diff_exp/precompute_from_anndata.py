@@ -1,21 +1,33 @@
 from typing import Union, List, Optional, Dict
 import h5py
+import heapq
 import multiprocessing
 import numpy as np
 import numbers
 import os
 import pathlib
+import scipy.sparse
 import shutil
 import tempfile
 import time
 
+try:
+    import torch
+except ImportError:
+    pass
+
 from cell_type_mapper.utils.utils import (
     mkstemp_clean,
     _clean_up)
 
 from cell_type_mapper.utils.multiprocessing_utils import (
+    prefetch_iterator,
     winnow_process_list)
 
+from cell_type_mapper.utils.torch_utils import (
+    is_cuda_available,
+    use_torch)
+
 from cell_type_mapper.utils.anndata_utils import (
     read_df_from_h5ad)
 
@@ -26,7 +38,8 @@ from cell_type_mapper.taxonomy.taxonomy_tree import (
     TaxonomyTree)
 
 from cell_type_mapper.utils.stats_utils import (
-    summary_stats_for_chunk)
+    summary_stats_for_clusters,
+    summary_stats_for_clusters_csr)
 
 from cell_type_mapper.diff_exp.precompute import (
     _create_empty_stats_file)
@@ -390,24 +403,29 @@ def _precompute_summary_stats_from_h5ad_and_lookup(
     n_clusters = len(cluster_to_output_row)
     n_genes = len(gene_names)
 
-    cell_name_to_output_row = dict()
-    for cell_name in cell_name_to_cluster_name:
-        cell_name_to_output_row[cell_name] = cluster_to_output_row[
-            cell_name_to_cluster_name[cell_name]]
+    cell_name_to_output_row = {
+        cell_name: cluster_to_output_row[cluster_name]
+        for cell_name, cluster_name in cell_name_to_cluster_name.items()
+    }
 
     bad_row_idx = -999
 
-    desired_cells = set(cell_name_to_cluster_name.keys())
-
-    path_to_cells = dict()
-    n_total_cells = 0
+    # map every row of every file to its output row once, here,
+    # rather than in every worker that touches the file
+    # (int32 because n_clusters is nowhere near 2**31)
+    path_to_output_row = dict()
     new_data_path_list = []
     for data_path in data_path_list:
-        cell_name_list = list(
-            read_df_from_h5ad(data_path, 'obs').index.values)
+        cell_name_list = read_df_from_h5ad(data_path, 'obs').index.values
 
-        n_overlap = len(set(cell_name_list).intersection(desired_cells))
-        if n_overlap > 0:
+        row_to_output_row = np.fromiter(
+            (cell_name_to_output_row.get(cell_name, bad_row_idx)
+             for cell_name in cell_name_list),
+            dtype=np.int32,
+            count=len(cell_name_list))
+        del cell_name_list
+
+        if (row_to_output_row != bad_row_idx).any():
             if buffer_dir is not None:
                 data_path = pathlib.Path(data_path)
                 new_path = mkstemp_clean(
@@ -425,77 +443,75 @@ def _precompute_summary_stats_from_h5ad_and_lookup(
                 data_path = new_path
                 new_data_path_list.append(new_path)
 
-            n_cells = len(cell_name_list)
-            path_to_cells[data_path] = n_cells
-            n_total_cells += n_cells
+            path_to_output_row[data_path] = row_to_output_row
 
     if buffer_dir is not None:
         data_path_list = new_data_path_list
 
-    n_per = np.ceil(n_total_cells/n_processors).astype(int)
-
-    work_load = []
-    for ii in range(n_processors):
-        work_load.append([])
-
-    i_worker = 0
-    this_n_cells = 0
+    # break the data into row chunks, weighting each chunk by
+    # the number of cells in it that actually contribute to the
+    # summary stats (chunks with no such cells are skipped)
+    chunk_list = []
+    weight_list = []
     for data_path in data_path_list:
-        if data_path not in path_to_cells:
+        if data_path not in path_to_output_row:
             continue
-        n_cells = path_to_cells[data_path]
+        is_desired = (path_to_output_row[data_path] != bad_row_idx)
+        n_cells = len(is_desired)
         for r0 in range(0, n_cells, rows_at_a_time):
             r1 = min(n_cells, r0+rows_at_a_time)
-            work_load[i_worker].append((data_path, r0, r1))
-            this_n_cells += r1-r0
-            if this_n_cells > n_per:
-                i_worker += 1
-                this_n_cells = 0
-
-    # clean out empty work loads (can happen depending on
-    # how cells are distributed amongst the input data files)
-    to_pop = []
-    for ii in range(len(work_load)):
-        if len(work_load[ii]) == 0:
-            to_pop.append(ii)
-    to_pop.sort()
-    to_pop.reverse()
-    for ii in to_pop:
-        # make absolutely sure we are not popping an "interesting"
-        # set of work
-        assert len(work_load[ii]) == 0
-        work_load.pop(ii)
+            n_desired = np.count_nonzero(is_desired[r0:r1])
+            if n_desired == 0:
+                continue
+            chunk_list.append((data_path, r0, r1))
+            weight_list.append(n_desired)
+
+    work_load = _divide_chunks_among_workers(
+        chunk_list=chunk_list,
+        weight_list=weight_list,
+        n_workers=n_processors)
+
+    # summary stats accumulated over all of the work loads
+    final_output = None
 
     buffer_path_list = []
     process_list = []
     for work_spec in work_load:
 
-        buffer_path = mkstemp_clean(
-            dir=tmp_dir,
-            prefix='precomputation_buffer_',
-            suffix='.h5')
-        buffer_path_list.append(buffer_path)
-
         if n_processors <= 1:
 
-            _process_chunk_spec(
+            # no need to round-trip the stats through a buffer
+            # file when they are computed in this process
+            buffer_dict = _process_chunk_spec(
                 chunk_specification_list=work_spec,
                 rows_at_a_time=rows_at_a_time,
                 gene_names=gene_names,
-                cell_name_to_output_row=cell_name_to_output_row,
+                path_to_output_row=path_to_output_row,
                 bad_row_idx=bad_row_idx,
                 normalization=normalization,
                 n_clusters=n_clusters,
-                buffer_path=buffer_path)
+                buffer_path=None)
+
+            final_output = _accumulate_summary_stats(
+                final_output=final_output,
+                buffer_dict=buffer_dict)
 
         else:
+            buffer_path = mkstemp_clean(
+                dir=tmp_dir,
+                prefix='precomputation_buffer_',
+                suffix='.h5')
+            buffer_path_list.append(buffer_path)
+
             p = multiprocessing.Process(
                     target=_process_chunk_spec,
                     kwargs={
                         'chunk_specification_list': work_spec,
                         'rows_at_a_time': rows_at_a_time,
                         'gene_names': gene_names,
-                        'cell_name_to_output_row': cell_name_to_output_row,
+                        'path_to_output_row': {
+                            chunk_spec[0]: path_to_output_row[chunk_spec[0]]
+                            for chunk_spec in work_spec},
                         'bad_row_idx': bad_row_idx,
                         'normalization': normalization,
                         'n_clusters': n_clusters,
@@ -520,20 +536,11 @@ def _precompute_summary_stats_from_h5ad_and_lookup(
         n_genes=n_genes,
         col_names=gene_names)
 
-    final_output = None
     for buffer_path in buffer_path_list:
         with h5py.File(buffer_path, 'r') as src:
-            if final_output is None:
-                final_output = dict()
-                for k in src.keys():
-                    final_output[k] = np.zeros(
-                        src[k].shape,
-                        dtype=src[k].dtype)
-            for k in src.keys():
-                if k == 'n_cells':
-                    final_output[k][:] += src[k][()]
-                else:
-                    final_output[k][:, :] += src[k][()]
+            final_output = _accumulate_summary_stats(
+                final_output=final_output,
+                buffer_dict={k: src[k][()] for k in src.keys()})
 
     with h5py.File(output_path, 'a') as out_file:
         for k in final_output.keys():
@@ -543,11 +550,55 @@ def _precompute_summary_stats_from_h5ad_and_lookup(
                 out_file[k][:, :] = final_output[k]
 
 
+def _divide_chunks_among_workers(
+        chunk_list,
+        weight_list,
+        n_workers):
+    """
+    Divide a list of work chunks among n_workers so that the
+    total weight assigned to each worker is as even as possible
+    (greedy longest-processing-time scheduling: the heaviest
+    remaining chunk always goes to the least loaded worker).
+
+    Parameters
+    ----------
+    chunk_list:
+        List of work chunks
+    weight_list:
+        List of the (non-negative) weights of the chunks
+        in chunk_list
+    n_workers:
+        The number of workers
+
+    Returns
+    -------
+    work_load:
+        A list of lists of chunks (one per worker; empty work
+        loads are omitted). Each worker's chunks keep their
+        relative order from chunk_list, so that chunks from the
+        same file stay adjacent.
+    """
+    n_workers = max(1, n_workers)
+    assignment = [[] for ii in range(n_workers)]
+    heap = [(0, ii) for ii in range(n_workers)]
+    heapq.heapify(heap)
+    for i_chunk in np.argsort(-np.asarray(weight_list), kind='stable'):
+        (load, i_worker) = heapq.heappop(heap)
+        assignment[i_worker].append(i_chunk)
+        heapq.heappush(heap, (load+weight_list[i_chunk], i_worker))
+
+    return [
+        [chunk_list[i_chunk] for i_chunk in sorted(chunk_idx)]
+        for chunk_idx in assignment
+        if len(chunk_idx) > 0
+    ]
+
+
 def _process_chunk_spec(
         chunk_specification_list,
         rows_at_a_time,
         gene_names,
-        cell_name_to_output_row,
+        path_to_output_row,
         bad_row_idx,
         normalization,
         n_clusters,
@@ -561,50 +612,64 @@ def _process_chunk_spec(
     (h5ad_path, r0, r1)
     telling the code which files to open and which r0:r1
     row chunks to process
+
+    path_to_output_row maps each h5ad_path to an array mapping
+    each row in that file to its output row (bad_row_idx for rows
+    that are not to be included)
+
+    If buffer_path is None, nothing is written and the dict
+    of summary stats is returned instead.
     """
 
     t0 = time.time()
     time_reading = 0.0
     n_genes = len(gene_names)
 
+    # the per-gene counts cannot exceed the number of cells in a
+    # cluster, so int32 is ample and halves the size of these buffers
+    # (sum and sumsq stay float64; var is computed as the difference
+    # sumsq - sum**2/n, which float32 accumulators would not survive)
     buffer_dict = dict()
     buffer_dict['n_cells'] = np.zeros(n_clusters, dtype=int)
     buffer_dict['sum'] = np.zeros((n_clusters, n_genes), dtype=float)
     buffer_dict['sumsq'] = np.zeros((n_clusters, n_genes), dtype=float)
-    buffer_dict['gt0'] = np.zeros((n_clusters, n_genes), dtype=int)
-    buffer_dict['gt1'] = np.zeros((n_clusters, n_genes), dtype=int)
-    buffer_dict['ge1'] = np.zeros((n_clusters, n_genes), dtype=int)
-
-    iterator = None
-    iterator_path = None
-    for chunk_spec in chunk_specification_list:
-        if iterator is None or iterator_path != chunk_spec[0]:
-
-            cell_name_list = list(
-                read_df_from_h5ad(chunk_spec[0], 'obs').index.values)
-
-            iterator = AnnDataRowIterator(
-                h5ad_path=chunk_spec[0],
-                row_chunk_size=rows_at_a_time)
-
-            iterator_path = chunk_spec[0]
-
+    buffer_dict['gt0'] = np.zeros((n_clusters, n_genes), dtype=np.int32)
+    buffer_dict['gt1'] = np.zeros((n_clusters, n_genes), dtype=np.int32)
+    buffer_dict['ge1'] = np.zeros((n_clusters, n_genes), dtype=np.int32)
+
+    # chunks are read on a background thread so that reading the
+    # next chunk overlaps with reducing the current one
+    chunk_iterator = prefetch_iterator(
+        _read_chunk_spec(
+            chunk_specification_list=chunk_specification_list,
+            rows_at_a_time=rows_at_a_time),
+        n_prefetch=1)
+
+    while True:
+        # time_reading is the time spent waiting for data
         r_t0 = time.time()
-        chunk = iterator.get_chunk(
-            r0=chunk_spec[1],
-            r1=chunk_spec[2])
+        try:
+            chunk_spec, chunk = next(chunk_iterator)
+        except StopIteration:
+            break
         time_reading += time.time()-r_t0
 
+        row_to_output_row = path_to_output_row[chunk_spec[0]]
+
         _process_chunk(
             chunk=chunk,
             gene_names=gene_names,
-            cell_name_to_output_row=cell_name_to_output_row,
-            cell_name_list=cell_name_list,
+            row_to_output_row=row_to_output_row,
             bad_row_idx=bad_row_idx,
             normalization=normalization,
             n_clusters=n_clusters,
             buffer_dict=buffer_dict)
 
+    if buffer_path is None:
+        print(f'finally process {os.getpid()} tot {time.time()-t0:.2e} '
+              f'reading {time_reading:.2e}')
+        return buffer_dict
+
     w_t0 = time.time()
     with h5py.File(buffer_path, 'w') as dst:
         for k in buffer_dict:
@@ -614,46 +679,128 @@ def _process_chunk_spec(
           f'reading {time_reading:.2e} writing {time_writing:.2e}')
 
 
+def _read_chunk_spec(
+        chunk_specification_list,
+        rows_at_a_time):
+    """
+    Generator yielding (chunk_spec, chunk) for each
+    (h5ad_path, r0, r1) chunk_spec in chunk_specification_list,
+    where chunk is the result of AnnDataRowIterator.get_chunk
+
+    Chunks of CSR data are left sparse (unless the statistics
+    are to be computed on the GPU)
+    """
+    on_gpu = use_torch() and is_cuda_available()
+    iterator = None
+    iterator_path = None
+    for chunk_spec in chunk_specification_list:
+        if iterator is None or iterator_path != chunk_spec[0]:
+            # the iterator is local to this generator (it is never
+            # pickled and nothing forks while it is alive), so CSC
+            # files can safely be transcribed in the background
+            iterator = AnnDataRowIterator(
+                h5ad_path=chunk_spec[0],
+                row_chunk_size=rows_at_a_time,
+                background_transcription=True)
+            iterator_path = chunk_spec[0]
+
+        chunk = iterator.get_chunk(
+            r0=chunk_spec[1],
+            r1=chunk_spec[2],
+            sparse=(iterator.is_csr and not on_gpu))
+        yield chunk_spec, chunk
+
+
+def _accumulate_summary_stats(
+        final_output,
+        buffer_dict):
+    """
+    Add the summary stats in buffer_dict to final_output
+    (a dict of the same form). If final_output is None,
+    buffer_dict becomes final_output.
+
+    Returns final_output
+    """
+    if final_output is None:
+        return buffer_dict
+    for k in buffer_dict:
+        final_output[k] += buffer_dict[k]
+    return final_output
+
+
 def _process_chunk(
         chunk,
         gene_names,
-        cell_name_to_output_row,
-        cell_name_list,
+        row_to_output_row,
         bad_row_idx,
         normalization,
         n_clusters,
         buffer_dict):
+    """
+    Add the summary stats for a chunk of rows to buffer_dict.
+
+    row_to_output_row is an array mapping each row in the
+    h5ad file to its output row (bad_row_idx for rows
+    that are not to be included)
+    """
 
     r0 = chunk[1]
     r1 = chunk[2]
-    cluster_chunk = np.array([
-        cell_name_to_output_row[cell_name_list[idx]]
-        if cell_name_list[idx] in cell_name_to_output_row
-        else bad_row_idx
-        for idx in range(r0, r1)
-    ])
-    for unq_cluster in np.unique(cluster_chunk):
-        if unq_cluster == bad_row_idx:
-            continue
-        valid = np.where(cluster_chunk == unq_cluster)[0]
-        valid = np.sort(valid)
-        this_cluster = chunk[0][valid, :]
-
-        if not isinstance(this_cluster, np.ndarray):
-            this_cluster = this_cluster.toarray()
-
-        this_cluster = CellByGeneMatrix(
-            data=this_cluster,
+    cluster_chunk = row_to_output_row[r0:r1]
+    valid = np.where(cluster_chunk != bad_row_idx)[0]
+    if len(valid) == 0:
+        return
+
+    if len(valid) == len(cluster_chunk):
+        data = chunk[0]
+    else:
+        data = chunk[0][valid, :]
+        cluster_chunk = cluster_chunk[valid]
+
+    (unq_cluster,
+     cluster_idx) = np.unique(cluster_chunk, return_inverse=True)
+
+    on_gpu = use_torch() and is_cuda_available()
+
+    if scipy.sparse.issparse(data) and not on_gpu:
+        # normalization to log2CPM is done as part of the reduction
+        summary_chunk = summary_stats_for_clusters_csr(
+            csr_data=data,
+            cluster_idx=cluster_idx,
+            n_clusters=len(unq_cluster),
+            normalization=normalization)
+    else:
+        if not isinstance(data, np.ndarray):
+            data = data.toarray()
+
+        if on_gpu:
+            # normalize and reduce on the GPU
+            data = torch.from_numpy(
+                data.astype(np.float64, copy=False)).to(device='cuda')
+
+        # normalize every row of the chunk at once and reduce all
+        # of the clusters it contains together
+        cell_x_gene = CellByGeneMatrix(
+            data=data,
             gene_identifiers=gene_names,
             normalization=normalization)
 
-        if this_cluster.normalization != 'log2CPM':
-            this_cluster.to_log2CPM_in_place()
-
-        summary_chunk = summary_stats_for_chunk(this_cluster)
-
-        for k in summary_chunk.keys():
-            if len(buffer_dict[k].shape) == 1:
-                buffer_dict[k][unq_cluster] += summary_chunk[k]
-            else:
-                buffer_dict[k][unq_cluster, :] += summary_chunk[k]
+        if cell_x_gene.normalization != 'log2CPM':
+            cell_x_gene.to_log2CPM_in_place()
+
+        summary_chunk = summary_stats_for_clusters(
+            cell_x_gene=cell_x_gene,
+            cluster_idx=cluster_idx,
+            n_clusters=len(unq_cluster))
+
+    # when the chunk's clusters occupy a contiguous block of output
+    # rows (the usual case when cells are grouped by cluster), add
+    # into a view of the buffer rather than gathering and scattering
+    # the rows through temporary copies
+    if unq_cluster[-1]-unq_cluster[0]+1 == len(unq_cluster):
+        out_rows = slice(unq_cluster[0], unq_cluster[-1]+1)
+    else:
+        out_rows = unq_cluster
+
+    for k in summary_chunk.keys():
+        buffer_dict[k][out_rows] += summary_chunk[k]
@@ -127,11 +127,16 @@ def merge_precompute_files(
                 src_n_cells = src['n_cells'][()]
                 dst_n_cells = dst['n_cells'][()]
                 to_replace = np.where(src_n_cells > dst_n_cells)[0]
-
-                dst['n_cells'][to_replace] = src['n_cells'][to_replace]
+                if len(to_replace) == 0:
+                    continue
+
+                # to_replace is sorted (it came from np.where), so
+                # each key can be transferred with a single
+                # fancy-indexed read and write rather than one
+                # HDF5 call per cluster
+                dst['n_cells'][to_replace] = src_n_cells[to_replace]
                 for key in dst.keys():
                     if key in keys_to_skip:
                         continue
-                    for idx in to_replace:
-                        dst[key][idx, :] = src[key][idx, :]
+                    dst[key][to_replace, :] = src[key][to_replace, :]
             dst.flush()
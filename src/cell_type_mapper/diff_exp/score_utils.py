@@ -1,6 +1,7 @@
 import h5py
 import json
 import numpy as np
+import scipy.sparse
 import warnings
 
 from cell_type_mapper.utils.utils import (
@@ -132,36 +133,56 @@ def read_precomputed_stats(
     compute 'var', 'ge1' (which are only needed if selecting marker
     genes)
     """
-    raw_results = read_raw_precomputed_stats(
+    # gt0 and gt1 are never returned, so do not read or aggregate
+    # them ('ge1' is read even when not needed so that
+    # aggregate_stats_from_arrays does not warn about it being absent)
+    if for_marker_selection:
+        stats_to_read = ('n_cells', 'sum', 'sumsq', 'ge1')
+    else:
+        stats_to_read = ('n_cells', 'sum', 'ge1')
+
+    (gene_names,
+     row_lookup,
+     raw_data) = _read_precomputed_arrays(
             precomputed_stats_path=precomputed_stats_path,
-            for_marker_selection=for_marker_selection)
+            for_marker_selection=for_marker_selection,
+            stats_to_read=stats_to_read)
 
     results = dict()
-    results['gene_names'] = raw_results['gene_names']
+    results['gene_names'] = gene_names
     results['cluster_stats'] = dict()
     as_leaves = taxonomy_tree.as_leaves
+
+    # aggregate a bounded number of nodes at a time so that
+    # the (n_nodes, n_genes) temporaries stay small
+    chunk_size = 1024
     for level in as_leaves:
-        for node in as_leaves[level]:
-            leaf_population = as_leaves[level][node]
-            this = aggregate_stats(
-                leaf_population=leaf_population,
-                precomputed_stats=raw_results['cluster_stats'])
-
-            key_list = list(this.keys())
-            for key in key_list:
-                if key not in ('mean', 'var', 'ge1', 'n_cells'):
-                    this.pop(key)
-            if not for_marker_selection:
-                for key in ('var', 'ge1', 'n_cells'):
-                    if key in this:
+        node_list = list(as_leaves[level].keys())
+        for i0 in range(0, len(node_list), chunk_size):
+            chunk = node_list[i0:i0+chunk_size]
+            aggregated = aggregate_stats_from_arrays(
+                leaf_populations=[as_leaves[level][node]
+                                  for node in chunk],
+                leaf_to_row=row_lookup,
+                precomputed_arrays=raw_data)
+
+            for node, this in zip(chunk, aggregated):
+                key_list = list(this.keys())
+                for key in key_list:
+                    if key not in ('mean', 'var', 'ge1', 'n_cells'):
                         this.pop(key)
-            results['cluster_stats'][f'{level}/{node}'] = this
+                if not for_marker_selection:
+                    for key in ('var', 'ge1', 'n_cells'):
+                        if key in this:
+                            this.pop(key)
+                results['cluster_stats'][f'{level}/{node}'] = this
     return results
 
 
 def read_raw_precomputed_stats(
         precomputed_stats_path,
-        for_marker_selection=True):
+        for_marker_selection=True,
+        stats_to_read=None):
     """
     Read in the precomputed stats file at
     precomputed_stats path and return a dict
@@ -178,54 +199,173 @@ def read_raw_precomputed_stats(
 
     if for_marker_selection is True and 'sumsq' or 'ge1' are missing,
     raise an error
+
+    if stats_to_read is not None, only the statistics listed in
+    it are read
     """
 
+    (gene_names,
+     row_lookup,
+     raw_data) = _read_precomputed_arrays(
+            precomputed_stats_path=precomputed_stats_path,
+            for_marker_selection=for_marker_selection,
+            stats_to_read=stats_to_read)
+
+    cluster_stats = dict()
+    for leaf_name in row_lookup:
+        idx = row_lookup[leaf_name]
+        this = dict()
+        for k in raw_data:
+            if k == 'n_cells':
+                this[k] = raw_data[k][idx]
+            else:
+                this[k] = raw_data[k][idx, :]
+        cluster_stats[leaf_name] = this
+
     precomputed_stats = dict()
+    precomputed_stats['gene_names'] = gene_names
+    precomputed_stats['cluster_stats'] = cluster_stats
+    return precomputed_stats
+
+
+def _read_precomputed_arrays(
+        precomputed_stats_path,
+        for_marker_selection=True,
+        stats_to_read=None):
+    """
+    Read the statistics in the precomputed stats file at
+    precomputed_stats_path as they are stored, i.e. one
+    (n_leaves, n_genes) array per statistic.
+
+    Returns
+    -------
+    gene_names:
+        list of gene names
+    row_lookup:
+        dict mapping leaf node name to row in the arrays
+    raw_data:
+        dict mapping statistic name to array ('n_cells' is
+        (n_leaves,); everything else is (n_leaves, n_genes))
+
+    if for_marker_selection is True and 'sumsq' or 'ge1' are missing,
+    raise an error
+
+    if stats_to_read is not None, only the statistics listed in
+    it are read
+    """
     raw_data = dict()
     with h5py.File(precomputed_stats_path, 'r') as in_file:
 
-        precomputed_stats['gene_names'] = json.loads(
+        gene_names = json.loads(
             in_file['col_names'][()].decode('utf-8'))
 
         row_lookup = json.loads(
             in_file['cluster_to_row'][()].decode('utf-8'))
 
-        all_keys = set(['n_cells', 'sum', 'sumsq', 'gt0', 'gt1', 'ge1'])
-        all_keys = list(all_keys.intersection(set(in_file.keys())))
-
-        if 'n_cells' not in all_keys or 'sum' not in all_keys:
-            raise RuntimeError(
-                "'n_cells' and 'sum' must be in precomputed stats "
-                f"file. The file\n{precomputed_stats_path}\n"
-                f"contains {in_file.keys()}")
+        all_keys = _get_precomputed_stats_keys(
+            in_file=in_file,
+            precomputed_stats_path=precomputed_stats_path,
+            for_marker_selection=for_marker_selection)
 
-        if for_marker_selection:
-            if 'sumsq' not in all_keys or 'ge1' not in all_keys:
-                raise RuntimeError(
-                    "'sumsq' and 'ge1' must be in precomputed stats "
-                    "file in order to use it for marker selection. The "
-                    f"file\n{precomputed_stats_path}\n"
-                    f"contains {in_file.keys()}")
+        if stats_to_read is not None:
+            all_keys = [k for k in all_keys if k in stats_to_read]
 
         for k in all_keys:
             if k in in_file:
                 raw_data[k] = in_file[k][()]
 
-    cluster_stats = dict()
-    for leaf_name in row_lookup:
-        idx = row_lookup[leaf_name]
-        this = dict()
-        if 'n_cells' in raw_data:
-            this['n_cells'] = raw_data['n_cells'][idx]
-        for k in all_keys:
-            if k == 'n_cells':
-                continue
-            if k in raw_data:
-                this[k] = raw_data[k][idx, :]
-        cluster_stats[leaf_name] = this
+    return gene_names, row_lookup, raw_data
 
-    precomputed_stats['cluster_stats'] = cluster_stats
-    return precomputed_stats
+
+def read_precomputed_leaf_means(
+        precomputed_stats_path,
+        leaf_names,
+        for_marker_selection=True,
+        selected_genes=None):
+    """
+    Read the mean gene expression profile of each leaf node
+    directly from a precomputed stats file.
+
+    Parameters
+    ----------
+    precomputed_stats_path:
+        Path to the precomputed stats file
+    leaf_names:
+        Ordered list of the leaf nodes whose means are wanted
+    for_marker_selection:
+        If True and 'sumsq' or 'ge1' are missing, raise an error
+    selected_genes:
+        Optional ordered list of the genes whose means are wanted
+        (if None, all genes are returned)
+
+    Returns
+    -------
+    gene_names:
+        List of gene names
+    mean_array:
+        A (len(leaf_names), len(gene_names)) numpy array of mean
+        expression in units of log2(CPM+1)
+
+    Notes
+    -----
+    Only 'n_cells' and 'sum' are read, and no nodes above the
+    leaf level are aggregated, so this is much cheaper than
+    read_precomputed_stats when only leaf means are needed.
+    """
+    with h5py.File(precomputed_stats_path, 'r') as in_file:
+        gene_names = json.loads(
+            in_file['col_names'][()].decode('utf-8'))
+        row_lookup = json.loads(
+            in_file['cluster_to_row'][()].decode('utf-8'))
+        _get_precomputed_stats_keys(
+            in_file=in_file,
+            precomputed_stats_path=precomputed_stats_path,
+            for_marker_selection=for_marker_selection)
+        n_cells = in_file['n_cells'][()]
+        sum_arr = in_file['sum'][()]
+
+    if selected_genes is not None:
+        gene_to_col = {g: ii for ii, g in enumerate(gene_names)}
+        missing = [g for g in selected_genes if g not in gene_to_col]
+        if len(missing) > 0:
+            raise RuntimeError(
+                f"genes {missing} not in {precomputed_stats_path}")
+        cols = np.array([gene_to_col[g] for g in selected_genes], dtype=int)
+        sum_arr = sum_arr[:, cols]
+        gene_names = list(selected_genes)
+
+    rows = np.array([row_lookup[leaf] for leaf in leaf_names], dtype=int)
+    mean_array = sum_arr[rows, :].astype(float)
+    mean_array /= np.maximum(1, n_cells[rows])[:, None]
+    return gene_names, mean_array
+
+
+def _get_precomputed_stats_keys(
+        in_file,
+        precomputed_stats_path,
+        for_marker_selection):
+    """
+    Return the list of summary statistics present in the open
+    precomputed stats file in_file, raising an error if the
+    statistics required are missing.
+    """
+    all_keys = set(['n_cells', 'sum', 'sumsq', 'gt0', 'gt1', 'ge1'])
+    all_keys = list(all_keys.intersection(set(in_file.keys())))
+
+    if 'n_cells' not in all_keys or 'sum' not in all_keys:
+        raise RuntimeError(
+            "'n_cells' and 'sum' must be in precomputed stats "
+            f"file. The file\n{precomputed_stats_path}\n"
+            f"contains {in_file.keys()}")
+
+    if for_marker_selection:
+        if 'sumsq' not in all_keys or 'ge1' not in all_keys:
+            raise RuntimeError(
+                "'sumsq' and 'ge1' must be in precomputed stats "
+                "file in order to use it for marker selection. The "
+                f"file\n{precomputed_stats_path}\n"
+                f"contains {in_file.keys()}")
+    return all_keys
 
 
 def aggregate_stats(
@@ -264,40 +404,47 @@ def aggregate_stats(
     """
     n_genes = len(precomputed_stats[leaf_population[0]]['sum'])
 
-    sum_arr = np.zeros(n_genes, dtype=float)
-    sumsq_arr = np.zeros(n_genes, dtype=float)
+    # only accumulate the statistics that were actually read
+    # (e.g. read_precomputed_stats does not read 'gt0', 'gt1');
+    # absent statistics are reported as zeros, as before
+    float_keys = ('sum', 'sumsq')
+    int_keys = ('gt0', 'gt1', 'ge1')
+    present = set(precomputed_stats[leaf_population[0]].keys())
+    for leaf_node in leaf_population:
+        present.intersection_update(precomputed_stats[leaf_node].keys())
 
-    gt0 = np.zeros(n_genes, dtype=int)
-    gt1 = np.zeros(n_genes, dtype=int)
-    ge1 = np.zeros(n_genes, dtype=int)
-    n_cells = 0
-    has_ge1 = True
+    accumulated = dict()
+    for k in float_keys:
+        accumulated[k] = np.zeros(n_genes, dtype=float)
+    for k in int_keys:
+        accumulated[k] = np.zeros(n_genes, dtype=int)
 
+    summed_keys = [k for k in float_keys+int_keys if k in present]
+
+    n_cells = 0
     for leaf_node in leaf_population:
         these_stats = precomputed_stats[leaf_node]
 
         if 'n_cells' in these_stats:
             n_cells += these_stats['n_cells']
 
-        if 'sum' in these_stats:
-            sum_arr += these_stats['sum']
-
-        if 'sumsq' in these_stats:
-            sumsq_arr += these_stats['sumsq']
+        for k in summed_keys:
+            accumulated[k] += these_stats[k]
 
-        if 'gt0' in these_stats:
-            gt0 += these_stats['gt0']
-
-        if 'gt1' in these_stats:
-            gt1 += these_stats['gt1']
-
-        if 'ge1' in these_stats:
-            ge1 += these_stats['ge1']
-        else:
-            has_ge1 = False
+    sum_arr = accumulated['sum']
+    sumsq_arr = accumulated['sumsq']
+    gt0 = accumulated['gt0']
+    gt1 = accumulated['gt1']
+    ge1 = accumulated['ge1']
+    has_ge1 = 'ge1' in present
 
     mu = sum_arr/max(1, n_cells)
-    var = (sumsq_arr-sum_arr**2/max(1, n_cells))/max(1, n_cells-1)
+
+    # var = (sumsq - sum**2/n)/(n-1), evaluated in place
+    var = np.square(sum_arr)
+    var /= max(1, n_cells)
+    np.subtract(sumsq_arr, var, out=var)
+    var /= max(1, n_cells-1)
 
     if not has_ge1:
         warnings.warn("precomputed stats file does not have 'ge1' data")
@@ -317,3 +464,111 @@ def aggregate_stats(
             result[k] = result[k].astype(new_dtype)
 
     return result
+
+
+def aggregate_stats_from_arrays(
+        leaf_populations,
+        leaf_to_row,
+        precomputed_arrays):
+    """
+    Equivalent to calling aggregate_stats on each of several
+    leaf populations, but working directly from the
+    (n_leaves, n_genes) arrays stored in a precomputed stats file.
+
+    Parameters
+    ----------
+    leaf_populations:
+        List of lists of leaf node names. Each list is one
+        population to aggregate.
+
+    leaf_to_row:
+        Dict mapping leaf node name to its row in the arrays
+        of precomputed_arrays
+
+    precomputed_arrays:
+        Dict mapping
+            'n_cells' -- (n_leaves,) array
+            'sum' -- (n_leaves, n_genes) array; units of log2(CPM+1)
+            'sumsq' -- (n_leaves, n_genes) array; units of log2(CPM+1)
+            'gt0' -- (n_leaves, n_genes) array
+            'gt1' -- (n_leaves, n_genes) array
+            'ge1' -- (n_leaves, n_genes) array
+        Only 'n_cells' and 'sum' are required.
+
+    Returns
+    -------
+    A list with one dict per population, structured like the
+    output of aggregate_stats.
+
+    Notes
+    -----
+    Each statistic is aggregated for all populations with a single
+    sparse (n_populations, n_leaves) membership matrix product, rather
+    than with one Python-level loop over leaves per population. The rows
+    of each population are added in the order they are listed, exactly
+    as in aggregate_stats.
+    """
+    n_leaves, n_genes = precomputed_arrays['sum'].shape
+    n_pop = len(leaf_populations)
+
+    indptr = np.zeros(n_pop+1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(pop) for pop in leaf_populations])
+    indices = np.array(
+        [leaf_to_row[leaf] for pop in leaf_populations for leaf in pop],
+        dtype=np.int64)
+
+    membership = dict()
+    for dtype in (float, int):
+        membership[dtype] = scipy.sparse.csr_matrix(
+            (np.ones(len(indices), dtype=dtype), indices, indptr),
+            shape=(n_pop, n_leaves))
+
+    n_cells = membership[int] @ precomputed_arrays['n_cells']
+    sum_arr = membership[float] @ precomputed_arrays['sum']
+    if 'sumsq' in precomputed_arrays:
+        sumsq_arr = membership[float] @ precomputed_arrays['sumsq']
+    else:
+        sumsq_arr = np.zeros((n_pop, n_genes), dtype=float)
+
+    # absent integer statistics are reported as zeros (as in
+    # aggregate_stats) without being aggregated
+    int_arrays = dict()
+    for k in ('gt0', 'gt1', 'ge1'):
+        if k in precomputed_arrays:
+            int_arrays[k] = membership[int] @ precomputed_arrays[k]
+        else:
+            int_arrays[k] = None
+
+    has_ge1 = int_arrays['ge1'] is not None
+    if not has_ge1:
+        warnings.warn("precomputed stats file does not have 'ge1' data")
+
+    mu = sum_arr/np.maximum(1, n_cells)[:, None]
+
+    # var = (sumsq - sum**2/n)/(n-1), evaluated in place
+    var = np.square(sum_arr, out=sum_arr)
+    var /= np.maximum(1, n_cells)[:, None]
+    np.subtract(sumsq_arr, var, out=var)
+    var /= np.maximum(1, n_cells-1)[:, None]
+
+    result = []
+    for i_pop in range(n_pop):
+        this = {'mean': mu[i_pop, :],
+                'var': var[i_pop, :],
+                'n_cells': n_cells[i_pop]}
+
+        for k in ('gt0', 'gt1', 'ge1'):
+            if int_arrays[k] is None:
+                if k == 'ge1':
+                    this[k] = None
+                else:
+                    this[k] = np.zeros(
+                        n_genes, dtype=choose_int_dtype((0, 0)))
+                continue
+            values = int_arrays[k][i_pop, :]
+            new_dtype = choose_int_dtype(
+                (values.min(), values.max()))
+            this[k] = values.astype(new_dtype)
+        result.append(this)
+
+    return result
@@ -715,14 +715,18 @@ def diffexp_score(
         var2=var2,
         n2=n2)
 
+    # negate in place rather than allocating a second
+    # (n_genes,) temporary for -1.0*log(pvalues)
     with np.errstate(divide='ignore'):
-        score = -1.0*np.log(pvalues)
+        score = np.log(pvalues)
+    np.negative(score, out=score)
     return score
 
 
 def rank_genes(
         scores,
-        validity):
+        validity,
+        n_top=None):
     """
     Parameters
     ----------
@@ -732,6 +736,10 @@ def rank_genes(
     validity:
         An np.ndarray of booleans; a flag indicating
         if the gene passed all of the validity tests
+    n_top:
+        Optional integer. If not None, only the n_top best
+        ranked genes are returned (found with np.argpartition,
+        so only those n_top genes are sorted).
 
     Returns
     -------
@@ -745,5 +753,9 @@ def rank_genes(
     max_score = scores.max()
     joint_stats = np.copy(scores)
     joint_stats[validity] += max_score+1.0
-    sorted_dex = np.argsort(-1.0*joint_stats)
+    joint_stats *= -1.0
+    if n_top is not None and n_top < len(joint_stats):
+        top_dex = np.argpartition(joint_stats, n_top)[:n_top]
+        return top_dex[np.argsort(joint_stats[top_dex])]
+    sorted_dex = np.argsort(joint_stats)
     return sorted_dex
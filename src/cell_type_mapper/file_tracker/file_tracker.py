@@ -1,5 +1,7 @@
+import os
 import pathlib
 import shutil
+import stat
 import tempfile
 
 from cell_type_mapper.utils.utils import (
@@ -60,8 +62,21 @@ class FileTracker(object):
         """
         file_path = pathlib.Path(file_path)
         file_str = f'{file_path.parent.name}/{file_path.name}'
-        if not file_path.is_file():
-            if file_path.exists():
+
+        # stat the path once (rather than issuing separate
+        # is_file/exists calls, which is slow on network
+        # filesystems)
+        try:
+            file_stat = os.stat(file_path)
+        except (FileNotFoundError, NotADirectoryError):
+            file_stat = None
+        is_file = (
+            file_stat is not None
+            and stat.S_ISREG(file_stat.st_mode)
+        )
+
+        if not is_file:
+            if file_stat is not None:
                 raise RuntimeError(
                     f"../{file_str}\nexists but is not a file")
             elif input_only:
@@ -75,10 +90,7 @@ class FileTracker(object):
 
         path_str = str(file_path.resolve().absolute())
 
-        if file_path.is_file():
-            self._file_pre_exists[path_str] = True
-        else:
-            self._file_pre_exists[path_str] = False
+        self._file_pre_exists[path_str] = is_file
 
         if self.tmp_dir is None:
             # if there is no tmp_dir, then nothing will be
@@ -94,7 +106,7 @@ class FileTracker(object):
                     prefix=f'{prefix}_',
                     suffix=suffix))
 
-        if file_path.is_file():
+        if is_file:
             shutil.copy(
                 src=file_path,
                 dst=tmp_path)
@@ -106,7 +118,7 @@ class FileTracker(object):
         tmp_path = str(tmp_path.resolve().absolute())
         self._path_to_location[path_str] = tmp_path
         if not input_only:
-            if not file_path.exists():
+            if not is_file:
                 self._to_write_out.append(path_str)
 
     def real_location(self, file_path):
@@ -35,7 +35,12 @@ class Collator():
         self.all_query_identifiers = all_query_identifiers
         self.normalization = normalization
         self.all_query_markers = all_query_markers
-        self.device = device
+        self.device = torch.device(device)
+
+        # page-locked host buffer through which batches are copied
+        # to the GPU (allocated lazily, once per worker process)
+        self._staging = None
+        self._copy_done = None
 
     def __call__(self, batch):
 
@@ -48,7 +53,7 @@ class Collator():
             data = data.astype(alt_dtype)
             data = torch.from_numpy(data)
 
-        data = data.to(device=self.device, non_blocking=True)
+        data = self._to_device(data)
 
         r0 = batch[0][1]
         r1 = batch[-1][-1]
@@ -67,6 +72,37 @@ class Collator():
 
         return data, r0, r1
 
+    def _to_device(self, data):
+        """
+        Copy the CPU tensor data to self.device.
+
+        CUDA copies are staged through a reusable page-locked buffer
+        so that they are genuinely asynchronous (copies out of
+        pageable memory are synchronous regardless of non_blocking).
+        """
+        if self.device.type != 'cuda':
+            return data.to(device=self.device)
+
+        if self._copy_done is not None:
+            # do not overwrite the staging buffer while the previous
+            # copy out of it may still be in flight
+            self._copy_done.synchronize()
+
+        if self._staging is None \
+                or self._staging.dtype != data.dtype \
+                or self._staging.numel() < data.numel():
+            self._staging = torch.empty(
+                data.numel(),
+                dtype=data.dtype,
+                pin_memory=True)
+
+        staging = self._staging[:data.numel()].view(data.shape)
+        staging.copy_(data)
+        data = staging.to(device=self.device, non_blocking=True)
+        self._copy_done = torch.cuda.Event()
+        self._copy_done.record()
+        return data
+
 
 def get_torch_dataloader(query_h5ad_path,
                          chunk_size,
@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 import h5py
 import json
 import time
@@ -169,6 +170,11 @@ def run_type_assignment_on_h5ad_gpu(
         all_query_markers = [
             all_query_identifiers[ii]
             for ii in in_file["all_query_markers"][()]]
+        all_reference_identifiers = json.loads(
+            in_file["reference_gene_names"][()].decode("utf-8"))
+        all_reference_markers = [
+            all_reference_identifiers[ii]
+            for ii in in_file["all_reference_markers"][()]]
 
     if is_cuda_available():
         gpu_index = 0
@@ -188,11 +194,14 @@ def run_type_assignment_on_h5ad_gpu(
                                       tmp_dir=tmp_dir)
 
     # get a CellByGeneMatrix of average expression
-    # profiles for each leaf in the taxonomy
+    # profiles for each leaf in the taxonomy (only the
+    # reference marker genes are ever used, so the other
+    # genes are not kept)
     leaf_node_matrix = get_leaf_means(
         taxonomy_tree=taxonomy_tree,
         precompute_path=precomputed_stats_path,
-        for_marker_selection=False)
+        for_marker_selection=False,
+        selected_genes=all_reference_markers)
 
     type_assignment_model = TypeAssignment()
 
@@ -221,35 +230,46 @@ def run_type_assignment_on_h5ad_gpu(
         prefix="Assignment: ")
     end = time.time()
     output_list = []
-    for ii, (data, r0, r1) in enumerate(dataloader):
-        # measure data loading time
-        data_time.update(time.time() - end)
-
-        query_cell_names_chunk = query_cell_names[r0:r1]
-
-        t = time.time()
-        assignment = type_assignment_model(data, config)
-        update_timer("type_assignment", t, timers)
-
-        t = time.time()
-        for idx in range(len(assignment)):
-            assignment[idx]['cell_id'] = query_cell_names_chunk[idx]
-        update_timer("loop", t, timers)
-
-        t = time.time()
-        if buffer_dir is not None:
-            this_output_path = buffer_dir / f"{r0}_{r1}_assignment.json"
-            save_results(assignment, this_output_path)
-        else:
-            output_list += assignment
-        update_timer("results", t, timers)
-
-        # measure elapsed time
-        batch_time.update(time.time() - end)
-        end = time.time()
-
-        if ii % print_freq == 0:
-            progress.display(ii + 1)
+
+    # serializing results to JSON is done on a background thread so
+    # that it overlaps with loading and assigning the next chunk
+    pending_writes = []
+    with ThreadPoolExecutor(max_workers=1) as results_writer:
+        for ii, (data, r0, r1) in enumerate(dataloader):
+            # measure data loading time
+            data_time.update(time.time() - end)
+
+            query_cell_names_chunk = query_cell_names[r0:r1]
+
+            t = time.time()
+            assignment = type_assignment_model(data, config)
+            update_timer("type_assignment", t, timers)
+
+            t = time.time()
+            for idx in range(len(assignment)):
+                assignment[idx]['cell_id'] = query_cell_names_chunk[idx]
+            update_timer("loop", t, timers)
+
+            t = time.time()
+            if buffer_dir is not None:
+                this_output_path = buffer_dir / f"{r0}_{r1}_assignment.json"
+                pending_writes.append(
+                    results_writer.submit(
+                        save_results, assignment, this_output_path))
+            else:
+                output_list += assignment
+            update_timer("results", t, timers)
+
+            # measure elapsed time
+            batch_time.update(time.time() - end)
+            end = time.time()
+
+            if ii % print_freq == 0:
+                progress.display(ii + 1)
+
+        # re-raise any exception encountered while writing
+        for future in pending_writes:
+            future.result()
 
     if buffer_dir is not None:
         path_list = [n for n in buffer_dir.iterdir()]
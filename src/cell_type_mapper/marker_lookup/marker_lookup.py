@@ -116,10 +116,8 @@ def map_aibs_marker_lookup(
     # create bespoke symbol-to-EnsemblID mapping that
     # uses AIBS conventions in cases where the gene symbol
     # maps to more than one EnsemblID
-    all_markers = set()
-    for k in raw_markers:
-        all_markers = all_markers.union(set(raw_markers[k]))
-    all_markers = list(all_markers)
+    all_markers = list({
+        gene for k in raw_markers for gene in raw_markers[k]})
 
     symbol_to_ensembl = map_aibs_gene_names(all_markers)
 
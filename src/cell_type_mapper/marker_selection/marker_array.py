@@ -493,9 +493,9 @@ class MarkerGeneArray(object):
 
         up = self.up_by_pair.get_genes_for_pair(pair_idx)
         down = self.down_by_pair.get_genes_for_pair(pair_idx)
-        assert len(set(up).intersection(set(down))) == 0
 
         up_mask[up] = True
+        assert not up_mask[down].any()
         marker_mask[up] = True
         marker_mask[down] = True
 
@@ -520,13 +520,14 @@ class MarkerGeneArray(object):
         times each gene occurs as an up-regulated marker within
         the list of pairs in pair_idx_list
         """
-        result = np.zeros(self.n_genes, dtype=int)
-        for pair_idx in pair_idx_list:
-            indices = self.up_by_pair.indices[
-                self.up_by_pair.indptr[pair_idx]:
-                self.up_by_pair.indptr[pair_idx+1]]
-            result[indices] += 1
-        return result
+        (_,
+         indices) = downsample_indptr(
+            indptr_old=self.up_by_pair.indptr,
+            indices_old=self.up_by_pair.indices,
+            indptr_to_keep=pair_idx_list)
+        return np.bincount(
+            indices.astype(int, copy=False),
+            minlength=self.n_genes)
 
     def down_mask_from_pair_idx(
             self,
@@ -547,13 +548,14 @@ class MarkerGeneArray(object):
         times each gene occurs as an down-regulated marker within
         the list of pairs in pair_idx_list
         """
-        result = np.zeros(self.n_genes, dtype=int)
-        for pair_idx in pair_idx_list:
-            indices = self.down_by_pair.indices[
-                self.down_by_pair.indptr[pair_idx]:
-                self.down_by_pair.indptr[pair_idx+1]]
-            result[indices] += 1
-        return result
+        (_,
+         indices) = downsample_indptr(
+            indptr_old=self.down_by_pair.indptr,
+            indices_old=self.down_by_pair.indices,
+            indptr_to_keep=pair_idx_list)
+        return np.bincount(
+            indices.astype(int, copy=False),
+            minlength=self.n_genes)
 
     def up_regulated_gene_batch(self, gene0, gene1):
         """
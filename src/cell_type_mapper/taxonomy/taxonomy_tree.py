@@ -1,7 +1,14 @@
 import copy
+import functools
 import h5py
 import json
 import pathlib
+import types
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 from cell_type_mapper.utils.utils import (
     clean_for_json,
@@ -32,10 +39,31 @@ class TaxonomyTree(object):
         Probably, users will not instantiate this class
         directly, instead using one of the classmethods
         """
-        self._data = copy.deepcopy(data)
+        self._initialize(data=copy.deepcopy(data))
+
+    @classmethod
+    def _from_owned_data(cls, data):
+        """
+        Instantiate from a dict that was built (or parsed from JSON)
+        solely for this tree and is referenced nowhere else. The
+        dict is adopted as-is rather than deep-copied; it is still
+        validated.
+        """
+        tree = cls.__new__(cls)
+        tree._initialize(data=data)
+        return tree
+
+    def _initialize(self, data):
+        self._data = data
         validate_taxonomy_tree(self._data)
         self._child_to_parent = get_child_to_parent(self._data)
 
+        # self._data is never modified after this point, so the
+        # results of leaves_to_compare and leaf_to_child can be
+        # memoized per parent
+        self._leaves_to_compare_cache = dict()
+        self._leaf_to_child_cache = dict()
+
     def __eq__(self, other):
         """
         Ignore keys 'metadata' and 'alias_mapping'
@@ -53,6 +81,19 @@ class TaxonomyTree(object):
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __getstate__(self):
+        """
+        Do not pickle the memoized per-parent results; the
+        leaf_to_child results are read-only mappingproxy objects
+        (which cannot be pickled) and all of them are cheap to
+        rebuild. TaxonomyTree is passed to worker
+        processes, so it must remain picklable.
+        """
+        state = self.__dict__.copy()
+        state['_leaves_to_compare_cache'] = dict()
+        state['_leaf_to_child_cache'] = dict()
+        return state
+
     def is_equal_to(self, other):
         """
         Compare to another taxonomy tree, only looking
@@ -91,8 +132,8 @@ class TaxonomyTree(object):
             a JSON-serialized TaxonomyTree)
         """
         with h5py.File(stats_path, 'r') as src:
-            return cls(
-                data=json.loads(src['taxonomy_tree'][()].decode('utf-8')))
+            serialized_tree = src['taxonomy_tree'][()]
+        return cls.from_str(serialized_tree.decode('utf-8'))
 
     @classmethod
     def from_h5ad(cls, h5ad_path, column_hierarchy):
@@ -126,8 +167,8 @@ class TaxonomyTree(object):
         """
         Instantiate from a JSON serialized dict
         """
-        return cls(
-            data=json.loads(serialized_dict))
+        return cls._from_owned_data(
+            data=_parse_json(serialized_dict))
 
     @classmethod
     def from_json_file(cls, json_path):
@@ -135,8 +176,9 @@ class TaxonomyTree(object):
         Instantiate from a file containing the JSON-serialized
         tree
         """
-        return cls(
-            data=json.load(open(json_path, 'rb')))
+        with open(json_path, 'rb') as src:
+            data = _parse_json(src.read())
+        return cls._from_owned_data(data=data)
 
     @classmethod
     def from_data_release(
@@ -306,7 +348,7 @@ class TaxonomyTree(object):
         new_data['hierarchy'] = [self._data['hierarchy'][-1]]
         for level in self._data['hierarchy'][:-1]:
             new_data.pop(level)
-        return TaxonomyTree(data=new_data)
+        return TaxonomyTree._from_owned_data(data=new_data)
 
     def _drop_level(self, level_to_drop, allow_leaf=False):
         """
@@ -348,7 +390,7 @@ class TaxonomyTree(object):
         if level_idx == 0:
             new_data['hierarchy'].pop(0)
             new_data.pop(level_to_drop)
-            return TaxonomyTree(data=new_data)
+            return TaxonomyTree._from_owned_data(data=new_data)
 
         parent_idx = level_idx - 1
         parent_level = self.hierarchy[parent_idx]
@@ -362,7 +404,7 @@ class TaxonomyTree(object):
         new_data.pop(level_to_drop)
         new_data[parent_level] = new_parent
         new_data['hierarchy'].pop(level_idx)
-        return TaxonomyTree(data=new_data)
+        return TaxonomyTree._from_owned_data(data=new_data)
 
     def drop_level(self, level_to_drop):
         """
@@ -381,7 +423,9 @@ class TaxonomyTree(object):
 
     @property
     def hierarchy(self):
-        return copy.deepcopy(self._data['hierarchy'])
+        # the levels are strings, so a shallow copy is enough to
+        # protect self._data from callers that modify the list
+        return list(self._data['hierarchy'])
 
     def nodes_at_level(self, this_level):
         """
@@ -399,17 +443,18 @@ class TaxonomyTree(object):
         (level, node)
         """
         this = dict()
+        hierarchy = self._data['hierarchy']
         hierarchy_idx = None
-        for idx in range(len(self.hierarchy)):
-            if self.hierarchy[idx] == level:
+        for idx in range(len(hierarchy)):
+            if hierarchy[idx] == level:
                 hierarchy_idx = idx
                 break
         for parent_level_idx in range(hierarchy_idx-1, -1, -1):
-            current = self.hierarchy[parent_level_idx]
+            current = hierarchy[parent_level_idx]
             if len(this) == 0:
                 this[current] = self._child_to_parent[level][node]
             else:
-                prev = self.hierarchy[parent_level_idx+1]
+                prev = hierarchy[parent_level_idx+1]
                 prev_node = this[prev]
                 this[current] = self._child_to_parent[prev][prev_node]
         return this
@@ -419,7 +464,7 @@ class TaxonomyTree(object):
         Return the immediate children of the specified node
         """
         if level is None and node is None:
-            return list(self._data[self.hierarchy[0]].keys())
+            return list(self._data[self._data['hierarchy'][0]].keys())
         if level not in self._data.keys():
             raise RuntimeError(
                 f"{level} is not a valid level\ntry {self.hierarchy}")
@@ -439,11 +484,15 @@ class TaxonomyTree(object):
         """
         List of valid leaf names
         """
-        return list(self._data[self.leaf_level].keys())
+        return list(self._all_leaves)
 
-    @property
+    @functools.cached_property
+    def _all_leaves(self):
+        return tuple(self._data[self.leaf_level].keys())
+
+    @functools.cached_property
     def n_leaves(self):
-        return len(self.all_leaves)
+        return len(self._all_leaves)
 
     @property
     def as_leaves(self):
@@ -452,7 +501,21 @@ class TaxonomyTree(object):
             level ('class', 'subclass', 'cluster', etc.)
                 -> node1 (a node on that level of the tree)
                     -> list of leaf nodes making up that node
-        """
+
+        Note
+        ----
+        The lookup is computed once per tree, but each call
+        returns a fresh copy that callers may modify; do not
+        call this repeatedly in a loop.
+        """
+        return {
+            level: {
+                node: list(leaves)
+                for node, leaves in level_lookup.items()}
+            for level, level_lookup in self._as_leaves.items()}
+
+    @functools.cached_property
+    def _as_leaves(self):
         return convert_tree_to_leaves(self._data)
 
     @property
@@ -460,15 +523,24 @@ class TaxonomyTree(object):
         """
         Return all pairs of nodes that are on the same level
         """
-        return get_all_pairs(self._data)
+        return list(self._siblings)
+
+    @functools.cached_property
+    def _siblings(self):
+        return tuple(get_all_pairs(self._data))
 
     @property
     def leaf_to_cells(self):
         """
         Return the lookup from leaf name to cells in the
         cell by gene file
+
+        Note
+        ----
+        This is a read-only view onto the tree's own data,
+        not a copy; do not modify the lists of cells it contains.
         """
-        return copy.deepcopy(self._data[self.leaf_level])
+        return types.MappingProxyType(self._data[self.leaf_level])
 
     @property
     def all_parents(self):
@@ -476,12 +548,16 @@ class TaxonomyTree(object):
         Return a list of all (level, node) tuples indicating
         valid parents in this taxonomy
         """
+        return list(self._all_parents)
+
+    @functools.cached_property
+    def _all_parents(self):
         parent_list = [None]
         for level in self._data['hierarchy'][:-1]:
             for node in self._data[level]:
                 parent = (level, node)
                 parent_list.append(parent)
-        return parent_list
+        return tuple(parent_list)
 
     def rows_for_leaf(self, leaf_node):
         """
@@ -561,6 +637,11 @@ class TaxonomyTree(object):
         A list of (level, leaf_node1, leaf_node2) tuples indicating
         the leaf nodes that need to be compared.
         """
+        if parent_node is not None:
+            parent_node = tuple(parent_node)
+        if parent_node in self._leaves_to_compare_cache:
+            return list(self._leaves_to_compare_cache[parent_node])
+
         if parent_node is not None:
             this_level = parent_node[0]
             this_node = parent_node[1]
@@ -577,7 +658,53 @@ class TaxonomyTree(object):
 
         result = get_all_leaf_pairs(
             taxonomy_tree=self._data,
-            parent_node=parent_node)
+            parent_node=parent_node,
+            tree_as_leaves=self._as_leaves)
+        self._leaves_to_compare_cache[parent_node] = tuple(result)
+        return result
+
+    def leaf_to_child(self, parent_node):
+        """
+        Map every leaf descended from parent_node onto the
+        immediate child of parent_node from which it descends.
+
+        Parameters
+        ----------
+        parent_node:
+           Either None or a (level, node) tuple specifying
+           the parent whose children we are choosing between
+           (None means we are at the root level)
+
+        Returns
+        -------
+        A read-only dict mapping leaf node to immediate child of
+        parent_node, with the leaves (keys) in sorted order.
+        Results are memoized per parent_node.
+        """
+        if parent_node is not None:
+            parent_node = tuple(parent_node)
+        if parent_node in self._leaf_to_child_cache:
+            return self._leaf_to_child_cache[parent_node]
+
+        hierarchy = self._data['hierarchy']
+        if parent_node is None:
+            child_level = hierarchy[0]
+            immediate_children = self.nodes_at_level(child_level)
+        else:
+            child_level = hierarchy[hierarchy.index(parent_node[0])+1]
+            immediate_children = self.children(
+                level=parent_node[0],
+                node=parent_node[1])
+
+        tree_as_leaves = self._as_leaves
+        result = dict()
+        for child in sorted(immediate_children):
+            for leaf in tree_as_leaves[child_level][child]:
+                result[leaf] = child
+
+        result = types.MappingProxyType(
+            {leaf: result[leaf] for leaf in sorted(result)})
+        self._leaf_to_child_cache[parent_node] = result
         return result
 
     def backfill_assignments(self, assignments):
@@ -613,7 +740,7 @@ class TaxonomyTree(object):
         -----
         In addition to being returned, assignments will be altered in place.
         """
-        reverse_hierarchy = copy.deepcopy(self.hierarchy)
+        reverse_hierarchy = self.hierarchy
         reverse_hierarchy.reverse()
         for child_level, parent_level in zip(reverse_hierarchy[:-1],
                                              reverse_hierarchy[1:]):
@@ -641,3 +768,19 @@ class TaxonomyTree(object):
                 cell[parent_level] = new_data
 
         return assignments
+
+
+def _parse_json(serialized):
+    """
+    Parse a JSON document (str or bytes), using orjson if it is
+    installed (it is several times faster than the json module on
+    large taxonomies). orjson rejects the non-standard NaN/Infinity
+    literals that json.dumps can emit, so fall back to json if
+    orjson cannot parse the document.
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(serialized)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(serialized)
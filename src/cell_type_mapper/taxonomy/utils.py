@@ -1,6 +1,7 @@
 import copy
 import itertools
 import numpy as np
+import pandas as pd
 import warnings
 
 from cell_type_mapper.utils.anndata_utils import (
@@ -151,6 +152,82 @@ def get_taxonomy_tree(
     return tree
 
 
+def get_taxonomy_tree_from_obs(
+        obs: pd.DataFrame,
+        column_hierarchy: list):
+    """
+    Convert an obs DataFrame into a taxonomy tree
+
+    Parameters
+    ----------
+    obs:
+        The obs DataFrame of an anndata file.
+
+    column_hierarcy:
+        The list of columns denoting taxonomic classes,
+        ordered from highest (parent) to lowest (child).
+
+    Returns
+    -------
+    tree indicating inheritance structure of taxonomy
+
+    Notes
+    -----
+    Produces the same tree as get_taxonomy_tree run on
+    obs.to_dict(orient='records'), but works on one column at
+    a time rather than materializing a dict for every cell.
+    """
+    if 'hierarchy' in column_hierarchy:
+        raise RuntimeError(
+            "Cannot use hierarchy as a taxonomic row; "
+            "that is where tree will store the ordered "
+            "list of taxonomy names")
+
+    # factorize each column so that nodes are numbered in order
+    # of first appearance (the order in which get_taxonomy_tree
+    # would encounter them); only the unique values are cast to str
+    level_to_codes = dict()
+    level_to_labels = dict()
+    for level in column_hierarchy:
+        codes, uniques = pd.factorize(obs[level], use_na_sentinel=False)
+        level_to_codes[level] = codes
+        level_to_labels[level] = [str(u) for u in uniques]
+
+    tree = dict()
+    tree["hierarchy"] = column_hierarchy
+
+    for parent_level, child_level in zip(column_hierarchy[:-1],
+                                         column_hierarchy[1:]):
+        parent_labels = level_to_labels[parent_level]
+        child_labels = level_to_labels[child_level]
+        tree[parent_level] = {label: set() for label in parent_labels}
+        pairs = np.unique(
+            level_to_codes[parent_level].astype(np.int64)*len(child_labels)
+            + level_to_codes[child_level])
+        for parent_code, child_code in zip(pairs // len(child_labels),
+                                           pairs % len(child_labels)):
+            tree[parent_level][parent_labels[parent_code]].add(
+                child_labels[child_code])
+
+    leaf_column = column_hierarchy[-1]
+    leaf_codes = level_to_codes[leaf_column]
+    sorted_rows = np.argsort(leaf_codes, kind='stable')
+    bounds = np.cumsum(
+        np.bincount(leaf_codes,
+                    minlength=len(level_to_labels[leaf_column])))
+    tree[leaf_column] = {
+        label: sorted_rows[i0:i1].tolist()
+        for label, i0, i1 in zip(level_to_labels[leaf_column],
+                                 np.concatenate([[0], bounds[:-1]]),
+                                 bounds)}
+
+    # restore the column_hierarchy ordering of keys
+    tree = {k: tree[k] for k in column_hierarchy + ["hierarchy"]}
+
+    validate_taxonomy_tree(tree)
+    return tree
+
+
 def get_taxonomy_tree_from_h5ad(
         h5ad_path,
         column_hierarchy):
@@ -158,8 +235,8 @@ def get_taxonomy_tree_from_h5ad(
     Get taxonomy tree from an h5ad file
     """
     obs = read_df_from_h5ad(h5ad_path, 'obs')
-    taxonomy_tree = get_taxonomy_tree(
-        obs_records=obs.to_dict(orient='records'),
+    taxonomy_tree = get_taxonomy_tree_from_obs(
+        obs=obs,
         column_hierarchy=column_hierarchy)
     return taxonomy_tree
 
@@ -353,7 +430,8 @@ def get_all_pairs(taxonomy_tree):
 
 def get_all_leaf_pairs(
         taxonomy_tree,
-        parent_node):
+        parent_node,
+        tree_as_leaves=None):
     """
     Find all of the leaf nodes that need to be compared
     under a given parent.
@@ -375,6 +453,11 @@ def get_all_leaf_pairs(
 
         If parent_node is None, then assume that we are selecting
         marker genes for the highest level of the taxonomy
+    tree_as_leaves:
+        Optional result of convert_tree_to_leaves(taxonomy_tree).
+        If None, it is computed here (callers making repeated
+        calls on the same taxonomy should compute it once and
+        pass it in).
 
     Returns
     -------
@@ -410,7 +493,8 @@ def get_all_leaf_pairs(
         child_level = hierarchy[0]
 
     result = []
-    tree_as_leaves = convert_tree_to_leaves(taxonomy_tree)
+    if tree_as_leaves is None:
+        tree_as_leaves = convert_tree_to_leaves(taxonomy_tree)
     for sibling_pair in itertools.combinations(siblings, 2):
         leaf_list_0 = tree_as_leaves[child_level][sibling_pair[0]]
         leaf_list_1 = tree_as_leaves[child_level][sibling_pair[1]]
@@ -65,11 +65,7 @@ def run_mapping(config, output_path, log_path=None):
     for pth in (output_path, log_path):
         if pth is not None:
             if not pth.exists():
-                try:
-                    with open(pth, 'w') as out_file:
-                        out_file.write('junk')
-                    pth.unlink()
-                except FileNotFoundError:
+                if not os.access(pth.parent, os.W_OK):
                     raise RuntimeError(
                         "unable to write to "
                         f"{pth.resolve().absolute()}")
@@ -95,7 +91,7 @@ def run_mapping(config, output_path, log_path=None):
         output["config"] = config
         output["log"] = log.log
         with open(output_path, "w") as out_file:
-            out_file.write(json.dumps(output, indent=2))
+            json.dump(output, out_file, indent=2)
 
 
 def _run_mapping(config, tmp_dir, log):
@@ -182,6 +182,11 @@ def run_type_assignment_on_h5ad_cpu(
         all_query_markers = [
             all_query_identifiers[ii]
             for ii in in_file["all_query_markers"][()]]
+        all_reference_identifiers = json.loads(
+            in_file["reference_gene_names"][()].decode("utf-8"))
+        all_reference_markers = [
+            all_reference_identifiers[ii]
+            for ii in in_file["all_reference_markers"][()]]
 
     chunk_iterator = AnnDataRowIterator(
         h5ad_path=query_h5ad_path,
@@ -203,11 +208,14 @@ def run_type_assignment_on_h5ad_cpu(
     t0 = time.time()
 
     # get a CellByGeneMatrix of average expression
-    # profiles for each leaf in the taxonomy
+    # profiles for each leaf in the taxonomy (only the
+    # reference marker genes are ever used, so the other
+    # genes are not kept)
     leaf_node_matrix = get_leaf_means(
         taxonomy_tree=taxonomy_tree,
         precompute_path=precomputed_stats_path,
-        for_marker_selection=False)
+        for_marker_selection=False,
+        selected_genes=all_reference_markers)
 
     chunk_index = -1
     for chunk in chunk_iterator:
@@ -343,11 +343,12 @@ def create_marker_gene_lookup_from_mapping(
     # assemble dict mapping reference marker path to the a
     # list of parent nodes valid for that reference marker file
     marker_config = dict()
+    tree_as_leaves = taxonomy_tree.as_leaves
     for parent in taxonomy_tree.all_parents:
         if parent is None:
             children = taxonomy_tree.all_leaves
         else:
-            children = taxonomy_tree.as_leaves[parent[0]][parent[1]]
+            children = tree_as_leaves[parent[0]][parent[1]]
 
         this_census = dict()
         for child in children:
@@ -514,27 +515,44 @@ def write_query_markers_to_h5(
 
     parent_node_list = list(marker_lookup.keys())
     parent_node_list.sort()
-    with h5py.File(output_cache_path, 'w') as out_file:
-        out_file.create_dataset(
-            'parent_node_list',
-            data=json.dumps(parent_node_list).encode('utf-8'))
 
     query_name_to_int = {
         n: ii for ii, n in enumerate(query_gene_names)}
     reference_name_to_int = {
         n: ii for ii, n in enumerate(reference_gene_names)}
 
+    # convert each parent's marker genes into (reference, query)
+    # index arrays sorted on the reference index
+    parent_to_idx = dict()
+    for parent_grp in marker_lookup:
+        gene_list = marker_lookup[parent_grp]
+        these_reference = np.fromiter(
+            (reference_name_to_int[gene] for gene in gene_list),
+            dtype=int,
+            count=len(gene_list))
+        these_query = np.fromiter(
+            (query_name_to_int[gene] for gene in gene_list),
+            dtype=int,
+            count=len(gene_list))
+        sorted_dex = np.argsort(these_reference)
+        parent_to_idx[parent_grp] = (
+            these_reference[sorted_dex],
+            these_query[sorted_dex])
+
     # all of the indexes of genes that get used as markers
-    query_genes = set()
-    reference_genes = set()
-    for parent in marker_lookup:
-        for gene in marker_lookup[parent]:
-            query_genes.add(query_name_to_int[gene])
-            reference_genes.add(reference_name_to_int[gene])
-    query_genes = np.sort(np.array(list(query_genes)))
-    reference_genes = np.sort(np.array(list(reference_genes)))
-
-    with h5py.File(output_cache_path, "a") as cache_file:
+    if len(parent_to_idx) > 0:
+        reference_genes = np.unique(
+            np.concatenate([idx[0] for idx in parent_to_idx.values()]))
+        query_genes = np.unique(
+            np.concatenate([idx[1] for idx in parent_to_idx.values()]))
+    else:
+        reference_genes = np.zeros(0, dtype=int)
+        query_genes = np.zeros(0, dtype=int)
+
+    with h5py.File(output_cache_path, 'w') as cache_file:
+        cache_file.create_dataset(
+            'parent_node_list',
+            data=json.dumps(parent_node_list).encode('utf-8'))
         cache_file.create_dataset(
             "all_query_markers",
             data=query_genes)
@@ -548,26 +566,15 @@ def write_query_markers_to_h5(
             "reference_gene_names",
             data=json.dumps(reference_gene_names).encode('utf-8'))
 
-        for parent_grp in marker_lookup:
+        for parent_grp, (these_reference, these_query) in \
+                parent_to_idx.items():
             out_grp = cache_file.create_group(parent_grp)
-            these_reference = []
-            these_query = []
-            for gene in marker_lookup[parent_grp]:
-                these_reference.append(reference_name_to_int[gene])
-                these_query.append(query_name_to_int[gene])
-            if len(these_reference) > 0:
-                these_reference = np.array(these_reference)
-                these_query = np.array(these_query)
-                sorted_dex = np.argsort(these_reference)
-                these_reference = these_reference[sorted_dex]
-                these_query = these_query[sorted_dex]
-
             out_grp.create_dataset(
                 'reference',
-                data=np.array(these_reference))
+                data=these_reference)
             out_grp.create_dataset(
                 'query',
-                data=np.array(these_query))
+                data=these_query)
 
 
 def serialize_markers(
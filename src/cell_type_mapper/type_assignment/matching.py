@@ -1,9 +1,10 @@
+import functools
 import h5py
 import json
-import numpy as np
+import os
 
 from cell_type_mapper.diff_exp.score_utils import (
-    read_precomputed_stats)
+    read_precomputed_leaf_means)
 
 from cell_type_mapper.cell_by_gene.cell_by_gene import (
     CellByGeneMatrix)
@@ -14,7 +15,8 @@ def assemble_query_data(
         mean_profile_matrix,
         taxonomy_tree,
         marker_cache_path,
-        parent_node):
+        parent_node,
+        dtype=None):
     """
     Assemble all of the data needed to select a taxonomy node
     for a collection of cells.
@@ -38,6 +40,12 @@ def assemble_query_data(
         Either None (if we are querying from root) or a
         (parent_level, parent_node) tuple indicating the parent node
         in the taxonomy whose children we are choosing between.
+    dtype:
+        Optional floating point dtype to which the returned
+        query and reference data are cast (e.g. np.float32, which
+        halves the memory traffic of the correlation step and lets
+        it use single precision BLAS). If None, the data keep the
+        dtype of full_query_data and mean_profile_matrix.
 
     Returns
     --------
@@ -53,49 +61,28 @@ def assemble_query_data(
         'reference_data's rows)
     """
 
-    tree_as_leaves = taxonomy_tree.as_leaves
-    hierarchy = taxonomy_tree.hierarchy
-    level_to_idx = {level: idx for idx, level in enumerate(hierarchy)}
-
     if parent_node is None:
         parent_grp = 'None'
-        immediate_children = taxonomy_tree.nodes_at_level(hierarchy[0])
-        child_level = hierarchy[0]
-
     else:
         parent_grp = f"{parent_node[0]}/{parent_node[1]}"
 
-        immediate_children = taxonomy_tree.children(
-               level=parent_node[0],
-               node=parent_node[1])
+    leaf_to_type = taxonomy_tree.leaf_to_child(parent_node)
 
-        child_level = hierarchy[level_to_idx[parent_node[0]]+1]
+    marker_cache = _read_marker_cache(marker_cache_path)
 
-    immediate_children.sort()
-
-    leaf_to_type = dict()
-    for child in immediate_children:
-        for leaf in tree_as_leaves[child_level][child]:
-            leaf_to_type[leaf] = child
+    if parent_grp not in marker_cache['groups']:
+        raise RuntimeError(
+            f"{parent_grp} not in marker cache path ({marker_cache_path})")
 
-    with h5py.File(marker_cache_path, 'r', swmr=True) as in_file:
-        if parent_grp not in in_file:
+    for k in ("reference", "query"):
+        if f"{parent_grp}/{k}" not in marker_cache['datasets']:
             raise RuntimeError(
-                f"{parent_grp} not in marker cache path ({marker_cache_path})")
-
-        this_grp = in_file[parent_grp]
-
-        for k in ("reference", "query"):
-            if k not in this_grp:
-                raise RuntimeError(
-                    f"'{k}' not in group '{parent_grp}' of marker cache path")
+                f"'{k}' not in group '{parent_grp}' of marker cache path")
 
-        reference_markers = this_grp['reference'][()]
-        raw_query_markers = this_grp['query'][()]
-        all_ref_identifiers = json.loads(
-            in_file["reference_gene_names"][()].decode("utf-8"))
-        all_query_identifiers = json.loads(
-            in_file["query_gene_names"][()].decode("utf-8"))
+    reference_markers = marker_cache['datasets'][f"{parent_grp}/reference"]
+    raw_query_markers = marker_cache['datasets'][f"{parent_grp}/query"]
+    all_ref_identifiers = marker_cache['reference_gene_names']
+    all_query_identifiers = marker_cache['query_gene_names']
 
     # select only the desired query marker genes
 
@@ -103,23 +90,22 @@ def assemble_query_data(
                      for ii in raw_query_markers]
 
     query_data = full_query_data.downsample_genes(
-        selected_genes=query_markers)
+        selected_genes=query_markers,
+        dtype=dtype)
 
     reference_marker_identifiers = [
         all_ref_identifiers[ii] for ii in reference_markers]
 
-    children = list(leaf_to_type.keys())
-    children.sort()
+    # leaf_to_child returns the leaves in sorted order
+    children = list(leaf_to_type)
 
-    reference_data = mean_profile_matrix.downsample_cells(
-        selected_cells=children)
+    reference_data = mean_profile_matrix.downsample_cells_and_genes(
+        selected_cells=children,
+        selected_genes=reference_marker_identifiers,
+        dtype=dtype)
 
-    reference_data.downsample_genes_in_place(
-        selected_genes=reference_marker_identifiers)
-
-    reference_types = []
-    for ii, child in enumerate(reference_data.cell_identifiers):
-        reference_types.append(leaf_to_type[child])
+    reference_types = [
+        leaf_to_type[child] for child in reference_data.cell_identifiers]
 
     if query_data.gene_identifiers != reference_data.gene_identifiers:
         raise RuntimeError(
@@ -141,10 +127,69 @@ def assemble_query_data(
             'reference_types': reference_types}
 
 
+def _read_marker_cache(marker_cache_path):
+    """
+    Read the full contents of the marker cache at marker_cache_path.
+
+    assemble_query_data is called once per parent node in the
+    taxonomy, so the contents are read in a single pass the first
+    time a file is seen and memoized. Only the most recently read
+    file is kept (a type assignment run uses one marker cache), so
+    memory is not pinned for every file a process has touched.
+    The memoized contents are keyed on the file's path, inode, size
+    and modification time so that a cache rewritten at the same path
+    is read again. The returned arrays are shared between callers and
+    are therefore read-only.
+
+    Returns
+    -------
+    A dict
+        'groups' -> the set of group names in the file
+        'datasets' -> a dict mapping dataset name to its contents
+        'reference_gene_names' -> the decoded list of reference genes
+        'query_gene_names' -> the decoded list of query genes
+    """
+    stat = os.stat(marker_cache_path)
+    return _read_marker_cache_contents(
+        marker_cache_path=str(marker_cache_path),
+        file_key=(stat.st_ino, stat.st_size, stat.st_mtime_ns))
+
+
+@functools.lru_cache(maxsize=1)
+def _read_marker_cache_contents(marker_cache_path, file_key):
+    """
+    Do the actual reading for _read_marker_cache. file_key is
+    only used to key the memoization.
+    """
+    gene_name_keys = ('reference_gene_names', 'query_gene_names')
+    groups = set()
+    datasets = dict()
+
+    def _visit(name, obj):
+        if isinstance(obj, h5py.Group):
+            groups.add(name)
+        elif name not in gene_name_keys:
+            value = obj[()]
+            if hasattr(value, 'setflags'):
+                value.setflags(write=False)
+            datasets[name] = value
+
+    with h5py.File(marker_cache_path, 'r', swmr=True) as in_file:
+        in_file.visititems(_visit)
+        result = {
+            k: json.loads(in_file[k][()].decode("utf-8"))
+            for k in gene_name_keys}
+
+    result['groups'] = groups
+    result['datasets'] = datasets
+    return result
+
+
 def get_leaf_means(
         taxonomy_tree,
         precompute_path,
-        for_marker_selection=True):
+        for_marker_selection=True,
+        selected_genes=None):
     """
     Returns a CellByGeneMatrix in which each cell
     is a cluster and the .data array contains
@@ -152,31 +197,23 @@ def get_leaf_means(
 
     If for_marker_selection is True and 'sumsq' or 'ge1' are missing,
     raise an error
+
+    If selected_genes is not None, only those genes (in that
+    order) are kept.
     """
-    precomputed_stats = read_precomputed_stats(
-        precomputed_stats_path=precompute_path,
-        taxonomy_tree=taxonomy_tree,
-        for_marker_selection=for_marker_selection)
     leaf_names = taxonomy_tree.all_leaves
     leaf_names.sort()
-    result = dict()
-
-    n_cells = len(leaf_names)
-    data = None
 
-    for i_leaf, leaf in enumerate(leaf_names):
-        # gt1/0 threshold do not actually matter here
-        leaf_key = f'{taxonomy_tree.leaf_level}/{leaf}'
-        stats = precomputed_stats['cluster_stats'][leaf_key]
-        this_mean = stats['mean']
-        if data is None:
-            n_genes = len(this_mean)
-            data = np.zeros((n_cells, n_genes))
-        data[i_leaf, :] = this_mean
+    (gene_names,
+     data) = read_precomputed_leaf_means(
+        precomputed_stats_path=precompute_path,
+        leaf_names=leaf_names,
+        for_marker_selection=for_marker_selection,
+        selected_genes=selected_genes)
 
     result = CellByGeneMatrix(
         data=data,
-        gene_identifiers=precomputed_stats['gene_names'],
+        gene_identifiers=gene_names,
         cell_identifiers=leaf_names,
         normalization="log2CPM")
 
@@ -7,13 +7,18 @@ from cell_type_mapper.utils.utils import (
     mkstemp_clean,
     _clean_up)
 
+from cell_type_mapper.utils.multiprocessing_utils import (
+    DummyLock)
+
 
 def csc_to_csr_on_disk(
         csc_group,
         csr_path,
         array_shape,
         max_gb=15,
-        use_data_array=True):
+        use_data_array=True,
+        output_lock=None,
+        progress_callback=None):
     """
     Convert a large csc matrix to an on-disk
     csr matrix at the specified location
@@ -32,6 +37,9 @@ def csc_to_csr_on_disk(
 
     if use_data_array is False, then there is no data array and
     we are just transposing the indices and indptr arrays
+
+    output_lock and progress_callback are passed through to
+    transpose_sparse_matrix_on_disk
     """
 
     if use_data_array:
@@ -45,7 +53,9 @@ def csc_to_csr_on_disk(
         data_handle=data_handle,
         indices_max=array_shape[0],
         max_gb=max_gb,
-        output_path=csr_path)
+        output_path=csr_path,
+        output_lock=output_lock,
+        progress_callback=progress_callback)
 
 
 def transpose_by_way_of_disk(
@@ -83,13 +93,12 @@ def transpose_by_way_of_disk(
                 suffix='.h5'))
 
         with h5py.File(src_path, 'w') as dst:
-            chunks = min(len(indices), 10000)
-            if chunks == 0:
-                chunks = None
             dst.create_dataset(
                 'indices',
                 data=indices,
-                chunks=chunks)
+                chunks=_get_chunks_for_1d(
+                    n_elements=len(indices),
+                    this_dtype=np.asarray(indices).dtype))
             dst.create_dataset(
                 'indptr',
                 data=indptr)
@@ -121,7 +130,36 @@ def transpose_sparse_matrix_on_disk(
         max_gb,
         output_path,
         verbose=True,
-        indices_slice=None):
+        indices_slice=None,
+        output_lock=None,
+        progress_callback=None):
+    """
+    Transpose a sparse matrix, writing the result to the HDF5
+    file at output_path.
+
+    The output is written in bands of contiguous rows (of the
+    transposed matrix), in order.
+
+    output_lock is an optional lock acquired whenever output_path
+    is open (so that another thread can safely read the rows that
+    have already been written).
+
+    progress_callback is an optional function that is called with
+    0 once output_path (including its indptr) has been created, and
+    then with the number of rows of the transposed matrix that are
+    complete on disk every time a band is written.
+
+    The output datasets are deliberately left uncompressed. The
+    output is a scratch file that is read back in row batches,
+    often while it is still being written, and batch boundaries do
+    not line up with HDF5 chunks. With compression, every batch
+    decompresses one or two whole chunks. In testing, shuffle+lzf
+    roughly halved the file size but made reading it back about
+    30x slower.
+    """
+
+    if output_lock is None:
+        output_lock = DummyLock()
 
     use_data_array = (data_handle is not None)
 
@@ -141,29 +179,31 @@ def transpose_sparse_matrix_on_disk(
     if use_data_array:
         data_dtype = data_handle.dtype
 
-    with h5py.File(output_path, 'w') as dst:
+    with output_lock, h5py.File(output_path, 'w') as dst:
 
         if use_data_array:
             dst.create_dataset(
                 'data',
                 shape=n_non_zero,
                 dtype=data_dtype,
-                chunks=(min(n_non_zero, 1000000),))
+                chunks=_get_chunks_for_1d(
+                    n_elements=n_non_zero,
+                    this_dtype=data_dtype))
 
-        if n_non_zero > 0:
-            chunks = (min(n_non_zero, 1000000),)
-        else:
-            chunks = None
         dst.create_dataset(
             'indices',
             shape=n_non_zero,
             dtype=col_dtype,
-            chunks=chunks)
+            chunks=_get_chunks_for_1d(
+                n_elements=n_non_zero,
+                this_dtype=col_dtype))
 
-    with h5py.File(output_path, 'a') as dst:
         dst.create_dataset(
             'indptr', data=csr_indptr)
 
+    if progress_callback is not None:
+        progress_callback(0)
+
     next_idx = np.copy(csr_indptr)
     csc_indptr = indptr_handle[()]
 
@@ -191,17 +231,16 @@ def transpose_sparse_matrix_on_disk(
 
     r0 = 0
     while True:
-        r1 = None
-        e0 = csr_indptr[r0]
-        for candidate in range(r0+1, len(csr_indptr), 1):
-            e1 = csr_indptr[candidate]
-            if e1-e0 >= elements_at_a_time or candidate == len(csr_indptr)-1:
-                r1 = candidate
-                break
-
-        if r1 is None:
+        if r0 >= len(csr_indptr)-1:
             break
 
+        # first row past r0 at which the band holds at least
+        # elements_at_a_time elements (or the last row)
+        e0 = csr_indptr[r0]
+        r1 = np.searchsorted(
+            csr_indptr, e0+elements_at_a_time, side='left')
+        r1 = int(min(len(csr_indptr)-1, max(r0+1, r1)))
+
         d0 = csr_indptr[r0]
         d1 = csr_indptr[r1]
 
@@ -212,84 +251,68 @@ def transpose_sparse_matrix_on_disk(
 
         n_indices = indices_handle.shape[0]
         for i0 in range(0, n_indices, load_chunk_size):
-            indices_filter = None
 
             i1 = min(n_indices, i0+load_chunk_size)
 
-            row_chunk = indices_handle[i0:i1]
+            # signed, so that subtracting indices_slice[0] cannot wrap
+            row_chunk = indices_handle[i0:i1].astype(np.int64)
 
             if indices_slice is not None:
-                indices_filter = np.logical_and(
-                    row_chunk >= indices_slice[0],
-                    row_chunk < indices_slice[1])
-                row_chunk = row_chunk[indices_filter]
                 row_chunk -= indices_slice[0]
 
-            sorted_dex = np.argsort(row_chunk)
-            row_chunk = row_chunk[sorted_dex]
-
-            unq_val_arr, unq_ct_arr = np.unique(
-                    row_chunk, return_counts=True)
+            # only keep the elements that land in this band of rows
+            in_band = np.logical_and(
+                row_chunk >= r0,
+                row_chunk < r1)
 
-            valid_dex = np.where(
-                np.logical_and(
-                    unq_val_arr >= r0,
-                    unq_val_arr < r1))[0]
+            in_band_idx = np.where(in_band)[0]
+            del in_band
 
-            if len(valid_dex) == 0:
+            if len(in_band_idx) == 0:
                 continue
 
+            row_chunk = row_chunk[in_band_idx]
+
+            # the input is traversed in column-major order, so a
+            # stable sort on row leaves the elements of each row
+            # ordered by column; every element can then be placed
+            # at its row's cursor plus its rank within the row
+            sorted_dex = np.argsort(row_chunk, kind='stable')
+            row_chunk = row_chunk[sorted_dex]
+            element_idx = in_band_idx[sorted_dex]+i0
+            del sorted_dex
+
             col_chunk = np.searchsorted(
                 csc_indptr,
-                np.arange(i0, i1, dtype=int),
+                element_idx,
                 side='right')
             col_chunk -= 1
 
-            if indices_filter is not None:
-                col_chunk = col_chunk[indices_filter]
-
-            col_chunk = col_chunk[sorted_dex]
+            row_ct = np.bincount(row_chunk-r0, minlength=r1-r0)
+            row_start = np.cumsum(row_ct)-row_ct
+            rank = np.arange(len(row_chunk))-row_start[row_chunk-r0]
+            dest = next_idx[row_chunk]+rank-d0
 
             if use_data_array:
                 data_chunk = data_group[i0:i1]
-                if indices_filter is not None:
-                    data_chunk = data_chunk[indices_filter]
-                data_chunk = data_chunk[sorted_dex]
-
-            del sorted_dex
-
-            unq_val_arr = unq_val_arr[valid_dex]
-            unq_ct_arr = unq_ct_arr[valid_dex]
-            for unq_val, unq_ct in zip(unq_val_arr, unq_ct_arr):
-                j0 = np.searchsorted(row_chunk, unq_val, side='left')
-
-                if use_data_array:
-                    this_data = data_chunk[j0:j0+unq_ct]
-
-                this_index = col_chunk[j0:j0+unq_ct]
-
-                col_sorted_dex = np.argsort(this_index)
-
-                this_index = this_index[col_sorted_dex]
-
-                if use_data_array:
-                    this_data = this_data[col_sorted_dex]
+                data_buffer[dest] = data_chunk[element_idx-i0]
+                del data_chunk
 
-                buffer_0 = next_idx[unq_val]-d0
-                buffer_1 = buffer_0+unq_ct
+            index_buffer[dest] = col_chunk
+            next_idx[r0:r1] += row_ct
 
-                if use_data_array:
-                    data_buffer[buffer_0:buffer_1] = this_data
-
-                index_buffer[buffer_0:buffer_1] = this_index
-                next_idx[unq_val] += unq_ct
-
-        with h5py.File(output_path, 'a') as dst:
+        with output_lock, h5py.File(output_path, 'a') as dst:
             if use_data_array:
                 dst['data'][d0:d1] = data_buffer.astype(data_dtype)
             dst['indices'][d0:d1] = index_buffer.astype(col_dtype)
         r0 = r1
 
+        if progress_callback is not None:
+            progress_callback(r1)
+
+    if progress_callback is not None:
+        progress_callback(len(csr_indptr)-1)
+
 
 def _calculate_csr_indptr(
         indices_handle,
@@ -325,8 +348,9 @@ def _calculate_csr_indptr(
             chunk -= indices_slice[0]
 
         n_non_zero += len(chunk)
-        unq_val, unq_ct = np.unique(chunk, return_counts=True)
-        cumulative_count[unq_val] += unq_ct
+        cumulative_count += np.bincount(
+            chunk.astype(np.int64),
+            minlength=indices_max)
 
     csr_indptr = np.cumsum(cumulative_count)
     csr_indptr = np.concatenate([np.array([0], dtype=int), csr_indptr])
@@ -334,6 +358,21 @@ def _calculate_csr_indptr(
     return csr_indptr, n_non_zero
 
 
+def _get_chunks_for_1d(
+        n_elements,
+        this_dtype,
+        chunk_bytes=4*1024**2):
+    """
+    Return the chunks specification for a 1-dimensional
+    dataset of n_elements so that each HDF5 chunk is
+    (at most) approximately chunk_bytes in size.
+    """
+    if n_elements == 0:
+        return None
+    n_per = max(1, chunk_bytes//_get_bytes_for_type(this_dtype))
+    return (min(n_elements, n_per),)
+
+
 def _get_uint_dtype(max_value):
     result = None
     for candidate in (np.uint8, np.uint16, np.uint32, np.uint):
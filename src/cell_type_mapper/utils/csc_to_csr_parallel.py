@@ -14,6 +14,7 @@ from cell_type_mapper.utils.multiprocessing_utils import (
     winnow_process_list)
 
 from cell_type_mapper.utils.csc_to_csr import (
+    _get_chunks_for_1d,
     transpose_sparse_matrix_on_disk
 )
 
@@ -150,7 +151,9 @@ def _transpose_sparse_matrix_on_disk_v2(
         indices = dst.create_dataset(
             'indices',
             shape=(indices_size,),
-            chunks=(min(indices_size, 1000000),),
+            chunks=_get_chunks_for_1d(
+                n_elements=indices_size,
+                this_dtype=indices_dtype),
             dtype=indices_dtype)
         indptr = dst.create_dataset(
             'indptr',
@@ -161,7 +164,9 @@ def _transpose_sparse_matrix_on_disk_v2(
             data = dst.create_dataset(
                 'data',
                 shape=(indices_size,),
-                chunks=(min(indptr_size, 1000000),),
+                chunks=_get_chunks_for_1d(
+                    n_elements=indices_size,
+                    this_dtype=data_dtype),
                 dtype=data_dtype)
 
         chunk_size = 1000000
@@ -74,6 +74,7 @@ def _copy_h5_element(
                     dtype=src_dataset.dtype,
                     shape=src_dataset.shape,
                     chunks=src_dataset.chunks,
+                    shuffle=src_dataset.shuffle,
                     compression=src_dataset.compression,
                     compression_opts=src_dataset.compression_opts)
 
@@ -131,3 +132,48 @@ def _get_slices_for_copy(
             these_slices.append(slice(i0, i1, 1))
         actual_slices.append(these_slices)
     return actual_slices
+
+
+def iter_allocated_chunks(dataset):
+    """
+    Iterate over the chunks of a chunked h5py.Dataset that have
+    actually been written to the file, in the order in which they
+    are stored on disk.
+
+    Chunks that were never written are skipped (reading them would
+    just return the dataset's fill value). The chunk index is
+    traversed once with H5Dchunk_iter where the HDF5 library
+    provides it, rather than querying it chunk by chunk. Otherwise
+    this falls back to every chunk in logical order.
+
+    Parameters
+    ----------
+    dataset:
+        a chunked h5py.Dataset
+
+    Returns
+    -------
+    An iterator over tuples of slices (one per dimension of
+    dataset) selecting each chunk
+    """
+    chunk_shape = dataset.chunks
+    if chunk_shape is None:
+        raise RuntimeError(
+            "iter_allocated_chunks requires a chunked dataset")
+
+    if not hasattr(dataset.id, 'chunk_iter'):
+        yield from dataset.iter_chunks()
+        return
+
+    chunk_info = []
+    dataset.id.chunk_iter(
+        lambda info: chunk_info.append(
+            (info.byte_offset, info.chunk_offset)))
+    chunk_info.sort()
+
+    for _, chunk_offset in chunk_info:
+        yield tuple(
+            slice(i0, min(i0+size, dim))
+            for i0, size, dim in zip(chunk_offset,
+                                     chunk_shape,
+                                     dataset.shape))
@@ -1,3 +1,7 @@
+import queue
+import threading
+
+
 class DummyLock(object):
 
     def __enter__(self):
@@ -51,3 +55,64 @@ def winnow_process_dict(
                     f"{process_dict[k].exitcode}")
             process_dict.pop(k)
     return process_dict
+
+
+def prefetch_iterator(
+        iterable,
+        n_prefetch=1):
+    """
+    Iterate over iterable, drawing up to n_prefetch items ahead
+    of the consumer on a background thread (so that, e.g., reading
+    the next chunk of data from disk overlaps with processing the
+    current one).
+
+    Parameters
+    ----------
+    iterable:
+        The iterable to draw items from. It is only ever
+        advanced on the background thread.
+    n_prefetch:
+        The maximum number of items to hold ahead of the consumer
+
+    Returns
+    -------
+    A generator yielding the items of iterable in order.
+    Exceptions raised by iterable are re-raised in the consumer.
+    """
+    buffer = queue.Queue(maxsize=n_prefetch)
+    stop = threading.Event()
+    done = object()
+
+    def _put(item):
+        # give up if the consumer has gone away
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce():
+        try:
+            for item in iterable:
+                if not _put((item, None)):
+                    return
+        except BaseException as err:
+            _put((done, err))
+            return
+        _put((done, None))
+
+    producer = threading.Thread(target=_produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            (item, err) = buffer.get()
+            if item is done:
+                if err is not None:
+                    raise err
+                return
+            yield item
+    finally:
+        stop.set()
+        producer.join()
@@ -6,7 +6,7 @@ from cell_type_mapper.utils.multiprocessing_utils import (
 
 from cell_type_mapper.utils.utils import (
     print_timing,
-    merge_index_list)
+    merge_index_array)
 
 
 def load_csr(
@@ -98,64 +98,129 @@ def _load_disjoint_csr(
         row_index_list,
         data,
         indices,
-        indptr):
+        indptr,
+        max_gap_nnz=2**15):
     """
     Load a csr matrix from a not necessarily contiguous
     set of row indexes.
+
+    The rows are loaded in sorted order, with consecutive
+    runs of rows coalesced into single slices (so that the number
+    of reads scales with the number of runs, not the number of rows).
+    Runs separated by no more than max_gap_nnz non-zero elements
+    are read as one slice (the unrequested rows in between are
+    read and discarded), which is cheaper than issuing a separate
+    HDF5 read for each. The result is then permuted back into the
+    order specified by row_index_list.
+
+    indices keep the dtype they have on disk and indptr is
+    returned as int32 whenever the number of non-zero elements
+    allows it, halving the index bytes downstream consumers
+    have to traverse.
     """
     row_index_list = np.array(row_index_list)
-    sorted_dex = np.argsort(row_index_list)
-    inverse_argsort = {sorted_dex[ii]: ii for ii in range(len(sorted_dex))}
-
-    row_index_list = row_index_list[sorted_dex]
-
-    row_chunk_list = merge_index_list(row_index_list)
-    data_list = []
-    indices_list = []
-    indptr_list = []
-    t_load = 0.0
-    for row_chunk in row_chunk_list:
-        t0 = time.time()
-        (this_data,
-         this_indices,
-         this_indptr) = _load_sparse(
-                             indptr_spec=row_chunk,
-                             data=data,
-                             indices=indices,
-                             indptr=indptr)
-        t_load += time.time()-t0
-
-        data_list.append(this_data)
-        indices_list.append(this_indices)
-        indptr_list.append(this_indptr)
-
-    (merged_data,
-     merged_indices,
-     merged_indptr) = merge_csr(
-                         data_list=data_list,
-                         indices_list=indices_list,
-                         indptr_list=indptr_list)
-
-    # undo sorting
-    final_data = np.zeros(merged_data.shape, dtype=merged_data.dtype)
-    final_indices = np.zeros(merged_indices.shape, dtype=merged_indices.dtype)
-    final_indptr = np.zeros(merged_indptr.shape, dtype=merged_indptr.dtype)
-
-    data_ct = 0
-    for ii in range(len(row_index_list)):
-        new_position = inverse_argsort[ii]
-        indptr0 = merged_indptr[new_position]
-        indptr1 = merged_indptr[new_position+1]
-        n = indptr1-indptr0
-        final_data[data_ct:data_ct+n] = merged_data[indptr0:indptr1]
-        final_indices[data_ct:data_ct+n] = merged_indices[indptr0:indptr1]
-        final_indptr[ii] = data_ct
-        data_ct += n
-    final_indptr[-1] = len(final_data)
+
+    unq_rows = np.unique(row_index_list)
+
+    # read indptr over the span of requested rows once, rather
+    # than once per run
+    row0 = unq_rows[0]
+    indptr = np.asarray(indptr[row0:unq_rows[-1]+2])
+    unq_rows = unq_rows - row0
+    row_index_list = row_index_list - row0
+
+    run_array = merge_index_array(unq_rows)
+    gap_nnz = indptr[run_array[1:, 0]] - indptr[run_array[:-1, 1]]
+    new_run = gap_nnz > max_gap_nnz
+    row_chunk_list = list(zip(
+        run_array[np.concatenate([[True], new_run]), 0],
+        run_array[np.concatenate([new_run, [True]]), 1]))
+
+    # the rows actually loaded (a superset of unq_rows, in order)
+    loaded_rows = np.concatenate(
+        [np.arange(r0, r1) for r0, r1 in row_chunk_list])
+
+    merged_indptr = np.zeros(len(loaded_rows)+1, dtype=int)
+    merged_indptr[1:] = np.cumsum(
+        indptr[loaded_rows+1]-indptr[loaded_rows])
+
+    # read every run straight into its place in the merged
+    # (sorted) arrays rather than into per-run buffers that
+    # then have to be copied again
+    merged_data = np.empty(merged_indptr[-1], dtype=data.dtype)
+    merged_indices = np.empty(merged_indptr[-1], dtype=indices.dtype)
+    dest0 = 0
+    for r0, r1 in row_chunk_list:
+        src_sel = np.s_[indptr[r0]:indptr[r1]]
+        dest_sel = np.s_[dest0:dest0+indptr[r1]-indptr[r0]]
+        merged_data[dest_sel] = data[src_sel]
+        merged_indices[dest_sel] = indices[src_sel]
+        dest0 = dest_sel.stop
+
+    if np.array_equal(loaded_rows, row_index_list):
+        # rows were requested in sorted order with no gaps
+        # or repeats; there is nothing to undo
+        return (merged_data,
+                merged_indices,
+                merged_indptr.astype(
+                    _get_index_dtype(merged_indptr[-1]), copy=False))
+
+    # undo sorting: find where each requested row landed in the
+    # merged (sorted) matrix and gather its elements in one
+    # fancy-indexing operation
+    position = np.searchsorted(loaded_rows, row_index_list)
+    (final_indptr,
+     gather_idx) = _get_csr_row_gather(
+        indptr=merged_indptr,
+        row_idx=position)
+
+    final_indptr = final_indptr.astype(
+        _get_index_dtype(final_indptr[-1]), copy=False)
+
+    final_data = merged_data[gather_idx]
+    final_indices = merged_indices[gather_idx]
 
     return final_data, final_indices, final_indptr
 
 
+def _get_csr_row_gather(
+        indptr,
+        row_idx):
+    """
+    Find the elements that belong to the rows row_idx (in that
+    order, repeats allowed) of a CSR matrix described by indptr.
+
+    Returns
+    -------
+    new_indptr:
+        The indptr array of the gathered matrix
+    gather_idx:
+        The indexes into the original data/indices arrays of the
+        elements of the gathered matrix, i.e. the gathered data array
+        is data[gather_idx]
+    """
+    row_idx = np.asarray(row_idx, dtype=int)
+    src0 = indptr[row_idx]
+    n_per_row = indptr[row_idx+1]-src0
+
+    new_indptr = np.zeros(len(row_idx)+1, dtype=int)
+    new_indptr[1:] = np.cumsum(n_per_row)
+
+    gather_idx = np.arange(new_indptr[-1], dtype=int)
+    gather_idx += np.repeat(src0-new_indptr[:-1], n_per_row)
+    return new_indptr, gather_idx
+
+
+def _get_index_dtype(max_value):
+    """
+    Return the smallest of (np.int32, np.int64) that can
+    hold max_value
+    """
+    if max_value < np.iinfo(np.int32).max:
+        return np.int32
+    return np.int64
+
+
 def _load_sparse(
         indptr_spec,
         data,
@@ -223,12 +288,14 @@ def _csr_to_dense(
     result = np.zeros((n_rows, n_cols),
                       dtype=data.dtype)
 
-    data_idx = 0
-    for iptr in range(len(indptr)-1):
-        these_cols = indices[indptr[iptr]:indptr[iptr+1]]
-        n_cols = len(these_cols)
-        result[iptr, these_cols] = data[data_idx:data_idx+n_cols]
-        data_idx += n_cols
+    # scatter all of the non-zero elements in one vectorized
+    # assignment rather than looping over rows
+    n_non_zero = indptr[-1]-indptr[0]
+    these_rows = np.repeat(
+        np.arange(len(indptr)-1),
+        np.diff(indptr))
+    result[these_rows,
+           indices[indptr[0]:indptr[-1]]] = data[:n_non_zero]
 
     return result
 
@@ -263,12 +330,12 @@ def _csc_to_dense(
     result = np.zeros((n_rows, n_cols),
                       dtype=data.dtype)
 
-    data_idx = 0
-    for iptr in range(len(indptr)-1):
-        these_rows = indices[indptr[iptr]:indptr[iptr+1]]
-        n_rows = len(these_rows)
-        result[these_rows, iptr] = data[data_idx:data_idx+n_rows]
-        data_idx += n_rows
+    n_non_zero = indptr[-1]-indptr[0]
+    these_cols = np.repeat(
+        np.arange(len(indptr)-1),
+        np.diff(indptr))
+    result[indices[indptr[0]:indptr[-1]],
+           these_cols] = data[:n_non_zero]
 
     return result
 
@@ -281,6 +348,14 @@ def _cull_columns(
     """
     Return only the desired columns from a csr matrix
     """
+    if len(indices) == 0 or (
+            indices.min() >= col_spec[0] and indices.max() < col_spec[1]):
+        # every element is already in the column band (e.g. the
+        # band spans all of the columns); no elements need to be culled
+        if col_spec[0] == 0:
+            return data, indices, indptr
+        return data, indices-col_spec[0], indptr
+
     valid_idx = np.where(
             np.logical_and(
                 indices >= col_spec[0],
@@ -289,15 +364,10 @@ def _cull_columns(
     new_data = data[valid_idx]
     new_indices = indices[valid_idx]-col_spec[0]
 
-    this_row = 0
-    new_indptr = np.zeros(len(indptr), dtype=int)
-    new_indptr[0]
-    for new_idx, this_idx in enumerate(valid_idx):
-        while this_idx >= indptr[this_row+1]:
-            this_row += 1
-            new_indptr[this_row] = new_idx
-
-    new_indptr[this_row+1:] = len(new_data)
+    # the new pointer to the start of each row is the number of
+    # kept elements that come before that row's first element
+    new_indptr = np.searchsorted(
+        valid_idx, indptr, side='left').astype(int)
 
     return (new_data,
             new_indices,
@@ -344,8 +414,12 @@ def merge_csr(
         n_indptr += len(i)-1
     n_indptr += 1
 
+    # keep the (typically int32) dtype of the input indices
+    # rather than upcasting them to int64
     data = np.zeros(n_data, dtype=data_list[0].dtype)
-    indices = np.zeros(n_data, dtype=int)
+    indices = np.zeros(
+        n_data,
+        dtype=np.result_type(*[i.dtype for i in indices_list]))
     indptr = np.zeros(n_indptr, dtype=int)
 
     i0 = 0
@@ -402,12 +476,9 @@ def precompute_indptr(
     rows as specified in row_order
     """
 
+    span = np.diff(indptr_in)[np.asarray(row_order, dtype=int)]
     new_indptr = np.zeros(len(indptr_in), dtype=int)
-    ct = 0
-    for new_idx, row in enumerate(row_order):
-        span = indptr_in[row+1]-indptr_in[row]
-        new_indptr[new_idx] = ct
-        ct += span
+    new_indptr[1:len(span)] = np.cumsum(span[:-1])
     new_indptr[-1] = indptr_in[-1]
     return new_indptr
 
@@ -422,26 +493,25 @@ def remap_csr_matrix(
         flush_every=1000000,
         row_chunk=None,
         output_lock=None,
-        process_name=None):
+        process_name=None,
+        verbose=False):
     """
     Given a CSR array and a re-arranged
     indptr array, write out the re-arrangeced
     CSR array.
 
     row_chunk is of the form (row_min, row_max)
+
+    If verbose is True, progress is printed every 1000 rows.
     """
     data_buffer = np.zeros(flush_every, data_handle.dtype)
     indices_buffer = np.zeros(flush_every, int)
     output_0 = 0
     buffer_1 = 0
 
-    new_to_old_row = dict()
-    for ii, rr in enumerate(new_row_order):
-        new_to_old_row[ii] = rr
+    new_to_old_row = np.asarray(new_row_order, dtype=int)
 
     t0 = time.time()
-    t_load = 0.0
-    t_write = 0.0
 
     if row_chunk is not None:
         output_0 = new_indptr[row_chunk[0]]
@@ -453,12 +523,9 @@ def remap_csr_matrix(
         old_row = new_to_old_row[new_row]
         i0 = indptr[old_row]
         i1 = indptr[old_row+1]
-        _t0 = time.time()
         data_chunk = data_handle[i0:i1]
         indices_chunk = indices_handle[i0:i1]
-        t_load += time.time()-_t0
 
-        _t0 = time.time()
         (output_0,
          buffer_1) = _update_buffers(
                           data_buffer=data_buffer,
@@ -470,10 +537,9 @@ def remap_csr_matrix(
                           buffer_1=buffer_1,
                           force_flush=False,
                           output_lock=output_lock)
-        t_write += time.time()-_t0
         row_ct += 1
 
-        if row_ct % 1000 == 0 or row_ct == 1:
+        if verbose and (row_ct % 1000 == 0 or row_ct == 1):
             print_timing(
                 t0=t0,
                 tot_chunks=row_chunk[1]-row_chunk[0],
@@ -578,20 +644,13 @@ def downsample_indptr(
     Returns indptr_new, indices_new
     """
 
-    ct_new = 0
-    indptr_new = np.zeros(len(indptr_to_keep)+1, dtype=indptr_old.dtype)
-    for ii, indptr in enumerate(indptr_to_keep):
-        indptr_new[ii] = ct_new
-        ct_new += indptr_old[indptr+1]-indptr_old[indptr]
-    indptr_new[-1] = ct_new
-
-    indices_new = np.zeros(ct_new, dtype=indices_old.dtype)
-    for ii in range(len(indptr_to_keep)):
-        src0 = indptr_old[indptr_to_keep[ii]]
-        src1 = indptr_old[indptr_to_keep[ii]+1]
-        dst0 = indptr_new[ii]
-        dst1 = indptr_new[ii+1]
-        indices_new[dst0:dst1] = indices_old[src0:src1]
+    (indptr_new,
+     gather_idx) = _get_csr_row_gather(
+        indptr=indptr_old,
+        row_idx=indptr_to_keep)
+
+    indptr_new = indptr_new.astype(indptr_old.dtype, copy=False)
+    indices_new = indices_old[gather_idx]
 
     return indptr_new, indices_new
 
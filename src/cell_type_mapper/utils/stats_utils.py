@@ -1,6 +1,15 @@
 import numpy as np
+import scipy.sparse
 import scipy.stats as scipy_stats
 
+try:
+    import torch
+except ImportError:
+    pass
+
+from cell_type_mapper.utils.torch_utils import (
+    use_torch)
+
 from cell_type_mapper.cell_by_gene.cell_by_gene import (
     CellByGeneMatrix)
 
@@ -15,7 +24,9 @@ def summary_stats_for_chunk(
     Parameters
     ----------
     cell_x_gene: CellByGeneMatrix
-        normalization must be log2CPM
+        normalization must be log2CPM. The data may be float32
+        (see the dtype parameter of convert_to_cpm); 'sum' and
+        'sumsq' are accumulated in float64 regardless.
 
     Returns
     -------
@@ -42,11 +53,323 @@ def summary_stats_for_chunk(
     result = dict()
     data = cell_x_gene.data
     result['n_cells'] = cell_x_gene.n_cells
-    result['sum'] = data.sum(axis=0)
-    result['sumsq'] = (data**2).sum(axis=0)
-    result['gt0'] = (data > zero_cutoff).sum(axis=0)
-    result['gt1'] = (data > one_cutoff).sum(axis=0)
-    result['ge1'] = (data > one_cutoff-eps).sum(axis=0)
+    result['sum'] = data.sum(axis=0, dtype=np.float64)
+
+    # einsum contracts over cells without materializing data**2;
+    # count_nonzero avoids summing the boolean masks as int64
+    result['sumsq'] = np.einsum('ij,ij->j', data, data, dtype=np.float64)
+    result['gt0'] = np.count_nonzero(data > zero_cutoff, axis=0)
+    result['gt1'] = np.count_nonzero(data > one_cutoff, axis=0)
+    result['ge1'] = np.count_nonzero(data > one_cutoff-eps, axis=0)
+    return result
+
+
+def summary_stats_for_clusters(
+        cell_x_gene: CellByGeneMatrix,
+        cluster_idx: np.ndarray,
+        n_clusters: int,
+        min_rows_per_segment: int = 8) -> dict:
+    """
+    Compute the same summary statistics as summary_stats_for_chunk
+    for several clusters of cells at once.
+
+    Parameters
+    ----------
+    cell_x_gene: CellByGeneMatrix
+        normalization must be log2CPM
+    cluster_idx:
+        (n_cells,) array of integers in [0, n_clusters) indicating
+        the cluster to which each row of cell_x_gene belongs
+    n_clusters:
+        the number of clusters
+    min_rows_per_segment:
+        if the clusters present have, on average, at least this
+        many rows, the rows are grouped into contiguous per-cluster
+        segments and each segment is reduced in place; otherwise
+        a sparse indicator matrix product is used (see Notes)
+
+    Returns
+    -------
+    A dict of summary stats keyed like the output of
+    summary_stats_for_chunk, except that 'n_cells' is a
+    (n_clusters,) array and every other value is a
+    (n_clusters, n_genes) array
+
+    Notes
+    -----
+    If the data is a torch tensor (e.g. one already on the GPU),
+    the reductions are done on its device with index_add_ and
+    the results are returned as numpy arrays.
+
+    When rows are grouped by cluster (as they often are in
+    reference data), each cluster is a contiguous slice of rows and
+    can be reduced with plain column reductions on a view of the
+    data; otherwise the rows are first gathered into cluster
+    order with one stable argsort. For many tiny clusters the
+    per-segment overhead dominates, so the reductions are instead
+    written as the product of a sparse (n_clusters, n_cells)
+    indicator matrix with the data. (Reducing one gene at a time
+    with np.bincount(cluster_idx, weights=data[:, j]), even on
+    contiguous gene tiles, is 2-3x slower than that product because
+    of the per-gene call overhead; bincount is used for sparse
+    data instead, see summary_stats_for_clusters_csr.)
+    """
+    if not cell_x_gene.normalization == 'log2CPM':
+        raise RuntimeError(
+            "cell_x_gene normalization is not log2CPM\n"
+            f"is {cell_x_gene.normalization}")
+
+    data = cell_x_gene.data
+    cluster_idx = np.asarray(cluster_idx)
+
+    n_cells = np.bincount(cluster_idx, minlength=n_clusters)
+
+    if use_torch():
+        if torch.is_tensor(data):
+            result = _summary_stats_by_index_add(
+                data=data,
+                cluster_idx=cluster_idx,
+                n_clusters=n_clusters)
+            result['n_cells'] = n_cells
+            return result
+
+    n_present = np.count_nonzero(n_cells)
+
+    if len(cluster_idx) >= min_rows_per_segment*n_present:
+        result = _summary_stats_by_segment(
+            data=data,
+            cluster_idx=cluster_idx,
+            n_cells=n_cells)
+    else:
+        result = _summary_stats_by_indicator(
+            data=data,
+            cluster_idx=cluster_idx,
+            n_clusters=n_clusters)
+
+    result['n_cells'] = n_cells
+    return result
+
+
+def _summary_stats_by_segment(
+        data,
+        cluster_idx,
+        n_cells,
+        tile_bytes=1024**2):
+    """
+    Reduce each cluster's rows as one contiguous slice of data
+    (see summary_stats_for_clusters), tile_bytes at a time
+    """
+    zero_cutoff = 0.0  # log2(CPM+1) with CPM=0
+    one_cutoff = 1.0  # log2(CPM+1) with CPM=1
+    eps = 1.0e-6  # for float comparisons
+
+    if np.any(cluster_idx[1:] < cluster_idx[:-1]):
+        order = np.argsort(cluster_idx, kind='stable')
+        data = data[order, :]
+
+    n_clusters = len(n_cells)
+    n_genes = data.shape[1]
+    bounds = np.concatenate([[0], np.cumsum(n_cells)])
+
+    result = dict()
+    result['sum'] = np.zeros((n_clusters, n_genes), dtype=np.float64)
+    result['sumsq'] = np.zeros((n_clusters, n_genes), dtype=np.float64)
+    for k in ('gt0', 'gt1', 'ge1'):
+        result[k] = np.zeros((n_clusters, n_genes), dtype=np.int32)
+
+    # each segment is reduced in bands of rows that fit in cache
+    # so that the five reductions re-read the band from cache
+    # rather than streaming the whole segment from memory five times
+    rows_per_band = max(1, tile_bytes//max(1, n_genes*data.itemsize))
+    mask = np.empty((rows_per_band, n_genes), dtype=bool)
+
+    cutoff_list = (('gt0', zero_cutoff),
+                   ('gt1', one_cutoff),
+                   ('ge1', one_cutoff-eps))
+
+    for i_cluster in np.flatnonzero(n_cells):
+        for r0 in range(bounds[i_cluster],
+                        bounds[i_cluster+1],
+                        rows_per_band):
+            r1 = min(bounds[i_cluster+1], r0+rows_per_band)
+            band = data[r0:r1, :]
+            band_mask = mask[:r1-r0, :]
+            result['sum'][i_cluster, :] += band.sum(
+                axis=0, dtype=np.float64)
+            result['sumsq'][i_cluster, :] += np.einsum(
+                'ij,ij->j', band, band, dtype=np.float64)
+            for (k, cutoff) in cutoff_list:
+                np.greater(band, cutoff, out=band_mask)
+                result[k][i_cluster, :] += np.count_nonzero(
+                    band_mask, axis=0)
+
+    return result
+
+
+def _summary_stats_by_indicator(
+        data,
+        cluster_idx,
+        n_clusters):
+    """
+    Reduce the clusters with sparse indicator matrix products
+    (see summary_stats_for_clusters)
+    """
+    zero_cutoff = 0.0  # log2(CPM+1) with CPM=0
+    one_cutoff = 1.0  # log2(CPM+1) with CPM=1
+    eps = 1.0e-6  # for float comparisons
+
+    n_cells = data.shape[0]
+
+    indicator = scipy.sparse.csr_matrix(
+        (np.ones(n_cells, dtype=np.float64),
+         (cluster_idx, np.arange(n_cells))),
+        shape=(n_clusters, n_cells))
+
+    # integer indicator so that counts are accumulated exactly
+    # (a chunk never holds 2**31 cells, so int32 suffices and
+    # halves the cost of the product relative to int64)
+    count_indicator = indicator.astype(np.int32)
+
+    result = dict()
+    result['sum'] = indicator @ data
+    result['sumsq'] = indicator @ np.square(data, dtype=np.float64)
+
+    # one boolean buffer is reused for all three threshold masks
+    mask = np.empty(data.shape, dtype=bool)
+    for (k, cutoff) in (('gt0', zero_cutoff),
+                        ('gt1', one_cutoff),
+                        ('ge1', one_cutoff-eps)):
+        np.greater(data, cutoff, out=mask)
+        result[k] = count_indicator @ mask
+    return result
+
+
+def _summary_stats_by_index_add(
+        data,
+        cluster_idx,
+        n_clusters):
+    """
+    Reduce the clusters of a torch tensor on its own device
+    (see summary_stats_for_clusters)
+    """
+    zero_cutoff = 0.0  # log2(CPM+1) with CPM=0
+    one_cutoff = 1.0  # log2(CPM+1) with CPM=1
+    eps = 1.0e-6  # for float comparisons
+
+    device = data.device
+    n_genes = data.shape[1]
+    cluster_idx = torch.from_numpy(cluster_idx).to(
+        device=device, dtype=torch.int64)
+
+    data = data.to(dtype=torch.float64)
+
+    result = dict()
+    for (k, values) in (('sum', data), ('sumsq', data*data)):
+        accumulator = torch.zeros(
+            (n_clusters, n_genes), dtype=torch.float64, device=device)
+        accumulator.index_add_(0, cluster_idx, values)
+        result[k] = accumulator.cpu().numpy()
+
+    for (k, cutoff) in (('gt0', zero_cutoff),
+                        ('gt1', one_cutoff),
+                        ('ge1', one_cutoff-eps)):
+        accumulator = torch.zeros(
+            (n_clusters, n_genes), dtype=torch.int32, device=device)
+        accumulator.index_add_(
+            0, cluster_idx, (data > cutoff).to(dtype=torch.int32))
+        result[k] = accumulator.cpu().numpy()
+
+    return result
+
+
+def summary_stats_for_clusters_csr(
+        csr_data,
+        cluster_idx: np.ndarray,
+        n_clusters: int,
+        normalization: str = 'log2CPM') -> dict:
+    """
+    Compute the same summary statistics as summary_stats_for_clusters
+    from a sparse cell-by-gene matrix, without densifying it.
+
+    Parameters
+    ----------
+    csr_data:
+        A scipy.sparse CSR matrix (each row is a cell;
+        each column is a gene)
+    cluster_idx:
+        (n_cells,) array of integers in [0, n_clusters) indicating
+        the cluster to which each row of csr_data belongs
+    n_clusters:
+        the number of clusters
+    normalization:
+        Either "raw" or "log2CPM"; how csr_data is normalized.
+        Raw counts are converted to log2CPM along the way
+        (csr_data itself is not modified).
+
+    Returns
+    -------
+    A dict of summary stats keyed and shaped like the output
+    of summary_stats_for_clusters
+
+    Notes
+    -----
+    log2(CPM+1) maps zero to zero, so implicit zeros contribute
+    nothing to any of the statistics and only the stored values
+    are normalized. Each stored value is assigned to its row once;
+    that assignment gives both its row's CPM scale factor and its
+    flattened (cluster, gene) bin, and every statistic is a single
+    np.bincount over the stored values, so the cost scales with
+    the number of non-zero entries.
+    """
+    zero_cutoff = 0.0  # log2(CPM+1) with CPM=0
+    one_cutoff = 1.0  # log2(CPM+1) with CPM=1
+    eps = 1.0e-6  # for float comparisons
+
+    if normalization not in ('raw', 'log2CPM'):
+        raise RuntimeError(
+            f"Do not know how to handle normalization: {normalization}")
+
+    csr_data = csr_data.tocsr()
+    cluster_idx = np.asarray(cluster_idx)
+    (n_rows, n_genes) = csr_data.shape
+    n_bins = n_clusters*n_genes
+
+    row_per_value = np.repeat(
+        np.arange(n_rows, dtype=np.int64), np.diff(csr_data.indptr))
+
+    if normalization == 'raw':
+        row_sums = np.bincount(
+            row_per_value,
+            weights=csr_data.data,
+            minlength=n_rows)
+        scale = 1.0e6/np.where(row_sums > 0.0, row_sums, 1.0)
+        values = np.multiply(
+            csr_data.data, scale[row_per_value], dtype=np.float64)
+        values += 1.0
+        np.log2(values, out=values)
+    else:
+        values = csr_data.data.astype(np.float64, copy=False)
+
+    bins = cluster_idx[row_per_value].astype(np.int64)*n_genes
+    bins += csr_data.indices
+
+    result = dict()
+    result['n_cells'] = np.bincount(cluster_idx, minlength=n_clusters)
+    result['sum'] = np.bincount(
+        bins, weights=values, minlength=n_bins).reshape(n_clusters, n_genes)
+    result['sumsq'] = np.bincount(
+        bins, weights=values*values, minlength=n_bins).reshape(
+            n_clusters, n_genes)
+
+    mask = np.empty(len(values), dtype=bool)
+    for (k, cutoff) in (('gt0', zero_cutoff),
+                        ('gt1', one_cutoff),
+                        ('ge1', one_cutoff-eps)):
+        np.greater(values, cutoff, out=mask)
+        result[k] = np.bincount(
+            bins[mask], minlength=n_bins).astype(np.int32).reshape(
+                n_clusters, n_genes)
+
     return result
 
 
@@ -3,6 +3,7 @@ import datetime
 import numpy as np
 import os
 import pathlib
+import shutil
 import tempfile
 import time
 
@@ -14,9 +15,7 @@ def _clean_up(target_path):
     if target_path.is_file():
         target_path.unlink()
     elif target_path.is_dir():
-        for sub_path in target_path.iterdir():
-            _clean_up(sub_path)
-        target_path.rmdir()
+        shutil.rmtree(target_path)
 
 
 def file_size_in_bytes(file_path, chunk_size=1000000000):
@@ -35,16 +34,23 @@ def merge_index_list(
     tuples. Note that max will be 1 greater than any value in the array
     because of the way array slicing works.
     """
+    ranges = merge_index_array(index_list)
+    return list(zip(ranges[:, 0], ranges[:, 1]))
+
+
+def merge_index_array(
+        index_list: Union[list, np.ndarray]) -> np.ndarray:
+    """
+    Same as merge_index_list, except that the (min, max) ranges
+    are returned as the rows of an (N, 2) array
+    """
     index_list = np.unique(index_list)
-    diff_list = np.diff(index_list)
-    breaks = np.where(diff_list > 1)[0]
-    result = []
-    min_dex = 0
-    for max_dex in breaks:
-        result.append((index_list[min_dex],
-                       index_list[max_dex]+1))
-        min_dex = max_dex+1
-    result.append((index_list[min_dex], index_list[-1]+1))
+    breaks = np.nonzero(np.diff(index_list) > 1)[0]
+    result = np.empty((len(breaks)+1, 2), dtype=index_list.dtype)
+    result[0, 0] = index_list[0]
+    result[1:, 0] = index_list[breaks+1]
+    result[:-1, 1] = index_list[breaks]+1
+    result[-1, 1] = index_list[-1]+1
     return result
 
 
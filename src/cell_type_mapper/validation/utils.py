@@ -6,6 +6,9 @@ import pandas as pd
 import pathlib
 import tempfile
 
+from cell_type_mapper.utils.h5_utils import (
+    iter_allocated_chunks)
+
 from cell_type_mapper.utils.utils import (
     mkstemp_clean,
     _clean_up)
@@ -361,20 +364,28 @@ def _round_dense_x_to_integers(
                 chunks=chunk_size,
                 dtype=output_dtype)
 
-            if chunk_size is None:
-                chunk_size = data.shape
-
-            for r0 in range(0, data.shape[0], chunk_size[0]):
-                r1 = min(data.shape[0], r0+chunk_size[0])
-                for c0 in range(0, data.shape[1], chunk_size[1]):
-                    c1 = min(data.shape[1], c0+chunk_size[1])
-                    chunk = data[r0:r1, c0:c1]
-                    rounded_chunk = np.round(chunk)
-                    this_delta = np.abs(rounded_chunk-chunk).max()
-                    if this_delta > delta:
-                        delta = this_delta
-                    dst['data'][r0:r1, c0:c1] = rounded_chunk.astype(
-                                                    output_dtype)
+            if chunk_size is not None and data.fillvalue == 0:
+                # read the chunks in storage order, skipping those
+                # that were never written (they are all zero, which
+                # is also the fill value of the output)
+                chunk_slice_iterator = iter_allocated_chunks(data)
+            else:
+                if chunk_size is None:
+                    chunk_size = data.shape
+                chunk_slice_iterator = (
+                    (slice(r0, min(data.shape[0], r0+chunk_size[0])),
+                     slice(c0, min(data.shape[1], c0+chunk_size[1])))
+                    for r0 in range(0, data.shape[0], chunk_size[0])
+                    for c0 in range(0, data.shape[1], chunk_size[1]))
+
+            for chunk_slice in chunk_slice_iterator:
+                chunk = data[chunk_slice]
+                rounded_chunk = np.round(chunk)
+                this_delta = np.abs(rounded_chunk-chunk).max()
+                if this_delta > delta:
+                    delta = this_delta
+                dst['data'][chunk_slice] = rounded_chunk.astype(
+                                                output_dtype)
 
     # if something changed, actually transcribe the new data
     eps = 1.0e-10
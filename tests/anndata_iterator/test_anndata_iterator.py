@@ -2,6 +2,7 @@ import pytest
 
 import anndata
 import h5py
+import itertools
 import numpy as np
 import pathlib
 import scipy.sparse as scipy_sparse
@@ -11,7 +12,9 @@ from cell_type_mapper.utils.utils import (
     _clean_up)
 
 from cell_type_mapper.anndata_iterator.anndata_iterator import (
-    AnnDataRowIterator)
+    AnnDataRowIterator,
+    CSRTranscriptionAborted,
+    CSRTranscriptionProgress)
 
 
 @pytest.fixture(scope='module')
@@ -203,6 +206,18 @@ def test_anndata_row_iterator_get_chunk(
             atol=0.0,
             rtol=1.0e-7)
 
+        sparse_chunk = iterator.get_chunk(r0=i0, r1=i1, sparse=True)
+        assert sparse_chunk[1] == i0
+        assert sparse_chunk[2] == i1
+        assert isinstance(sparse_chunk[0], scipy_sparse.csr_matrix)
+        np.testing.assert_allclose(
+            sparse_chunk[0].toarray(),
+            x_array_fixture[i0:i1, :],
+            atol=0.0,
+            rtol=1.0e-7)
+
+    assert iterator.is_csr == (use != 'dense')
+
     # now test get_batch (which gets a disjoint set of rows)
     for row_batch in ([0, 61, 181, 55, 1122],
                       [5, 77, 233, 88],
@@ -318,3 +333,96 @@ def test_anndata_iterator_from_layer(
             data[row, :],
             atol=0.0,
             rtol=1.0e-6)
+
+
+@pytest.mark.parametrize(
+    'keep_open,background_transcription',
+    itertools.product([True, False], [True, False]))
+def test_anndata_iterator_csc_in_bands(
+        x_array_fixture,
+        csc_fixture,
+        tmp_dir_fixture,
+        keep_open,
+        background_transcription):
+    """
+    Test iterating over a CSC file while it is (possibly) still
+    being transcribed to CSR (max_gb is small enough that the
+    transcription is done in many bands of rows)
+    """
+    chunk_size = 97
+
+    iterator = AnnDataRowIterator(
+        h5ad_path=csc_fixture,
+        row_chunk_size=chunk_size,
+        tmp_dir=tmp_dir_fixture,
+        max_gb=5.0e-4,
+        keep_open=keep_open,
+        background_transcription=background_transcription)
+
+    n_rows = x_array_fixture.shape[0]
+    assert iterator.n_rows == n_rows
+
+    # reading zero rows must wait for the CSR file to exist
+    empty = iterator.get_chunk(r0=0, r1=0)
+    assert empty[0].shape == (0, x_array_fixture.shape[1])
+
+    row_batch = [1122, 5, 77]
+    np.testing.assert_allclose(
+        iterator.get_batch(row_batch),
+        x_array_fixture[row_batch, :],
+        atol=0.0,
+        rtol=1.0e-7)
+
+    for i0, chunk in zip(range(0, n_rows, chunk_size),
+                         iterator):
+        i1 = min(n_rows, i0+chunk_size)
+        assert chunk[1] == i0
+        assert chunk[2] == i1
+        np.testing.assert_allclose(
+            chunk[0],
+            x_array_fixture[i0:i1, :],
+            atol=0.0,
+            rtol=1.0e-7)
+
+
+def test_anndata_iterator_csc_abandoned(
+        csc_fixture,
+        tmp_dir_fixture):
+    """
+    Test that deleting an iterator whose background transcription
+    is still running stops the transcription and cleans up
+    """
+    iterator = AnnDataRowIterator(
+        h5ad_path=csc_fixture,
+        row_chunk_size=10,
+        tmp_dir=tmp_dir_fixture,
+        max_gb=5.0e-4,
+        background_transcription=True)
+    next(iterator)
+    scratch_dir = pathlib.Path(iterator.tmp_dir)
+    thread = iterator._transcription_thread
+    del iterator
+    assert not thread.is_alive()
+    assert not scratch_dir.exists()
+
+
+def test_csr_transcription_progress_error():
+    progress = CSRTranscriptionProgress()
+    progress.update(0)
+    progress.wait_for(0)
+    progress.update(10)
+    progress.wait_for(5)
+    progress.finish(error=ValueError('bad news'))
+    assert progress.done
+    with pytest.raises(RuntimeError, match='transcription failed'):
+        progress.wait_for(20)
+
+
+def test_csr_transcription_progress_abort():
+    progress = CSRTranscriptionProgress()
+    progress.update(10)
+    progress.abort()
+    with pytest.raises(CSRTranscriptionAborted):
+        progress.update(20)
+    progress.finish()
+    progress.wait_for(20)
@@ -378,6 +378,46 @@ def test_downsample_by_cell_id(
         base.downsample_cells(selected_cells)
 
 
+@pytest.mark.parametrize("use_cell_id", [True, False])
+def test_downsample_cells_and_genes(
+        raw_fixture,
+        gene_id_fixture,
+        cell_id_fixture,
+        use_cell_id):
+
+    base = CellByGeneMatrix(
+        data=raw_fixture,
+        gene_identifiers=gene_id_fixture,
+        normalization="raw",
+        cell_identifiers=cell_id_fixture if use_cell_id else None)
+
+    if use_cell_id:
+        selected_cells = ["cell_13", "cell_5", "cell_9"]
+    else:
+        selected_cells = [13, 5, 9]
+    selected_genes = ["gene_71", "gene_3", "gene_100", "gene_4"]
+
+    expected = base.downsample_cells(selected_cells)
+    expected.downsample_genes_in_place(selected_genes)
+
+    other = base.downsample_cells_and_genes(
+        selected_cells=selected_cells,
+        selected_genes=selected_genes)
+
+    np.testing.assert_array_equal(other.data, expected.data)
+    assert other.gene_identifiers == selected_genes
+    assert other.cell_identifiers == expected.cell_identifiers
+    assert other.normalization == "raw"
+
+    with pytest.raises(RuntimeError, match="downsampled by genes"):
+        other.to_log2CPM()
+
+    with pytest.raises(RuntimeError, match="occurs more than once"):
+        base.downsample_cells_and_genes(
+            selected_cells=selected_cells,
+            selected_genes=["gene_3", "gene_4", "gene_3"])
+
+
 
 def test_cpm_after_gene_ds(
         raw_fixture,
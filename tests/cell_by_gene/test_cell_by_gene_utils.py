@@ -1,7 +1,11 @@
+import pytest
+
 import numpy as np
+import scipy.sparse
 
 from cell_type_mapper.cell_by_gene.utils import (
-    convert_to_cpm)
+    convert_to_cpm,
+    convert_to_cpm_csr)
 
 
 def test_convert_to_cpm():
@@ -23,3 +27,62 @@ def test_convert_to_cpm():
             actual[ii, :],
             atol=0.0,
             rtol=1.0e-6)
+
+
+def test_convert_to_cpm_dtype():
+    n_cells = 57
+    n_genes = 41
+    rng = np.random.default_rng(77123)
+    data = rng.integers(0, 500, (n_cells, n_genes))
+    data[5, :] = 0
+    expected = convert_to_cpm(data)
+    assert expected.dtype == np.float64
+
+    actual = convert_to_cpm(data, dtype=np.float32)
+    assert actual.dtype == np.float32
+    assert (actual[5, :] == 0.0).all()
+    np.testing.assert_allclose(
+        expected,
+        actual,
+        atol=0.0,
+        rtol=1.0e-6)
+
+
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+def test_convert_to_cpm_csr(dtype):
+    n_cells = 63
+    n_genes = 29
+    rng = np.random.default_rng(561223)
+    data = rng.integers(0, 500, (n_cells, n_genes))
+    data[rng.random((n_cells, n_genes)) < 0.7] = 0
+    data[4, :] = 0
+    data[n_cells-1, :] = 0
+    expected = convert_to_cpm(data, dtype=dtype)
+
+    csr = scipy.sparse.csr_matrix(data)
+    actual = convert_to_cpm(csr, dtype=dtype)
+    assert scipy.sparse.issparse(actual)
+    assert actual.dtype == dtype
+    np.testing.assert_allclose(
+        expected,
+        actual.toarray(),
+        atol=0.0,
+        rtol=1.0e-6)
+
+    # a slice of rows whose indptr does not start at zero
+    r0 = 10
+    r1 = 40
+    actual = convert_to_cpm_csr(
+        data=csr.data,
+        indptr=csr.indptr[r0:r1+1],
+        dtype=dtype)
+    sub = scipy.sparse.csr_matrix(
+        (actual,
+         csr.indices[csr.indptr[r0]:csr.indptr[r1]],
+         csr.indptr[r0:r1+1]-csr.indptr[r0]),
+        shape=(r1-r0, n_genes))
+    np.testing.assert_allclose(
+        expected[r0:r1, :],
+        sub.toarray(),
+        atol=0.0,
+        rtol=1.0e-6)
@@ -204,9 +204,6 @@ def expected_corr_fixture(
     n_cells = x_data_fixture.shape[0]
     n_clusters = sum_fixture.shape[0]
 
-    expected = np.zeros(
-            (n_cells, n_clusters))
-
     cell_profiles = x_data_fixture[:, matched_genes['query']]
     cell_means = np.mean(cell_profiles, axis=1)
     cell_std = np.std(cell_profiles, axis=1, ddof=0)
@@ -217,20 +214,18 @@ def expected_corr_fixture(
     cluster_means = np.mean(cluster_profiles, axis=1)
     cluster_std = np.std(cluster_profiles, axis=1, ddof=0)
 
-    valid = 0
-    for i_cell in range(n_cells):
-        this_cell = cell_profiles[i_cell, :]
-        for i_cluster in range(n_clusters):
-            this_cluster = cluster_profiles[i_cluster, :]
-            corr = np.mean((this_cell-cell_means[i_cell])
-                          *(this_cluster-cluster_means[i_cluster]))
-            denom = (cluster_std[i_cluster]*cell_std[i_cell])
-            if denom > 0.0:
-                corr = corr/denom
-                valid += 1
-            else:
-                corr = 0.0
-            expected[i_cell, i_cluster] = corr
+    centered_cells = cell_profiles - cell_means[:, None]
+    centered_clusters = cluster_profiles - cluster_means[:, None]
+    expected = np.dot(centered_cells, centered_clusters.T)
+    expected = expected / cell_profiles.shape[1]
+    denom = cell_std[:, None]*cluster_std[None, :]
+    valid_mask = denom > 0.0
+    expected = np.where(
+        valid_mask,
+        expected/np.where(valid_mask, denom, 1.0),
+        0.0)
+    assert expected.shape == (n_cells, n_clusters)
+    valid = valid_mask.sum()
     assert valid > 0
     return expected
 
@@ -27,7 +27,8 @@ from cell_type_mapper.utils.output_utils import (
 from cell_type_mapper.diff_exp.precompute_from_anndata import (
     precompute_summary_stats_from_h5ad,
     precompute_summary_stats_from_h5ad_and_lookup,
-    precompute_summary_stats_from_h5ad_list_and_tree)
+    precompute_summary_stats_from_h5ad_list_and_tree,
+    _divide_chunks_among_workers)
 
 from cell_type_mapper.taxonomy.taxonomy_tree import (
     TaxonomyTree)
@@ -844,3 +845,31 @@ def test_precompute_from_many_h5ad_with_tree(
             ground_truth[cluster]["ge1"])
 
     _clean_up(tmp_dir)
+
+
+def test_divide_chunks_among_workers():
+    chunk_list = [('a', 0, 10), ('a', 10, 20), ('a', 20, 30),
+                  ('b', 0, 10), ('b', 10, 20), ('b', 20, 30)]
+    weight_list = [100, 1, 1, 50, 40, 8]
+    work_load = _divide_chunks_among_workers(
+        chunk_list=chunk_list,
+        weight_list=weight_list,
+        n_workers=2)
+
+    assert len(work_load) == 2
+    lookup = {chunk: w for chunk, w in zip(chunk_list, weight_list)}
+    loads = sorted([sum(lookup[c] for c in w) for w in work_load])
+    assert loads == [100, 100]
+
+    # every chunk is assigned exactly once, in its original order
+    flat = [c for w in work_load for c in w]
+    assert sorted(flat) == sorted(chunk_list)
+    for w in work_load:
+        assert w == sorted(w, key=lambda c: chunk_list.index(c))
+
+    # more workers than chunks: no empty work loads
+    work_load = _divide_chunks_among_workers(
+        chunk_list=chunk_list[:2],
+        weight_list=weight_list[:2],
+        n_workers=5)
+    assert work_load == [[chunk_list[0]], [chunk_list[1]]]
@@ -1,9 +1,13 @@
 import pytest
 
+import h5py
+import json
 import numpy as np
 
 from cell_type_mapper.diff_exp.score_utils import (
-    aggregate_stats)
+    aggregate_stats,
+    aggregate_stats_from_arrays,
+    read_raw_precomputed_stats)
 
 from cell_type_mapper.diff_exp.scores import (
     score_differential_genes,
@@ -11,11 +15,11 @@ from cell_type_mapper.diff_exp.scores import (
     rank_genes)
 
 
-@pytest.fixture
+@pytest.fixture(scope='module')
 def n_genes():
     return 26
 
-@pytest.fixture
+@pytest.fixture(scope='module')
 def leaf_node_fixture():
     """
     List of leaf nodes
@@ -24,7 +28,7 @@ def leaf_node_fixture():
             'e', 'f', 'g', 'h']
 
 
-@pytest.fixture
+@pytest.fixture(scope='module')
 def data_fixture(leaf_node_fixture, n_genes):
     """
     Fixture mapping leaf_node to a simulated
@@ -43,7 +47,7 @@ def data_fixture(leaf_node_fixture, n_genes):
         result[node] = data
     return result
 
-@pytest.fixture
+@pytest.fixture(scope='module')
 def precomputed_stats_fixture(
         leaf_node_fixture,
         data_fixture,
@@ -109,10 +113,100 @@ def test_aggregate_stats(
     assert not np.array_equal(expected_gt1, expected_ge1)
 
 
-def test_score_diff_smoke(
-        data_fixture,
+@pytest.mark.parametrize('skip_keys', [(), ('gt0', 'gt1', 'ge1')])
+def test_aggregate_stats_from_arrays(
         precomputed_stats_fixture,
         leaf_node_fixture,
+        skip_keys):
+    """
+    Test that aggregate_stats_from_arrays gives the same result
+    as aggregate_stats on each population
+    """
+    rng = np.random.default_rng(66123)
+    leaf_to_row = {n: ii for ii, n in enumerate(leaf_node_fixture[::-1])}
+    row_order = sorted(leaf_to_row, key=lambda n: leaf_to_row[n])
+    precomputed_arrays = {
+        k: np.array([precomputed_stats_fixture[n][k] for n in row_order])
+        for k in ('n_cells', 'sum', 'sumsq', 'gt0', 'gt1', 'ge1')
+        if k not in skip_keys}
+
+    stats_lookup = {
+        n: {k: precomputed_stats_fixture[n][k]
+            for k in precomputed_arrays}
+        for n in leaf_node_fixture}
+
+    populations = [
+        list(rng.choice(leaf_node_fixture, n_pop, replace=False))
+        for n_pop in (1, 3, 4, len(leaf_node_fixture))]
+
+    actual = aggregate_stats_from_arrays(
+        leaf_populations=populations,
+        leaf_to_row=leaf_to_row,
+        precomputed_arrays=precomputed_arrays)
+
+    assert len(actual) == len(populations)
+    for pop, actual_stats in zip(populations, actual):
+        expected = aggregate_stats(
+            leaf_population=pop,
+            precomputed_stats=stats_lookup)
+        assert set(actual_stats.keys()) == set(expected.keys())
+        assert actual_stats['n_cells'] == expected['n_cells']
+        np.testing.assert_array_equal(actual_stats['mean'], expected['mean'])
+        np.testing.assert_array_equal(actual_stats['var'], expected['var'])
+        for k in ('gt0', 'gt1', 'ge1'):
+            if expected[k] is None:
+                assert actual_stats[k] is None
+            else:
+                np.testing.assert_array_equal(actual_stats[k], expected[k])
+                assert actual_stats[k].dtype == expected[k].dtype
+
+
+def test_read_raw_precomputed_stats_subset(
+        precomputed_stats_fixture,
+        leaf_node_fixture,
+        tmp_path):
+    """
+    Test that stats_to_read limits the statistics that are read
+    """
+    h5_path = tmp_path / 'precomputed_stats.h5'
+    stat_keys = ('n_cells', 'sum', 'sumsq', 'gt0', 'gt1', 'ge1')
+    with h5py.File(h5_path, 'w') as dst:
+        dst.create_dataset(
+            'col_names',
+            data=json.dumps(
+                [f'g{ii}' for ii in range(len(
+                    precomputed_stats_fixture['a']['sum']))]
+            ).encode('utf-8'))
+        dst.create_dataset(
+            'cluster_to_row',
+            data=json.dumps(
+                {n: ii for ii, n in enumerate(leaf_node_fixture)}
+            ).encode('utf-8'))
+        for k in stat_keys:
+            dst.create_dataset(
+                k,
+                data=np.array([precomputed_stats_fixture[n][k]
+                               for n in leaf_node_fixture]))
+
+    full = read_raw_precomputed_stats(
+        precomputed_stats_path=h5_path)
+    subset = read_raw_precomputed_stats(
+        precomputed_stats_path=h5_path,
+        stats_to_read=('n_cells', 'sum', 'ge1'))
+
+    assert subset['gene_names'] == full['gene_names']
+    for node in leaf_node_fixture:
+        assert set(full['cluster_stats'][node].keys()) == set(stat_keys)
+        assert set(subset['cluster_stats'][node].keys()) == set(
+            ['n_cells', 'sum', 'ge1'])
+        for k in ('n_cells', 'sum', 'ge1'):
+            np.testing.assert_array_equal(
+                subset['cluster_stats'][node][k],
+                full['cluster_stats'][node][k])
+
+
+def test_score_diff_smoke(
+        precomputed_stats_fixture,
         n_genes):
     """
     Just a smoketest to make sure we can run
@@ -188,3 +282,10 @@ def test_rank_genes(
                 scores=scores,
                 validity=validity)
     np.testing.assert_array_equal(expected, actual)
+
+    for n_top in range(1, len(scores)+2):
+        actual = rank_genes(
+                    scores=scores,
+                    validity=validity,
+                    n_top=n_top)
+        np.testing.assert_array_equal(expected[:n_top], actual)
@@ -87,6 +87,23 @@ def taxonomy_tree_dict(n_reference_cells):
     return tree
 
 
+@pytest.fixture(scope='module')
+def taxonomy_tree_json_path(
+        tmp_dir_fixture,
+        taxonomy_tree_dict):
+    """
+    Path to a JSON serialization of taxonomy_tree_dict
+    (written once per module)
+    """
+    tree_path = mkstemp_clean(
+        dir=tmp_dir_fixture,
+        prefix='taxonomy_tree_',
+        suffix='.json')
+    with open(tree_path, 'w') as out_file:
+        out_file.write(json.dumps(taxonomy_tree_dict))
+    return tree_path
+
+
 @pytest.fixture(scope='module')
 def obs_records_fixture(taxonomy_tree_dict):
     cluster_to_subclass = dict()
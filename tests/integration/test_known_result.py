@@ -222,6 +222,7 @@ def test_cli_pipeline(
         raw_query_h5ad_fixture,
         expected_cluster_fixture,
         taxonomy_tree_dict,
+        taxonomy_tree_json_path,
         query_gene_names,
         tmp_dir_fixture,
         use_tree,
@@ -248,10 +249,7 @@ def test_cli_pipeline(
         'normalization': 'raw'}
 
     if use_tree:
-        tree_path = mkstemp_clean(dir=tmp_dir_fixture, suffix='.json')
-        with open(tree_path, 'w') as out_file:
-            out_file.write(json.dumps(taxonomy_tree_dict))
-        config['precomputed_stats']['taxonomy_tree'] = tree_path
+        config['precomputed_stats']['taxonomy_tree'] = taxonomy_tree_json_path
     else:
         config['precomputed_stats']['column_hierarchy'] = taxonomy_tree_dict['hierarchy']
 
@@ -445,6 +443,7 @@ def test_cli_error_log(
         raw_query_h5ad_fixture,
         expected_cluster_fixture,
         taxonomy_tree_dict,
+        taxonomy_tree_json_path,
         query_gene_names,
         tmp_dir_fixture):
     """
@@ -474,10 +473,7 @@ def test_cli_error_log(
         'path': precompute_out,
         'normalization': 'raw'}
 
-    tree_path = mkstemp_clean(dir=tmp_dir_fixture, suffix='.json')
-    with open(tree_path, 'w') as out_file:
-            out_file.write(json.dumps(taxonomy_tree_dict))
-    config['precomputed_stats']['taxonomy_tree'] = tree_path
+    config['precomputed_stats']['taxonomy_tree'] = taxonomy_tree_json_path
 
     config['reference_markers'] = {
         'n_processors': 3,
@@ -63,6 +63,7 @@ def ab_initio_assignment_fixture(
         raw_query_h5ad_fixture,
         expected_cluster_fixture,
         taxonomy_tree_dict,
+        taxonomy_tree_json_path,
         query_gene_names,
         tmp_dir_fixture):
     """
@@ -90,10 +91,7 @@ def ab_initio_assignment_fixture(
         'path': str(precompute_out),
         'normalization': 'raw'}
 
-    tree_path = mkstemp_clean(dir=tmp_dir_fixture, suffix='.json')
-    with open(tree_path, 'w') as out_file:
-        out_file.write(json.dumps(taxonomy_tree_dict))
-    config['precomputed_stats']['taxonomy_tree'] = tree_path
+    config['precomputed_stats']['taxonomy_tree'] = taxonomy_tree_json_path
 
     config['reference_markers'] = {
         'n_processors': 3,
@@ -219,6 +219,22 @@ def test_marker_mask_from_pair_idx(
             arr.down_mask_from_pair_idx(pair_idx=i_col),
             np.logical_and(expected_marker, ~expected_up))
 
+    # batched versions count occurrences over a list of pairs
+    # (repeats allowed)
+    rng = np.random.default_rng(88112)
+    pair_idx_list = rng.integers(0, n_cols, 2*n_cols)
+    expected_up = np.logical_and(is_marker_fixture, up_reg_truth)
+    expected_down = np.logical_and(is_marker_fixture, ~up_reg_truth)
+    np.testing.assert_array_equal(
+        arr.up_mask_from_pair_idx_batch(pair_idx_list),
+        expected_up[:, pair_idx_list].sum(axis=1))
+    np.testing.assert_array_equal(
+        arr.down_mask_from_pair_idx_batch(pair_idx_list),
+        expected_down[:, pair_idx_list].sum(axis=1))
+    np.testing.assert_array_equal(
+        arr.up_mask_from_pair_idx_batch([]),
+        np.zeros(arr.n_genes, dtype=int))
+
 @pytest.mark.parametrize('to_other', [True, False])
 def test_marker_downsample_genes(
         backed_array_fixture,
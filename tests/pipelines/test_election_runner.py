@@ -34,6 +34,9 @@ from cell_type_mapper.taxonomy.utils import (
 from cell_type_mapper.diff_exp.scores import (
     diffexp_score)
 
+from cell_type_mapper.diff_exp.score_utils import (
+    read_precomputed_stats)
+
 from cell_type_mapper.diff_exp.markers import (
     find_markers_for_all_taxonomy_pairs)
 
@@ -1027,3 +1030,54 @@ def test_running_h5ad_election_negative_expression(
         bootstrap_iteration=bootstrap_iteration,
         rng=rng,
         normalization='log2CPM')
+
+
+def test_get_leaf_means(
+        precompute_stats_path_fixture,
+        taxonomy_tree_fixture):
+    """
+    Check that get_leaf_means agrees with the leaf-level
+    means aggregated by read_precomputed_stats
+    """
+    taxonomy_tree = taxonomy_tree_fixture[0]
+    leaf_matrix = get_leaf_means(
+        taxonomy_tree=taxonomy_tree,
+        precompute_path=precompute_stats_path_fixture)
+
+    expected = read_precomputed_stats(
+        precomputed_stats_path=precompute_stats_path_fixture,
+        taxonomy_tree=taxonomy_tree,
+        for_marker_selection=True)
+
+    leaf_names = taxonomy_tree.all_leaves
+    leaf_names.sort()
+    assert leaf_matrix.cell_identifiers == leaf_names
+    assert leaf_matrix.gene_identifiers == expected['gene_names']
+    assert leaf_matrix.normalization == 'log2CPM'
+    for i_leaf, leaf in enumerate(leaf_names):
+        leaf_key = f'{taxonomy_tree.leaf_level}/{leaf}'
+        np.testing.assert_allclose(
+            leaf_matrix.data[i_leaf, :],
+            expected['cluster_stats'][leaf_key]['mean'],
+            atol=0.0,
+            rtol=1.0e-10)
+
+    # check that selected_genes keeps only the requested genes
+    # in the requested order
+    rng = np.random.default_rng(2231)
+    selected_genes = list(rng.choice(
+        expected['gene_names'], 7, replace=False))
+    ds_matrix = get_leaf_means(
+        taxonomy_tree=taxonomy_tree,
+        precompute_path=precompute_stats_path_fixture,
+        selected_genes=selected_genes)
+    assert ds_matrix.gene_identifiers == selected_genes
+    np.testing.assert_array_equal(
+        ds_matrix.data,
+        leaf_matrix.downsample_genes(selected_genes).data)
+
+    with pytest.raises(RuntimeError, match="not in"):
+        get_leaf_means(
+            taxonomy_tree=taxonomy_tree,
+            precompute_path=precompute_stats_path_fixture,
+            selected_genes=['not_a_gene'])
@@ -3,6 +3,7 @@ import copy
 import numpy as np
 import json
 import itertools
+import pickle
 
 from cell_type_mapper.taxonomy.utils import (
     get_taxonomy_tree)
@@ -26,6 +27,14 @@ def test_tree_as_leaves(
             assert set(actual) == expected
             assert len(set(actual)) == len(actual)
 
+    # modifying the result must not modify the tree
+    h = column_hierarchy[0]
+    this_node = list(parent_to_leaves[h].keys())[0]
+    as_leaves[h][this_node].append('nonsense')
+    as_leaves.pop(h)
+    fresh = taxonomy_tree_fixture.as_leaves
+    assert set(fresh[h][this_node]) == parent_to_leaves[h][this_node]
+
 
 def test_tree_get_all_pairs(
         records_fixture,
@@ -129,6 +138,51 @@ def test_tree_get_all_leaf_pairs():
     actual = taxonomy_tree.leaves_to_compare(parent_node)
     assert actual == []
 
+    # check that memoized results are returned as copies that
+    # callers can modify without corrupting the tree
+    parent_node = ('level2', 'l2b')
+    first = taxonomy_tree.leaves_to_compare(parent_node)
+    first.pop()
+    second = taxonomy_tree.leaves_to_compare(list(parent_node))
+    assert len(second) == len(first) + 1
+    assert set(second) == set(
+        [('leaf', pair[0], pair[1])
+         for pair in itertools.product(['0', '1', '2'], ['7', '8'])])
+
+    leaves = taxonomy_tree.all_leaves
+    leaves.sort(reverse=True)
+    leaves.pop()
+    assert taxonomy_tree.all_leaves == [str(k) for k in range(24)]
+    assert taxonomy_tree.n_leaves == 24
+
+    parents = taxonomy_tree.all_parents
+    parents.append(('level1', 'nonsense'))
+    assert ('level1', 'nonsense') not in taxonomy_tree.all_parents
+
+    # check leaf_to_child
+    actual = taxonomy_tree.leaf_to_child(('level2', 'l2b'))
+    assert dict(actual) == {'0': 'l3a', '1': 'l3a', '2': 'l3a',
+                            '7': 'l3c', '8': 'l3c'}
+    assert taxonomy_tree.leaf_to_child(['level2', 'l2b']) is actual
+    with pytest.raises(TypeError):
+        actual['0'] = 'l3c'
+
+    actual = taxonomy_tree.leaf_to_child(None)
+    expected = {leaf: 'l1a' for leaf in candidates0}
+    expected.update({leaf: 'l1b' for leaf in candidates1})
+    expected.update({leaf: 'l1c' for leaf in candidates2})
+    assert dict(actual) == expected
+    assert list(actual) == sorted(expected)
+
+    # check that a tree with memoized results can still be
+    # pickled and copied (e.g. to pass it to worker processes)
+    for other in (pickle.loads(pickle.dumps(taxonomy_tree)),
+                  copy.deepcopy(taxonomy_tree)):
+        assert other == taxonomy_tree
+        assert dict(other.leaf_to_child(None)) == expected
+        assert (other.leaves_to_compare(('level2', 'l2b'))
+                == taxonomy_tree.leaves_to_compare(('level2', 'l2b')))
+
 
 def test_tree_eq():
     """
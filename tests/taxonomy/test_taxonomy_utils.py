@@ -2,12 +2,14 @@ import pytest
 import copy
 import numpy as np
 import json
+import pandas as pd
 import itertools
 
 from cell_type_mapper.utils.utils import clean_for_json
 
 from cell_type_mapper.taxonomy.utils import (
     get_taxonomy_tree,
+    get_taxonomy_tree_from_obs,
     _get_rows_from_tree,
     compute_row_order,
     _get_leaves_from_tree,
@@ -329,6 +331,14 @@ def test_get_all_leaf_pairs():
                 expected.append(('leaf', pair[1], pair[0]))
     assert set(actual) == set(expected)
 
+    # check that passing in a precomputed tree_as_leaves
+    # gives the same result
+    actual = get_all_leaf_pairs(
+                taxonomy_tree=tree,
+                parent_node=parent_node,
+                tree_as_leaves=convert_tree_to_leaves(tree))
+    assert set(actual) == set(expected)
+
     # check case when there are no pairs to compare
     parent_node = ('level1', 'l1c')
     actual = get_all_leaf_pairs(
@@ -342,6 +352,43 @@ def test_get_all_leaf_pairs():
     assert actual == []
 
 
+@pytest.mark.parametrize('use_categorical', [True, False])
+def test_get_taxonomy_tree_from_obs(
+        records_fixture,
+        column_hierarchy,
+        use_categorical):
+
+    obs = pd.DataFrame(records_fixture)
+    if use_categorical:
+        for col in column_hierarchy:
+            obs[col] = obs[col].astype('category')
+
+    expected = get_taxonomy_tree(
+        obs_records=copy.deepcopy(records_fixture),
+        column_hierarchy=column_hierarchy)
+
+    actual = get_taxonomy_tree_from_obs(
+        obs=obs,
+        column_hierarchy=column_hierarchy)
+
+    assert actual == expected
+    for level in column_hierarchy:
+        assert list(actual[level].keys()) == list(expected[level].keys())
+
+    # non-string columns are cast to str just as in get_taxonomy_tree
+    obs['garbage'] = obs['garbage'].astype(float)
+    obs.loc[obs.index[3], 'garbage'] = np.nan
+    expected = get_taxonomy_tree(
+        obs_records=obs.to_dict(orient='records'),
+        column_hierarchy=['garbage'])
+
+    actual = get_taxonomy_tree_from_obs(
+        obs=obs,
+        column_hierarchy=['garbage'])
+    assert actual == expected
+    assert 'nan' in actual['garbage']
+
+
 def test_get_taxonomy_tree_errors():
     """
     Test that, in case where a child appears to have multiple parents
@@ -358,6 +405,11 @@ def test_get_taxonomy_tree_errors():
             obs_records=obs_records,
             column_hierarchy=['l1', 'l2', 'l3'])
 
+    with pytest.raises(RuntimeError, match='ccc has at least two parents'):
+        get_taxonomy_tree_from_obs(
+            obs=pd.DataFrame(obs_records),
+            column_hierarchy=['l1', 'l2', 'l3'])
+
 
 def test_validate_taxonomy_tree():
 
@@ -14,6 +14,7 @@ from cell_type_mapper.taxonomy.utils import (
     convert_tree_to_leaves)
 
 from cell_type_mapper.type_assignment.matching import (
+    _read_marker_cache,
     assemble_query_data)
 
 from cell_type_mapper.taxonomy.taxonomy_tree import (
@@ -108,6 +109,7 @@ def raw_mean_matrix_fixture(mean_lookup_fixture, n_genes, marker_fixture):
      (('subclass', 'cc'), 3, ['0', '5', '6'], ['0', '5', '6']),
      (('class', 'B'), 6, ['aa', 'aa', 'aa', 'ee', 'dd', 'ee'], ['1', '3', '4', '8', '7', '9'])
     ])
+@pytest.mark.parametrize("dtype", [None, np.float32])
 def test_assemble_query_data(
         tree_fixture,
         marker_fixture,
@@ -119,6 +121,7 @@ def test_assemble_query_data(
         expected_n_reference,
         expected_types,
         expected_clusters,
+        dtype,
         tmp_dir_fixture):
 
     tmp_dir = tmp_dir_fixture
@@ -171,7 +174,17 @@ def test_assemble_query_data(
             mean_profile_matrix=mean_matrix_fixture,
             taxonomy_tree=TaxonomyTree(data=tree_fixture),
             marker_cache_path=marker_cache_path,
-            parent_node=parent_node)
+            parent_node=parent_node,
+            dtype=dtype)
+
+    if dtype is None:
+        expected_dtype = full_query_data.dtype
+        cast = float
+    else:
+        expected_dtype = dtype
+        cast = dtype
+    assert actual['query_data'].data.dtype == expected_dtype
+    assert actual['reference_data'].data.dtype == expected_dtype
 
     assert actual['query_data'].n_cells == n_query
     assert actual['query_data'].n_genes == n_markers
@@ -179,7 +192,7 @@ def test_assemble_query_data(
     for ii in range(n_query):
         for jj in range(n_markers):
             jj_o = marker_fixture['query'][jj]
-            assert actual['query_data'].data[ii, jj] == full_query_data[ii, jj_o]
+            assert actual['query_data'].data[ii, jj] == cast(full_query_data[ii, jj_o])
 
     assert actual['reference_types'] == expected_types
     assert actual['reference_data'].n_cells == expected_n_reference
@@ -190,7 +203,7 @@ def test_assemble_query_data(
     for ii, ref in enumerate(cluster_list):
         for jj in range(n_markers):
             jj_o = marker_fixture['reference'][jj]
-            assert actual['reference_data'].data[ii, jj] == mean_lookup_fixture[ref][jj_o]
+            assert actual['reference_data'].data[ii, jj] == cast(mean_lookup_fixture[ref][jj_o])
 
 
 def test_assemble_query_data_errors(
@@ -270,3 +283,48 @@ def test_assemble_query_data_errors(
             taxonomy_tree=TaxonomyTree(data=tree_fixture),
             marker_cache_path=marker_cache_path,
             parent_node=parent_node)
+
+
+def test_read_marker_cache(tmp_dir_fixture):
+    """
+    Test that the memoized contents of a marker cache are
+    refreshed when the file is rewritten at the same path,
+    are shared between str and pathlib.Path keys, and are
+    read-only
+    """
+    marker_cache_path = mkstemp_clean(
+        dir=tmp_dir_fixture,
+        suffix='.h5')
+
+    for ct in range(2):
+        with h5py.File(marker_cache_path, 'w') as out_file:
+            out_file.create_dataset(
+                'None/reference', data=np.arange(3+ct))
+            out_file.create_dataset(
+                'None/query', data=np.arange(4+ct))
+            out_file.create_dataset(
+                'class/a/reference', data=np.arange(ct, 5))
+            out_file.create_dataset(
+                'class/a/query', data=np.arange(ct, 6))
+            for k in ('reference_gene_names', 'query_gene_names'):
+                out_file.create_dataset(
+                    k,
+                    data=json.dumps([f'{k}_{ct}']).encode('utf-8'))
+
+        actual = _read_marker_cache(marker_cache_path)
+        assert _read_marker_cache(marker_cache_path) is actual
+        assert _read_marker_cache(pathlib.Path(marker_cache_path)) is actual
+        assert actual['groups'] == set(['None', 'class', 'class/a'])
+        np.testing.assert_array_equal(
+            actual['datasets']['None/reference'], np.arange(3+ct))
+        np.testing.assert_array_equal(
+            actual['datasets']['None/query'], np.arange(4+ct))
+        np.testing.assert_array_equal(
+            actual['datasets']['class/a/reference'], np.arange(ct, 5))
+        np.testing.assert_array_equal(
+            actual['datasets']['class/a/query'], np.arange(ct, 6))
+        assert actual['reference_gene_names'] == [
+            f'reference_gene_names_{ct}']
+        assert actual['query_gene_names'] == [f'query_gene_names_{ct}']
+        for arr in actual['datasets'].values():
+            assert not arr.flags.writeable
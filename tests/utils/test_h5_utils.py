@@ -12,7 +12,8 @@ from cell_type_mapper.utils.utils import (
     mkstemp_clean)
 
 from cell_type_mapper.utils.h5_utils import (
-    copy_h5_excluding_data)
+    copy_h5_excluding_data,
+    iter_allocated_chunks)
 
 
 @pytest.fixture(scope='module')
@@ -292,3 +293,29 @@ def test_h5_copy_util_on_h5ad(
     else:
         dst_uns = dst_a_data.uns
         assert dst_uns == dict()
+
+
+def test_iter_allocated_chunks(tmp_dir_fixture):
+    h5_path = mkstemp_clean(dir=tmp_dir_fixture, suffix='.h5')
+    expected = np.zeros((10, 11), dtype=float)
+    with h5py.File(h5_path, 'w') as dst:
+        dataset = dst.create_dataset(
+            'x', shape=expected.shape, chunks=(3, 4), dtype=float)
+        # write the chunks out of logical order; leave some unwritten
+        for (r0, c0) in ((9, 8), (0, 4), (6, 0)):
+            block = np.arange(12, dtype=float)[:3*4].reshape(3, 4)+r0+c0
+            block = block[:expected.shape[0]-r0, :expected.shape[1]-c0]
+            dataset[r0:r0+3, c0:c0+4] = block
+            expected[r0:r0+3, c0:c0+4] = block
+
+    with h5py.File(h5_path, 'r') as src:
+        dataset = src['x']
+        chunk_list = list(iter_allocated_chunks(dataset))
+        actual = np.zeros(expected.shape, dtype=float)
+        for chunk_slice in chunk_list:
+            actual[chunk_slice] = dataset[chunk_slice]
+
+    if hasattr(dataset.id, 'chunk_iter'):
+        assert len(chunk_list) == 3
+        assert (slice(9, 10), slice(8, 11)) in chunk_list
+    np.testing.assert_array_equal(actual, expected)
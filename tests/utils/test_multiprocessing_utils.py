@@ -3,6 +3,7 @@ import pytest
 import multiprocessing
 
 from cell_type_mapper.utils.multiprocessing_utils import (
+    prefetch_iterator,
     winnow_process_list,
     winnow_process_dict)
 
@@ -71,3 +72,29 @@ def test_winnow_process_dict():
         process_dict[4] = p
         while len(process_dict) > 0:
             process_dict = winnow_process_dict(process_dict)
+
+
+@pytest.mark.parametrize('n_prefetch', [1, 3])
+def test_prefetch_iterator(n_prefetch):
+
+    actual = list(prefetch_iterator(range(17), n_prefetch=n_prefetch))
+    assert actual == list(range(17))
+
+    assert list(prefetch_iterator([], n_prefetch=n_prefetch)) == []
+
+    def bad_generator():
+        yield 1
+        yield 2
+        raise RuntimeError("reading failed")
+
+    actual = []
+    with pytest.raises(RuntimeError, match="reading failed"):
+        for item in prefetch_iterator(bad_generator(),
+                                      n_prefetch=n_prefetch):
+            actual.append(item)
+    assert actual == [1, 2]
+
+    # abandoning the iteration early must not hang
+    iterator = prefetch_iterator(range(1000), n_prefetch=n_prefetch)
+    assert next(iterator) == 0
+    iterator.close()
@@ -176,6 +176,19 @@ def test_load_csr_chunk(tmp_dir_fixture):
                 subset,
                 data[r0:r1, c0:c1])
 
+        # column bands that contain every element of the rows
+        for r0, r1 in ((0, 200), (13, 71)):
+            subset = load_csr_chunk(
+                row_spec=(r0, r1),
+                col_spec=(0, data.shape[1]),
+                data=src['X/data'],
+                indices=src['X/indices'],
+                indptr=src['X/indptr'])
+
+            np.testing.assert_array_equal(
+                subset,
+                data[r0:r1, :])
+
     _clean_up(tmp_path)
 
 
@@ -299,7 +312,10 @@ def test_merge_csr_block_zeros(zero_block):
 
 
 
-def test_load_disjoint_csr(tmp_dir_fixture):
+@pytest.mark.parametrize(
+    "max_gap_nnz,shuffle",
+    product([0, 100, 2**15], [True, False]))
+def test_load_disjoint_csr(tmp_dir_fixture, max_gap_nnz, shuffle):
     nrows = 200
     ncols = 300
 
@@ -322,7 +338,8 @@ def test_load_disjoint_csr(tmp_dir_fixture):
 
     index_list = np.unique(rng.integers(0, nrows, 45))
 
-    rng.shuffle(index_list)
+    if shuffle:
+        rng.shuffle(index_list)
     expected = np.zeros((len(index_list), ncols), dtype=int)
 
     for ct, ii in enumerate(index_list):
@@ -335,7 +352,8 @@ def test_load_disjoint_csr(tmp_dir_fixture):
                              row_index_list=index_list,
                              data=src['X/data'],
                              indices=src['X/indices'],
-                             indptr=src['X/indptr'])
+                             indptr=src['X/indptr'],
+                             max_gap_nnz=max_gap_nnz)
 
     actual = scipy_sparse.csr_matrix(
                 (chunk_data, chunk_indices, chunk_indptr),
@@ -348,6 +366,60 @@ def test_load_disjoint_csr(tmp_dir_fixture):
     _clean_up(tmp_path)
 
 
+@pytest.mark.parametrize("max_gap_nnz", [0, 100, 2**15])
+def test_load_disjoint_csr_repeated_rows(tmp_dir_fixture, max_gap_nnz):
+    """
+    Test that _load_disjoint_csr returns the right rows in the
+    right order when some rows are requested more than once
+    """
+    nrows = 150
+    ncols = 211
+
+    tmp_path = mkstemp_clean(
+        dir=tmp_dir_fixture, suffix='.h5ad')
+
+    rng = np.random.default_rng(5512)
+
+    data = np.zeros(nrows*ncols, dtype=float)
+    chosen_dex = rng.choice(np.arange(len(data)),
+                            len(data)//4,
+                            replace=False)
+
+    data[chosen_dex] = rng.random(len(chosen_dex))
+    data = data.reshape((nrows, ncols))
+    data[17, :] = 0.0
+
+    csr = scipy_sparse.csr_matrix(data)
+    ann = anndata.AnnData(csr)
+    ann.write_h5ad(tmp_path)
+
+    index_list = [88, 17, 3, 4, 5, 88, 149, 17, 6, 0, 3]
+    expected = data[index_list, :]
+
+    with h5py.File(tmp_path, 'r') as src:
+        (chunk_data,
+         chunk_indices,
+         chunk_indptr) = _load_disjoint_csr(
+                             row_index_list=index_list,
+                             data=src['X/data'],
+                             indices=src['X/indices'],
+                             indptr=src['X/indptr'],
+                             max_gap_nnz=max_gap_nnz)
+        indices_dtype = src['X/indices'].dtype
+
+    # indices keep their on-disk dtype; indptr is downcast
+    assert chunk_indices.dtype == indices_dtype
+    assert chunk_indptr.dtype == np.int32
+
+    actual = scipy_sparse.csr_matrix(
+                (chunk_data, chunk_indices, chunk_indptr),
+                shape=(len(index_list), ncols)).toarray()
+
+    np.testing.assert_allclose(actual, expected, atol=0.0, rtol=1.0e-7)
+
+    _clean_up(tmp_path)
+
+
 def test_precompute_indptr():
     rng = np.random.default_rng(87123331)
     nrows = 112
@@ -1,7 +1,13 @@
+import pytest
+
 import numpy as np
+import scipy.sparse
 
 from cell_type_mapper.utils.stats_utils import (
     summary_stats_for_chunk,
+    summary_stats_for_clusters,
+    summary_stats_for_clusters_csr,
+    _summary_stats_by_segment,
     welch_t_test)
 
 from cell_type_mapper.cell_by_gene.utils import (
@@ -78,6 +84,142 @@ def test_summary_stats_for_chunk():
     assert not np.array_equal(actual['ge1'], actual['gt1'])
 
 
+@pytest.mark.parametrize(
+    "min_rows_per_segment,sort_rows",
+    [(1, False), (1, True), (1000000, False)])
+def test_summary_stats_for_clusters(min_rows_per_segment, sort_rows):
+    rng = np.random.default_rng(66123)
+    nrows = 200
+    ncols = 47
+    n_clusters = 7
+    raw_data = rng.integers(0, 20, (nrows, ncols))
+    raw_data[rng.random((nrows, ncols)) < 0.6] = 0
+    cluster_idx = rng.integers(0, n_clusters, nrows)
+
+    # one cluster with no cells
+    cluster_idx[cluster_idx == 4] = 3
+    if sort_rows:
+        cluster_idx = np.sort(cluster_idx)
+
+    def make_matrix(data):
+        cell_x_gene = CellByGeneMatrix(
+            data=data,
+            gene_identifiers=[f"{ii}" for ii in range(ncols)],
+            normalization="raw")
+        cell_x_gene.to_log2CPM_in_place()
+        return cell_x_gene
+
+    actual = summary_stats_for_clusters(
+        cell_x_gene=make_matrix(raw_data),
+        cluster_idx=cluster_idx,
+        n_clusters=n_clusters,
+        min_rows_per_segment=min_rows_per_segment)
+
+    for i_cluster in range(n_clusters):
+        in_cluster = (cluster_idx == i_cluster)
+        assert actual['n_cells'][i_cluster] == in_cluster.sum()
+        if i_cluster == 4:
+            for k in ('sum', 'sumsq', 'gt0', 'gt1', 'ge1'):
+                assert (actual[k][i_cluster, :] == 0).all()
+            continue
+        expected = summary_stats_for_chunk(
+            make_matrix(raw_data[in_cluster, :]))
+        for k in ('sum', 'sumsq'):
+            np.testing.assert_allclose(
+                actual[k][i_cluster, :],
+                expected[k],
+                atol=0.0,
+                rtol=1.0e-10)
+        for k in ('gt0', 'gt1', 'ge1'):
+            np.testing.assert_array_equal(
+                actual[k][i_cluster, :],
+                expected[k])
+
+
+def test_summary_stats_by_segment_tiling():
+    """
+    Test that reducing segments a few rows at a time gives the
+    same result as reducing them all at once
+    """
+    rng = np.random.default_rng(22131)
+    nrows = 101
+    ncols = 13
+    data = rng.random((nrows, ncols))*3.0
+    data[rng.random((nrows, ncols)) < 0.5] = 0.0
+    cluster_idx = rng.integers(0, 4, nrows)
+    n_cells = np.bincount(cluster_idx, minlength=4)
+
+    expected = _summary_stats_by_segment(
+        data=data,
+        cluster_idx=cluster_idx,
+        n_cells=n_cells)
+
+    # three rows per band
+    actual = _summary_stats_by_segment(
+        data=data,
+        cluster_idx=cluster_idx,
+        n_cells=n_cells,
+        tile_bytes=3*ncols*8)
+
+    for k in ('sum', 'sumsq'):
+        np.testing.assert_allclose(
+            actual[k], expected[k], atol=0.0, rtol=1.0e-10)
+    for k in ('gt0', 'gt1', 'ge1'):
+        np.testing.assert_array_equal(actual[k], expected[k])
+
+
+@pytest.mark.parametrize('normalization', ['raw', 'log2CPM'])
+def test_summary_stats_for_clusters_csr(normalization):
+    """
+    Test that reducing a CSR matrix gives the same result as
+    reducing the equivalent dense matrix
+    """
+    rng = np.random.default_rng(871231)
+    nrows = 150
+    ncols = 31
+    n_clusters = 6
+    raw_data = rng.integers(0, 20, (nrows, ncols))
+    raw_data[rng.random((nrows, ncols)) < 0.7] = 0
+    cluster_idx = rng.integers(0, n_clusters, nrows)
+
+    # one cluster with no cells
+    cluster_idx[cluster_idx == 2] = 1
+
+    cell_x_gene = CellByGeneMatrix(
+        data=raw_data,
+        gene_identifiers=[f"{ii}" for ii in range(ncols)],
+        normalization="raw")
+    cell_x_gene.to_log2CPM_in_place()
+
+    expected = summary_stats_for_clusters(
+        cell_x_gene=cell_x_gene,
+        cluster_idx=cluster_idx,
+        n_clusters=n_clusters)
+
+    if normalization == 'raw':
+        csr_data = scipy.sparse.csr_matrix(raw_data)
+    else:
+        csr_data = scipy.sparse.csr_matrix(cell_x_gene.data)
+    csr_input = csr_data.copy()
+
+    actual = summary_stats_for_clusters_csr(
+        csr_data=csr_data,
+        cluster_idx=cluster_idx,
+        n_clusters=n_clusters,
+        normalization=normalization)
+
+    # input must not be modified
+    np.testing.assert_array_equal(csr_data.data, csr_input.data)
+
+    assert set(actual.keys()) == set(expected.keys())
+    np.testing.assert_array_equal(actual['n_cells'], expected['n_cells'])
+    for k in ('sum', 'sumsq'):
+        np.testing.assert_allclose(
+            actual[k], expected[k], atol=1.0e-12, rtol=1.0e-10)
+    for k in ('gt0', 'gt1', 'ge1'):
+        np.testing.assert_array_equal(actual[k], expected[k])
+
+
 def test_welch_t_test():
     """
     Just tests that calling it on numpy arrays works
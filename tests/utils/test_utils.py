@@ -5,6 +5,7 @@ import numpy as np
 
 from cell_type_mapper.utils.utils import (
     merge_index_list,
+    merge_index_array,
     choose_int_dtype,
     clean_for_uns_serialization,
     clean_for_uns_deserialization,
@@ -21,6 +22,10 @@ def test_merge_index_list(input_list, expected):
     actual = merge_index_list(input_list)
     assert actual == expected
 
+    actual = merge_index_array(input_list)
+    assert actual.shape == (len(expected), 2)
+    np.testing.assert_array_equal(actual, np.array(expected))
+
 
 @pytest.mark.parametrize(
         "output_dtype",